@@ -0,0 +1,4 @@
+"""Benchmarks for the api and ETL, run against synthetic datasets generated
+from a seed, so that runs made at different commits can be compared. See
+benchmarks/README.md.
+"""
@@ -0,0 +1,172 @@
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from sqlalchemy.exc import IntegrityError
+
+from plenario.database import postgres_engine, postgres_session, redshift_base, redshift_engine
+from plenario.etl.common import add_unique_hash
+from plenario.etl.point import PlenarioETL
+from plenario.models import MetaTable, ShapeMetadata
+from plenario.models.SensorNetwork import FeatureMeta, NetworkMeta, NodeMeta, SensorMeta
+
+
+# Everything is generated inside of this box around Chicago, and within the
+# year starting at EPOCH
+BBOX = (-87.94, 41.64, -87.52, 42.02)
+EPOCH = datetime(2016, 1, 1)
+CATEGORIES = ['THEFT', 'BATTERY', 'NARCOTICS', 'ASSAULT', 'BURGLARY', 'ROBBERY', 'FRAUD', 'ARSON']
+
+POINT_DATASET = 'bench_points'
+SHAPE_DATASET = 'Bench Grid'
+NETWORK = 'bench_network'
+FEATURE = 'temperature'
+
+
+def write_points_csv(path: str, rows: int, seed: int) -> None:
+    """Write a csv of rows point observations. The same seed always gives the
+    same file.
+    """
+    rng = random.Random(seed)
+    west, south, east, north = BBOX
+    seconds = 365 * 24 * 60 * 60
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'date', 'latitude', 'longitude', 'category', 'value'])
+        for i in range(rows):
+            writer.writerow([
+                i,
+                (EPOCH + timedelta(seconds=rng.randrange(seconds))).isoformat(),
+                round(rng.uniform(south, north), 6),
+                round(rng.uniform(west, east), 6),
+                rng.choice(CATEGORIES),
+                rng.randint(0, 1000)
+            ])
+
+
+def load_points(workdir: str, rows: int, seed: int) -> float:
+    """Generate a point dataset and ingest it with PlenarioETL.add, the way a
+    submitted dataset is.
+
+    :returns: (float) seconds taken by PlenarioETL.add
+    """
+    path = os.path.join(workdir, POINT_DATASET + '.csv')
+    write_points_csv(path, rows, seed)
+
+    drop_points()
+    meta = MetaTable(
+        dataset_name=POINT_DATASET,
+        url='file://' + path,
+        human_name='Bench Points',
+        business_key='id',
+        observed_date='date',
+        latitude='latitude',
+        longitude='longitude',
+        approved_status='true',
+        update_freq='yearly',
+        attribution='plenario benchmarks',
+        description='Synthetic point observations.',
+        column_names={'id': 'INTEGER', 'date': 'TIMESTAMP', 'latitude': 'DOUBLE PRECISION',
+                      'longitude': 'DOUBLE PRECISION', 'category': 'VARCHAR', 'value': 'INTEGER'}
+    )
+    postgres_session.add(meta)
+    postgres_session.commit()
+
+    start = perf_counter()
+    PlenarioETL(meta, source_path=path).add()
+    elapsed = perf_counter() - start
+    postgres_session.commit()
+    return elapsed
+
+
+def drop_points() -> None:
+    postgres_session.query(MetaTable).filter(MetaTable.dataset_name == POINT_DATASET).delete()
+    postgres_session.commit()
+    postgres_engine.execute('DROP TABLE IF EXISTS {}'.format(POINT_DATASET))
+    postgres_engine.execute('DROP TABLE IF EXISTS {}__daily'.format(POINT_DATASET))
+
+
+def load_shapes(cells: int, seed: int) -> None:
+    """Create a shapeset of about cells jittered polygons tiling BBOX, in the
+    same layout ogr2ogr gives imported shapefiles.
+    """
+    table_name = ShapeMetadata.make_table_name(SHAPE_DATASET)
+    side = max(int(cells ** 0.5), 1)
+    west, south, east, north = BBOX
+    width, height = (east - west) / side, (north - south) / side
+
+    postgres_session.query(ShapeMetadata).filter(ShapeMetadata.dataset_name == table_name).delete()
+    postgres_session.commit()
+    postgres_engine.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+    postgres_engine.execute('''
+        CREATE TABLE {t} AS
+        SELECT row_number() OVER () AS ogc_fid,
+               'cell ' || x || ',' || y AS name,
+               ST_Multi(ST_MakeEnvelope(
+                   {west} + x * {width}, {south} + y * {height},
+                   {west} + (x + 1) * {width} + random() * {width} / 10,
+                   {south} + (y + 1) * {height} + random() * {height} / 10,
+                   4326)) AS geom
+        FROM (SELECT setseed({seed})) AS seeded,
+             generate_series(0, {last}) AS x,
+             generate_series(0, {last}) AS y;
+        CREATE INDEX ON {t} USING gist (geom);
+    '''.format(t=table_name, west=west, south=south, width=width, height=height,
+               seed=_pg_seed(seed), last=side - 1))
+    add_unique_hash(table_name)
+
+    meta = ShapeMetadata.add(human_name=SHAPE_DATASET, source_url=None,
+                             update_freq='yearly', approved_status=True)
+    meta.update_after_ingest()
+    postgres_session.commit()
+
+
+def load_sensor_network(nodes: int, rows: int, seed: int) -> None:
+    """Register a sensor network of nodes nodes reporting one feature, and
+    fill its feature table with rows observations.
+    """
+    sensor = SensorMeta(name='bench_sensor', observed_properties={'temperature': FEATURE + '.temperature'})
+    node_metas = [
+        NodeMeta(id='bench_node_{}'.format(i), sensor_network=NETWORK, sensors=[sensor],
+                 location='SRID=4326;POINT({} {})'.format(*_node_location(i, seed)))
+        for i in range(nodes)
+    ]
+    network = NetworkMeta(name=NETWORK, nodes=node_metas)
+    feature = FeatureMeta(name=FEATURE, networks=[network],
+                          observed_properties=[{'type': 'float', 'name': 'temperature'}])
+
+    for obj in [sensor, network, feature] + node_metas:
+        try:
+            postgres_session.add(obj)
+            postgres_session.commit()
+        except IntegrityError:
+            # Left over from an earlier run
+            postgres_session.rollback()
+
+    table_name = '{}__{}'.format(NETWORK, FEATURE)
+    redshift_engine.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+    if table_name in redshift_base.metadata.tables:
+        redshift_base.metadata.remove(redshift_base.metadata.tables[table_name])
+    feature._mirror(NETWORK)
+    redshift_engine.execute('''
+        INSERT INTO {t} (node_id, datetime, meta_id, sensor, temperature)
+        SELECT 'bench_node_' || (i % {nodes}),
+               '{epoch}'::timestamp + (i * interval '{step} seconds'),
+               1, 'bench_sensor', 20 + random() * 10
+        FROM (SELECT setseed({seed})) AS seeded, generate_series(0, {last}) AS i
+    '''.format(t=table_name, nodes=nodes, epoch=EPOCH.isoformat(), step=max(365 * 24 * 60 * 60 // rows, 1),
+               seed=_pg_seed(seed), last=rows - 1))
+
+
+def _node_location(i, seed):
+    rng = random.Random(seed + i)
+    west, south, east, north = BBOX
+    return rng.uniform(west, east), rng.uniform(south, north)
+
+
+def _pg_seed(seed):
+    # Postgres takes seeds between -1 and 1
+    return (seed % 1000) / 1000
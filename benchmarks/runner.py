@@ -0,0 +1,140 @@
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from logging import getLogger
+
+from plenario.api import cost
+
+from benchmarks import datasets
+from benchmarks.scenarios import SCENARIOS, run_etl, run_request
+
+
+logger = getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Dataset sizes for each scale, sensor rows are spread over a year
+SCALES = {
+    'small': {'points': 100 * 1000, 'shapes': 100, 'nodes': 10, 'observations': 100 * 1000},
+    'medium': {'points': 1000 * 1000, 'shapes': 1000, 'nodes': 50, 'observations': 1000 * 1000},
+    'large': {'points': 5 * 1000 * 1000, 'shapes': 5000, 'nodes': 200, 'observations': 5 * 1000 * 1000},
+}
+
+
+def load(scale: str, seed: int, workdir: str) -> float:
+    """Generate and load every dataset the scenarios use.
+
+    :returns: (float) seconds taken by PlenarioETL.add for the point dataset
+    """
+    sizes = SCALES[scale]
+    logger.info('Loading {} datasets (seed {}).'.format(scale, seed))
+    etl_seconds = datasets.load_points(workdir, sizes['points'], seed)
+    datasets.load_shapes(sizes['shapes'], seed)
+    datasets.load_sensor_network(sizes['nodes'], sizes['observations'], seed)
+    return etl_seconds
+
+
+def run(app, scale='small', seed=0, repeat=5, only=None, skip_load=False, etl_repeat=1) -> dict:
+    """Time every scenario repeat times against datasets of the given scale,
+    and save the results.
+
+    :param app: flask app to make the requests to
+    :param only: names of the scenarios to run, all of them if not given
+    :param skip_load: reuse the datasets of an earlier run of the same scale
+    :param etl_repeat: times to reload the point dataset to time the ETL
+    :returns: (dict) the results, as saved
+    """
+    # Expensive requests would be turned into jobs or refused, and timed out
+    # statements would cut the work short, neither of which is being measured.
+    cost.QUERY_COST_JOB = cost.QUERY_COST_REJECT = 0
+    app.config['STATEMENT_TIMEOUT'] = 0
+    app.config['STATEMENT_TIMEOUTS'] = {}
+
+    sizes = SCALES[scale]
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        etl = [] if skip_load else [load(scale, seed, workdir)]
+        if only is None or 'etl_add' in only:
+            while len(etl) < etl_repeat:
+                etl.append(run_etl(workdir, sizes['points'], seed))
+            timings['etl_add'] = etl
+
+    client = app.test_client()
+    for scenario in SCENARIOS:
+        if only is not None and scenario.name not in only:
+            continue
+        logger.info('Running {}.'.format(scenario.name))
+        # One run to warm up connections and the planner, which isn't counted
+        run_request(client, scenario)
+        timings[scenario.name] = [run_request(client, scenario) for _ in range(repeat)]
+
+    result = {
+        'commit': _commit(),
+        'timestamp': datetime.now().isoformat(),
+        'scale': scale,
+        'sizes': sizes,
+        'seed': seed,
+        'repeat': repeat,
+        'scenarios': {name: summarize(times) for name, times in timings.items()}
+    }
+    save(result)
+    return result
+
+
+def summarize(times: list) -> dict:
+    ordered = sorted(times)
+    return {
+        'runs': len(ordered),
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': statistics.mean(ordered),
+        'p95': ordered[min(int(round(0.95 * (len(ordered) - 1))), len(ordered) - 1)],
+        'max': ordered[-1],
+        'times': times
+    }
+
+
+def save(result: dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, '{}-{}-{}.json'.format(
+        result['timestamp'].replace(':', '').split('.')[0], result['commit'][:10], result['scale']))
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    logger.info('Saved results to {}.'.format(path))
+    return path
+
+
+def compare(before_path: str, after_path: str) -> str:
+    """Line up the median times of two saved runs, scenario by scenario."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    if (before['scale'], before['seed']) != (after['scale'], after['seed']):
+        logger.warning('Comparing runs of different datasets: {} seed {} and {} seed {}.'.format(
+            before['scale'], before['seed'], after['scale'], after['seed']))
+
+    lines = ['{:<20} {:>12} {:>12} {:>8}'.format(
+        'scenario', before['commit'][:10], after['commit'][:10], 'change')]
+    for name in sorted(set(before['scenarios']) | set(after['scenarios'])):
+        old = before['scenarios'].get(name, {}).get('median')
+        new = after['scenarios'].get(name, {}).get('median')
+        change = '{:+.1%}'.format(new / old - 1) if old and new else '-'
+        lines.append('{:<20} {:>12} {:>12} {:>8}'.format(name, _seconds(old), _seconds(new), change))
+    return '\n'.join(lines)
+
+
+def _seconds(value):
+    return '{:.3f}s'.format(value) if value is not None else '-'
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
@@ -0,0 +1,73 @@
+from collections import namedtuple
+from time import perf_counter
+
+from plenario.api.common import cache
+from plenario.models import ShapeMetadata
+
+from benchmarks import datasets
+
+
+# A scenario is a request made to the api, or for the ETL a function that
+# times itself. Requests are answered by a test client, with the response
+# cache cleared beforehand so that every run does the work.
+Scenario = namedtuple('Scenario', ['name', 'path', 'params'])
+
+PREFIX = '/v1/api'
+START, END = '2016-01-01', '2016-12-31'
+SENSOR_START, SENSOR_END = '2016-01-01T00:00:00', '2016-01-08T00:00:00'
+
+SCENARIOS = [
+    Scenario('detail', '/detail', {
+        'dataset_name': datasets.POINT_DATASET, 'obs_date__ge': START, 'obs_date__le': END}),
+    Scenario('detail_filtered', '/detail', {
+        'dataset_name': datasets.POINT_DATASET, 'obs_date__ge': START, 'obs_date__le': END,
+        datasets.POINT_DATASET + '__filter': '{"op": "eq", "col": "category", "val": "THEFT"}'}),
+    Scenario('timeseries', '/timeseries', {
+        'dataset_name__in': datasets.POINT_DATASET, 'obs_date__ge': START, 'obs_date__le': END, 'agg': 'week'}),
+    Scenario('grid', '/grid', {
+        'dataset_name': datasets.POINT_DATASET, 'obs_date__ge': START, 'obs_date__le': END, 'resolution': 500}),
+    Scenario('shapes', '/shapes/{}/{}'.format(ShapeMetadata.make_table_name(datasets.SHAPE_DATASET),
+                                              datasets.POINT_DATASET), {
+        'obs_date__ge': START, 'obs_date__le': END}),
+    Scenario('datadump', '/datadump', {
+        'dataset_name': datasets.POINT_DATASET, 'obs_date__ge': START, 'obs_date__le': END, 'data_type': 'csv'}),
+    Scenario('sensor_query', '/sensor-networks/{}/query'.format(datasets.NETWORK), {
+        'feature': datasets.FEATURE, 'start_datetime': SENSOR_START, 'end_datetime': SENSOR_END,
+        'limit': 10000}),
+    Scenario('sensor_aggregate', '/sensor-networks/{}/aggregate'.format(datasets.NETWORK), {
+        'node': 'bench_node_0', 'feature': datasets.FEATURE + '.temperature', 'function': 'avg',
+        'agg': 'hour', 'start_datetime': SENSOR_START, 'end_datetime': SENSOR_END}),
+]
+
+
+class ScenarioFailed(Exception):
+    pass
+
+
+def run_request(client, scenario: Scenario) -> float:
+    """Make the request of a scenario, reading the whole response.
+
+    :returns: (float) seconds taken
+    """
+    cache.clear()
+    start = perf_counter()
+    response = client.get(PREFIX + scenario.path, query_string=scenario.params)
+    # Streamed responses only do their work as they are read
+    size = sum(len(chunk) for chunk in response.response)
+    elapsed = perf_counter() - start
+    response.close()
+
+    if response.status_code != 200:
+        raise ScenarioFailed('{} returned {}: {}'.format(
+            scenario.name, response.status_code, response.get_data(as_text=True)[:500]))
+    if not size:
+        raise ScenarioFailed('{} returned an empty response'.format(scenario.name))
+    return elapsed
+
+
+def run_etl(workdir: str, rows: int, seed: int) -> float:
+    """Ingest a fresh point dataset with PlenarioETL.add.
+
+    :returns: (float) seconds taken
+    """
+    return datasets.load_points(workdir, rows, seed)
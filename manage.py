@@ -104,6 +104,31 @@ def test():
         wait(subprocess.Popen(cmd))
 
 
+@manager.option('--scale', default='small', help='small, medium or large')
+@manager.option('--seed', default=0, type=int, help='seed for the generated datasets')
+@manager.option('--repeat', default=5, type=int, help='timed runs of each scenario')
+@manager.option('--only', default=None, help='comma separated scenarios to run')
+@manager.option('--skip-load', dest='skip_load', action='store_true', help='reuse loaded datasets')
+def benchmark(scale, seed, repeat, only, skip_load):
+    """Time the api and ETL against synthetic datasets.
+    """
+    from benchmarks.runner import run
+
+    result = run(application, scale=scale, seed=seed, repeat=repeat,
+                 only=only.split(',') if only else None, skip_load=skip_load)
+    for name, summary in sorted(result['scenarios'].items()):
+        print('{:<20} median {:.3f}s  p95 {:.3f}s'.format(name, summary['median'], summary['p95']))
+
+
+@manager.command
+def compare_benchmarks(before, after):
+    """Compare the results of two benchmark runs.
+    """
+    from benchmarks.runner import compare
+
+    print(compare(before, after))
+
+
 # @manager.command
 # def config():
 #     """Set up environment variables for plenario."""
@@ -150,6 +175,9 @@ def init():
     # Set up custom functions, triggers and views in postgres
     psql('./plenario/dbscripts/sensor_tree.sql')
     psql('./plenario/dbscripts/point_from_location.sql')
+    psql('./plenario/dbscripts/data_version.sql')
+    psql('./plenario/dbscripts/point_date_hash_index.sql')
+    psql('./plenario/dbscripts/daily_rollup.sql')
 
     # Set up the default user if we are running in anything but production
     if os.environ.get('CONFIG') != 'prod':
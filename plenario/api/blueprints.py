@@ -1,19 +1,26 @@
 import json
+from logging import getLogger
 from time import sleep
 
 from flask import Blueprint, make_response
+from psycopg2.extensions import QueryCanceledError
+from sqlalchemy.exc import DBAPIError
 
 from plenario.sensor_network.api.ifttt import get_ifttt_meta, get_ifttt_observations, ifttt_status, ifttt_test_setup
 from plenario.sensor_network.api.sensor_networks import check, get_aggregations, get_feature_metadata, \
     get_network_map, get_network_metadata, get_node_download, get_node_metadata, get_observation_nearest, \
     get_observations, get_observations_download, get_sensor_metadata
+from plenario.database import QueryAbandoned
 from .common import cache, make_cache_key
 from .point import datadump_view, dataset_fields, detail, detail_aggregate, get_job_view, grid, meta
 from .sensor import weather, weather_fill, weather_stations
 from .shape import aggregate_point_data, export_shape, get_all_shape_datasets
+from .response import make_error
 from .timeseries import timeseries
 
 
+logger = getLogger(__name__)
+
 api = Blueprint('api', __name__)
 
 API_VERSION = '/v1'
@@ -36,7 +43,7 @@ api.add_url_rule('{}{}'.format(prefix, '/shapes/'), 'shape_index', get_all_shape
 api.add_url_rule('{}{}'.format(prefix, '/shapes/<dataset_name>'), 'shape_export', export_shape)
 api.add_url_rule('{}{}'.format(prefix, '/shapes/<polygon_dataset_name>/<point_dataset_name>'), 'aggregate', aggregate_point_data)
 
-api.add_url_rule('{}{}'.format(prefix, '/jobs/<ticket>'), view_func=get_job_view, methods=['GET'])
+api.add_url_rule('{}{}'.format(prefix, '/jobs/<ticket>'), 'jobs', get_job_view, methods=['GET'])
 
 api.add_url_rule('{}{}'.format(prefix, '/datadump'), 'datadump', datadump_view)
 
@@ -67,7 +74,22 @@ api.add_url_rule('/ifttt/v1/triggers/property_comparison', 'ifttt_obs', get_iftt
 api.add_url_rule('/ifttt/v1/triggers/property_comparison/fields/<field>/options', 'ifttt_meta', get_ifttt_meta, methods=['POST'])
 
 
-@api.route('{}{}'.format(prefix, '/flush-)cache'))
+@api.errorhandler(DBAPIError)
+def database_error(error):
+    if isinstance(error.orig, QueryCanceledError):
+        msg = 'This query took too long to run. Try narrowing it down, or request it with job=true.'
+        return make_error(msg, 504)
+    logger.exception('Database error while serving the request')
+    return make_error('The database could not answer this query, try again later.', 503)
+
+
+@api.errorhandler(QueryAbandoned)
+def query_abandoned(error):
+    # Nobody is listening anymore, nginx's code for a closed request will do.
+    return make_error(str(error), 499)
+
+
+@api.route('{}{}'.format(prefix, '/flush-cache'))
 def flush_cache():
     cache.clear()
     resp = make_response(json.dumps({'status': 'ok', 'message': 'cache flushed!'}))
@@ -0,0 +1,145 @@
+"""Typed, columnar exports in the parquet and arrow ipc stream formats. Rows
+are collected into record batches as they come off a server-side cursor, and
+each batch is encoded and handed to the response before the next one is
+read, so memory is bounded by the batch size rather than the export.
+
+Both formats need pyarrow, which is optional. Check available() first.
+"""
+import json
+from itertools import islice
+
+from sqlalchemy import types
+
+from plenario.settings import COLUMNAR_BATCH_ROWS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+MIMETYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+
+def available():
+    return pyarrow is not None
+
+
+def columnar_export(rows, columns, fmt, batch_rows=COLUMNAR_BATCH_ROWS):
+    """Encode rows as a parquet file or an arrow stream, one record batch (and
+    parquet row group) of batch_rows rows at a time.
+
+    :param rows: iterable of rows holding a value for each of the columns
+    :param columns: (list) of the reflected Columns the rows were selected from
+    :param fmt: (str) 'parquet' or 'arrow'
+    :param batch_rows: (int) rows per record batch
+    :returns: generator of bytes
+    """
+    schema = arrow_schema(columns)
+    converters = [_converter(c.type) for c in columns]
+
+    sink = _Sink()
+    if fmt == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        write = lambda batch: writer.write_table(pyarrow.Table.from_batches([batch]))
+    else:
+        writer = pyarrow.RecordBatchStreamWriter(sink, schema)
+        write = writer.write_batch
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_rows))
+        if not chunk:
+            break
+        write(_record_batch(chunk, schema, converters))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def arrow_schema(columns):
+    """The arrow schema for a list of reflected Columns."""
+    return pyarrow.schema([pyarrow.field(c.name, _arrow_type(c.type)) for c in columns])
+
+
+def _arrow_type(type_):
+    # Order matters, Float is a kind of Numeric and BigInteger is a kind of
+    # Integer, for instance.
+    if isinstance(type_, types.Boolean):
+        return pyarrow.bool_()
+    if isinstance(type_, types.SmallInteger):
+        return pyarrow.int16()
+    if isinstance(type_, types.BigInteger):
+        return pyarrow.int64()
+    if isinstance(type_, types.Integer):
+        return pyarrow.int32()
+    if isinstance(type_, types.Numeric):
+        return pyarrow.float64()
+    if isinstance(type_, types.DateTime):
+        return pyarrow.timestamp('us', tz='UTC' if type_.timezone else None)
+    if isinstance(type_, types.Date):
+        return pyarrow.date32()
+    if isinstance(type_, types.Time):
+        return pyarrow.time64('us')
+    return pyarrow.string()
+
+
+def _converter(type_):
+    """Whatever needs doing to a database value before arrow takes it as the
+    column's arrow type, or None.
+    """
+    if isinstance(type_, types.Numeric) and not isinstance(type_, types.Float):
+        return float
+    if isinstance(type_, types.JSON):
+        return json.dumps
+    if isinstance(type_, types.String) or _arrow_type(type_) != pyarrow.string():
+        return None
+    # Geometries, arrays and anything else without an arrow type of its own
+    return str
+
+
+def _record_batch(rows, schema, converters):
+    arrays = []
+    for i, (field, convert) in enumerate(zip(schema, converters)):
+        values = [row[i] for row in rows]
+        if convert is not None:
+            values = [None if v is None else convert(v) for v in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema.names)
+
+
+class _Sink(object):
+    """Write-only file that pyarrow writers encode into, and that is emptied
+    every time a batch has been written.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
@@ -1,19 +1,34 @@
 import csv
 import json
 import logging
+import re
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import date, datetime, time, timedelta
-from functools import update_wrapper
+from functools import update_wrapper, wraps
+from hashlib import sha1
 from io import StringIO
+from threading import Thread
+from time import sleep
+from time import time as now
 
-from flask import current_app, make_response, request
+from dateutil import parser
+from flask import copy_current_request_context, current_app, g, make_response, request
 from flask_cache import Cache
 from shapely.geometry import asShape
 from sqlalchemy.sql.schema import Table
 
+from plenario import registry
+from plenario.database import postgres_session, socket_closed
 from plenario.models import MetaTable
-from plenario.settings import CACHE_CONFIG
+from plenario.settings import BROTLI_QUALITY, CACHE_CONFIG, COMPRESSION_LEVEL, STREAM_CHUNK_SIZE
 from plenario.utils.helpers import get_size_in_degrees
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +36,13 @@ cache = Cache(config=CACHE_CONFIG)
 
 RESPONSE_LIMIT = 1000
 CACHE_TIMEOUT = 60 * 60 * 6
+# Age after which a cached response is refreshed, while still being served
+CACHE_SOFT_TIMEOUT = 60 * 60 * 5
+# How long a worker may hold the right to recompute a cache entry, and how
+# long the others wait for it before doing the work themselves
+CACHE_LOCK_TIMEOUT = 60 * 2
+CACHE_LOCK_WAIT = 60
+CACHE_LOCK_POLL = 0.1
 
 
 def unknown_object_json_handler(obj):
@@ -103,10 +125,425 @@ def crossdomain(origin=None, methods=None, headers=None,
     return decorator
 
 
+# Arguments whose values are normalized before they go into a cache key
+DATE_ARGS = {'obs_date__ge', 'obs_date__le', 'start_datetime', 'end_datetime'}
+GEOM_ARGS = {'location_geom__within', 'geom'}
+SET_ARGS = {'dataset_name__in'}
+
+
 def make_cache_key(*args, **kwargs):
-    path = request.path
-    args = str(hash(frozenset(list(request.args.items()))))
-    return path + args
+    """Key a cached response by its path, a digest of its canonical query and
+    the data versions of the datasets it reads. Equivalent requests share an
+    entry across workers and hosts, and reingesting a dataset moves every
+    request that depends on it to a fresh key.
+    """
+    return request.path.rstrip('/') + ':' + request_digest()
+
+
+def request_digest():
+    """Digest of the canonical query of the current request and the data
+    versions of the datasets it reads. Computed once per request, since both
+    the cache key and the ETag are derived from it.
+    """
+    if 'request_digest' not in g:
+        query = canonical_query(request.args)
+        versions = dataset_versions(requested_datasets(request.args, request.view_args))
+        g.request_digest = sha1((query + json.dumps(versions)).encode('utf-8')).hexdigest()
+    return g.request_digest
+
+
+def conditional(f):
+    """Tag successful responses with an ETag derived from request_digest, and
+    answer a matching If-None-Match with a 304 before the view runs. Applied
+    outside of the cache, so a client with an up to date copy skips both the
+    cache and the database.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Every job request has to reach the view to get its own ticket, the
+        # caches below skip them too, see jobs.is_uncached_request.
+        if request.args.get('job', '').lower() == 'true':
+            return f(*args, **kwargs)
+
+        try:
+            etag = request_digest()
+        except Exception:
+            logger.exception('Unable to compute an ETag.')
+            return f(*args, **kwargs)
+
+        if request.if_none_match.contains_weak(etag):
+            resp = current_app.response_class(status=304)
+            resp.set_etag(etag)
+            resp.headers['Access-Control-Allow-Origin'] = '*'
+            return resp
+
+        resp = make_response(f(*args, **kwargs))
+        if resp.status_code == 200 and not g.get('skip_cache'):
+            resp.set_etag(etag)
+        return resp
+
+    return decorated_function
+
+
+def skip_cache():
+    """Keep the response to the current request out of single_flight caches
+    and without an ETag, for responses that only make sense once, like the
+    ticket of a job or the refusal of a query that is too expensive.
+    """
+    g.skip_cache = True
+
+
+def client_disconnected():
+    """Whether the client of the current request has closed its connection.
+    Only gunicorn hands us the socket, under any other server this can't be
+    told and the answer is always False.
+    """
+    return socket_closed(request.environ.get('gunicorn.socket'))
+
+
+def requested_datasets(args, view_args=None):
+    """Collect the names of the point and shape datasets a request refers to,
+    whether by argument, by condition tree or in the url itself.
+
+    :param args: (MultiDict) request arguments
+    :param view_args: (dict) arguments taken from the url
+    :returns: (set) of dataset names
+    """
+    names = set()
+    for key in ('dataset_name', 'shape'):
+        names.update(args.getlist(key))
+    for value in args.getlist('dataset_name__in'):
+        names.update(name.strip() for name in value.split(','))
+    for key in args:
+        if key.endswith('__filter'):
+            # Matches the last occurrence of '__', like validate does.
+            names.add(re.split(r'__(?!_)', key)[0])
+    for key, value in (view_args or {}).items():
+        if key.endswith('dataset_name'):
+            names.add(value)
+    return names
+
+
+def dataset_versions(names):
+    """Look up the versions of the given datasets in the registry snapshot,
+    without any queries. A version is a digest of the dataset's registry row,
+    so it changes with a reingest as well as with an edit of its metadata or
+    approval. A request that doesn't name any datasets can be answered from
+    any of them, so it gets the digests of the registry tables as a whole.
+
+    :param names: (set) of dataset names
+    :returns: (list) of [name, version] pairs
+    """
+    tablenames = ('meta_master', 'meta_shape')
+
+    if not names:
+        return [[tablename, registry.digests(tablename)[None]] for tablename in tablenames]
+
+    versions = []
+    for tablename in tablenames:
+        digests = registry.digests(tablename)
+        versions += [[name, digests[name]] for name in names if name in digests]
+    return sorted(versions)
+
+
+def canonical_query(args):
+    """Serialize request arguments deterministically. Arguments are sorted by
+    name, and dates, geometries, condition trees and dataset lists are
+    rewritten to a single form, so that the same query always produces the
+    same string regardless of argument order or formatting.
+
+    :param args: (MultiDict) request arguments
+    :returns: (str) canonical form of the arguments
+    """
+    canonical = []
+    for key in sorted(args.keys()):
+        values = [_canonical_value(key, value) for value in args.getlist(key)]
+        canonical.append([key, values])
+    return json.dumps(canonical, separators=(',', ':'))
+
+
+def _canonical_value(key, value):
+    """Normalize a single argument value, leaving it untouched if it can't be
+    interpreted. Invalid values are rejected by the validators later on.
+    """
+    try:
+        if key in DATE_ARGS:
+            return parser.parse(value).isoformat()
+        if key in GEOM_ARGS:
+            fragment = extract_first_geometry_fragment(value)
+            return json.dumps(fragment, sort_keys=True, separators=(',', ':'))
+        if key == 'filter' or key.endswith('__filter'):
+            return json.dumps(json.loads(value), sort_keys=True, separators=(',', ':'))
+        if key in SET_ARGS:
+            return ','.join(sorted(set(v.strip() for v in value.split(','))))
+    except (ValueError, TypeError, AttributeError, KeyError, OverflowError):
+        pass
+    return value
+
+
+def _acquire(lock):
+    # Flask-Cache's add doesn't pass on whether the key was added, the
+    # backend's does.
+    return cache.cache.add(lock, True, timeout=CACHE_LOCK_TIMEOUT)
+
+
+def _peek(key):
+    # Waiting on a key polls it many times over for what is one lookup, which
+    # was already counted as a miss. Don't count the polls when the backend
+    # counts hits and misses.
+    backend = cache.cache
+    return getattr(backend, 'peek', backend.get)(key)
+
+
+def single_flight(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key,
+                  soft_timeout=None, background=False, unless=None):
+    """A replacement for cache.cached that lets only one worker at a time
+    compute a missing or expired response. The worker that wins a short lock
+    in the cache runs the view and stores its result, the rest poll the cache
+    until the result shows up.
+
+    With a soft_timeout, entries are considered stale after soft_timeout
+    seconds but are kept for the full timeout. The first request to see a
+    stale entry refreshes it while every other request keeps getting the
+    stale response. With background=True, the refresh happens in a separate
+    thread, so no request waits on it.
+
+    :param timeout: seconds a response is kept in the cache
+    :param key_prefix: callable that returns the cache key of the request
+    :param soft_timeout: seconds after which a response is refreshed
+    :param background: refresh stale responses outside of the request
+    :param unless: callable, bypasses the cache entirely when it returns True
+    """
+    soft_timeout = soft_timeout or timeout
+
+    def decorator(f):
+        def store(key, lock, *args, **kwargs):
+            try:
+                rv = f(*args, **kwargs)
+                if g.get('skip_cache'):
+                    return rv
+                try:
+                    cache.set(key, (now() + soft_timeout, rv), timeout=timeout)
+                except Exception:
+                    logger.exception('Exception possibly due to cache backend.')
+                return rv
+            finally:
+                cache.delete(lock)
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if callable(unless) and unless() is True:
+                return f(*args, **kwargs)
+
+            try:
+                key = key_prefix()
+                lock = key + ':lock'
+                entry = cache.get(key)
+            except Exception:
+                logger.exception('Exception possibly due to cache backend.')
+                return f(*args, **kwargs)
+
+            if entry is not None:
+                fresh_until, rv = entry
+                if fresh_until > now() or not _acquire(lock):
+                    return rv
+                if not background:
+                    return store(key, lock, *args, **kwargs)
+
+                @copy_current_request_context
+                def refresh():
+                    try:
+                        store(key, lock, *args, **kwargs)
+                    finally:
+                        postgres_session.remove()
+
+                Thread(target=refresh, daemon=True).start()
+                return rv
+
+            if _acquire(lock):
+                return store(key, lock, *args, **kwargs)
+
+            # Somebody else is computing this response, wait for it to land.
+            deadline = now() + CACHE_LOCK_WAIT
+            while now() < deadline:
+                sleep(CACHE_LOCK_POLL)
+                entry = _peek(key)
+                if entry is not None:
+                    return entry[1]
+
+            logger.warning('Gave up waiting on {}, computing it again.'.format(key))
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+class _GzipCompressor(object):
+
+    def __init__(self):
+        # Adding 16 to wbits makes zlib write a gzip header and trailer
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class _BrotliCompressor(object):
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, chunk):
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality('br'):
+        return 'br'
+    if accepted.quality('gzip'):
+        return 'gzip'
+    return None
+
+
+def _compress_chunks(body, chunks, compressor):
+    """Compress the body of a response piece by piece, flushing the
+    compressor at every chunk boundary so that the client receives data as
+    soon as it is produced. Closes the original body when done, which lets
+    generators clean up after an aborted download.
+    """
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.finish()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def compressed(f):
+    """Compress successful responses with brotli or gzip, whichever the client
+    prefers and we have available. Works on streamed responses as well, where
+    each chunk is compressed and flushed as it comes through. Applied outside
+    of the cache, so cached responses stay uncompressed.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        resp = make_response(f(*args, **kwargs))
+        resp.vary.add('Accept-Encoding')
+
+        encoding = _negotiate_encoding()
+        if encoding is None or resp.status_code != 200 or 'Content-Encoding' in resp.headers:
+            return resp
+
+        compressor = _BrotliCompressor() if encoding == 'br' else _GzipCompressor()
+        resp.response = _compress_chunks(resp.response, resp.iter_encoded(), compressor)
+        resp.headers['Content-Encoding'] = encoding
+        resp.headers.pop('Content-Length', None)
+
+        # The compressed body is no longer byte for byte what the ETag named
+        etag, weak = resp.get_etag()
+        if etag:
+            resp.set_etag(etag, weak=True)
+
+        return resp
+
+    return decorated_function
+
+
+def encode_cursor(point_date, hash_):
+    """Build an opaque pagination cursor from the sort key of the last row
+    of a /detail page. The next page picks up strictly after this key.
+
+    :param point_date: (datetime) point_date of the last row returned
+    :param hash_: (str) hash of the last row returned
+    :returns: (str) url safe cursor
+    """
+    payload = json.dumps([point_date.isoformat(), hash_])
+    return urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Reverse encode_cursor. Raises a ValueError for anything that was not
+    produced by encode_cursor.
+
+    :param cursor: (str) cursor provided by the user
+    :returns: (tuple) of point_date, hash
+    """
+    try:
+        payload = urlsafe_b64decode(cursor.encode('ascii'))
+        point_date, hash_ = json.loads(payload.decode('utf-8'))
+        return parser.parse(point_date), str(hash_)
+    except (TypeError, AttributeError, OverflowError):
+        raise ValueError('Malformed cursor: {}'.format(cursor))
+
+
+def chunked(fragments, chunk_size=STREAM_CHUNK_SIZE):
+    """Join an iterable of pre-encoded string fragments into utf-8 byte chunks
+    of roughly chunk_size bytes, so that a streaming response writes a few
+    large pieces instead of one tiny piece per row.
+
+    :param fragments: iterable of strings
+    :param chunk_size: number of bytes to collect before yielding
+    :returns: generator of bytes
+    """
+    pieces = []
+    size = 0
+    for fragment in fragments:
+        encoded = fragment.encode('utf-8')
+        pieces.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield b''.join(pieces)
+            pieces = []
+            size = 0
+    if pieces:
+        yield b''.join(pieces)
+
+
+# Line-delimited formats. Every record is encoded on its own as it comes off
+# the cursor, so a response never holds more than one chunk of them.
+LINE_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'geojsonseq': 'application/geo+json-seq'
+}
+
+
+def is_line_request():
+    """Whether the current request asks for a line-delimited format. Those
+    responses are streamed, which the response cache can't hold on to.
+    """
+    return request.args.get('data_type') in LINE_FORMATS
+
+
+def ndjson_lines(records):
+    """Encode dicts as newline-delimited json, one record per line."""
+    encoder = json.JSONEncoder(default=unknown_object_json_handler)
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+def geojsonseq_lines(features):
+    """Encode (geometry, properties) pairs as a GeoJSON text sequence (RFC
+    8142), one feature per record. Geometries are expected as geojson strings,
+    as rendered by ST_AsGeoJSON, and are spliced in as-is. Features without a
+    geometry are left out.
+    """
+    encoder = json.JSONEncoder(default=unknown_object_json_handler)
+    for geometry, properties in features:
+        if geometry is None:
+            continue
+        yield '\x1e{"type": "Feature", "geometry": %s, "properties": %s}\n' % (
+            geometry, encoder.encode(properties))
 
 
 def make_csv(data):
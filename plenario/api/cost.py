@@ -0,0 +1,84 @@
+import json
+from logging import getLogger
+
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from plenario.api import jobs, response as api_response
+from plenario.api.common import skip_cache
+from plenario.api.jobs import is_job_request, make_job_response
+from plenario.database import postgres_session
+from plenario.metrics import timed
+from plenario.settings import QUERY_COST_JOB, QUERY_COST_REJECT
+
+
+logger = getLogger(__name__)
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN a statement. Executing it returns the planner's estimates
+    without running the statement itself.
+    """
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def _compile_explain(element, compiler, **kwargs):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kwargs)
+
+
+def estimate(statement):
+    """Ask postgres what running a statement would take.
+
+    :param statement: (Select) statement to estimate
+    :returns: (tuple) of the estimated total cost and number of rows
+    """
+    plan = postgres_session.execute(Explain(statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]['Plan']
+    return plan['Total Cost'], plan['Plan Rows']
+
+
+@timed('plan')
+def cost_guard(endpoint, validated_query, statements):
+    """Decide whether a request is cheap enough to run inside a web worker,
+    judging by the planner's estimates for the statements it will run.
+
+    :param endpoint: name of the endpoint, used if the request becomes a job
+    :param validated_query: ValidatorResult of the request
+    :param statements: (list) of the statements the request will run
+    :returns: None if the request can go ahead, otherwise the response to send
+              instead, either a 413 or the ticket of the job it was turned into.
+              Requests are only turned into jobs when jobs are enabled.
+    """
+    if not (QUERY_COST_JOB or QUERY_COST_REJECT) or is_job_request():
+        return None
+
+    try:
+        estimates = [estimate(statement) for statement in statements]
+    except DatabaseError:
+        # Not being able to estimate a query shouldn't stop it from running.
+        postgres_session.rollback()
+        logger.exception('Unable to estimate query cost.')
+        return None
+
+    cost = sum(cost for cost, _ in estimates)
+    rows = sum(rows for _, rows in estimates)
+
+    if QUERY_COST_REJECT and cost > QUERY_COST_REJECT:
+        msg = 'This query is too expensive to run (estimated cost {:.0f}, about {} rows). ' \
+              'Try narrowing it down with a shorter date range, a smaller area or column filters.'
+        skip_cache()
+        return api_response.error(msg.format(cost, rows), 413)
+
+    # Without jobs there is nowhere else to run it, so it runs here as it
+    # always has.
+    if QUERY_COST_JOB and cost > QUERY_COST_JOB and jobs.JOBS_ENABLED:
+        logger.info('Running {} as a job (estimated cost {:.0f}).'.format(endpoint, cost))
+        return make_job_response(endpoint, validated_query)
+
+    return None
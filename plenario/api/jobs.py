@@ -1,21 +1,176 @@
-import pickle
+import hmac
+from datetime import datetime
+from logging import getLogger
+from uuid import uuid4
 
-from flask import jsonify
+from flask import Response, jsonify, request, stream_with_context, url_for
 
-from plenario.database import postgres_base, postgres_engine as engine
-from plenario.utils.helpers import reflect
+from plenario.api.common import skip_cache
+from plenario.api.response import make_error
+from plenario.settings import DEFAULT_SECRET_KEY, SECRET_KEY
+from plenario.tasks import JOB_HEADER, run_job, worker
+from plenario.utils.helpers import sign
+from plenario.utils.result_store import get_result_store
+
+
+logger = getLogger(__name__)
+
+# Workers replay jobs with a header signed with SECRET_KEY. Anybody can sign
+# one with the default key and skip the cost guard, so jobs stay off until the
+# server is given a key of its own.
+JOBS_ENABLED = SECRET_KEY != DEFAULT_SECRET_KEY
+if not JOBS_ENABLED:
+    logger.warning('Jobs are disabled, SECRET_KEY is still the default.')
+
+# Celery task states, as they are reported to users of the api
+JOB_STATUSES = {
+    'PENDING': 'queued',
+    'RECEIVED': 'queued',
+    'STARTED': 'processing',
+    'PROGRESS': 'processing',
+    'RETRY': 'processing',
+    'SUCCESS': 'success',
+    'FAILURE': 'error',
+    'REVOKED': 'error'
+}
 
 
 def get_job(ticket: str):
-    celery_taskmeta = reflect('celery_taskmeta', postgres_base.metadata, engine)
-    query = celery_taskmeta.select().where(celery_taskmeta.c.task_id == ticket)
-    job_meta = dict(query.execute().first().items())
-    job_meta['result'] = pickle.loads(job_meta['result'])
+    """Describe a job, its progress and, once it's done, where to collect its
+    result. Returns None for tickets that were never issued.
+    """
+    record = get_result_store().get_record(ticket)
+    if record is None:
+        return None
+
+    result = worker.AsyncResult(ticket)
+    status = JOB_STATUSES.get(result.state, 'processing')
+
+    job = {
+        'ticket': ticket,
+        'request': record.get('request'),
+        'status': {
+            'status': status,
+            'meta': {k: record.get(k) for k in ('queueTime', 'startTime', 'endTime', 'workers')}
+        }
+    }
+
+    if result.state == 'PROGRESS':
+        job['status']['progress'] = result.info
+    elif status == 'error':
+        job['error'] = str(result.result)
+    elif status == 'success' and record.get('statusCode') is None:
+        # The worker finished without its record reaching this result store,
+        # which happens when it writes somewhere else, like its own /tmp
+        job['status']['status'] = 'error'
+        job['error'] = 'The result of the job is missing from the result store.'
+    elif status == 'success':
+        url = url_for('api.jobs', ticket=ticket, _external=True)
+        job['result'] = {
+            'statusCode': record['statusCode'],
+            'contentType': record.get('contentType'),
+            'chunks': record.get('chunks', 0),
+            'bytes': record.get('bytes', 0),
+            'url': url + '?download=true',
+            'chunkUrl': url + '?chunk={}'
+        }
+        # The replayed request failed, its response is still there to collect
+        if not 200 <= record['statusCode'] < 300:
+            job['status']['status'] = 'error'
+            job['error'] = 'The request returned status {}.'.format(record['statusCode'])
+
+    return job
+
+
+def job_response(ticket: str):
+    """Respond to /jobs/<ticket>. Without arguments this reports on the job.
+    Once it has finished, ?chunk=<n> returns a single chunk of the result and
+    ?download=true streams the whole result, as the original request would
+    have returned it.
+    """
+    job = get_job(ticket)
+    if job is None:
+        return make_error('No job found for ticket {}.'.format(ticket), 404)
+
+    chunk = request.args.get('chunk')
+    download = request.args.get('download', '').lower() == 'true'
+    if chunk is None and not download:
+        return jsonify(job)
+
+    if 'result' not in job:
+        if job['status']['status'] == 'error':
+            return make_error('Job {} failed: {}'.format(ticket, job['error']), 409)
+        return make_error('Job {} has not finished yet.'.format(ticket), 409)
 
-    return job_meta
+    store = get_result_store()
+    result = job['result']
+
+    if chunk is not None:
+        try:
+            index = int(chunk)
+        except ValueError:
+            return make_error('Invalid chunk: {}.'.format(chunk), 400)
+        data = store.get_chunk(ticket, index) if 0 <= index < result['chunks'] else None
+        if data is None:
+            return make_error('Job {} has no chunk {}.'.format(ticket, chunk), 404)
+        return Response(data, content_type=result['contentType'])
+
+    def chunks():
+        for index in range(result['chunks']):
+            yield store.get_chunk(ticket, index)
+
+    resp = Response(stream_with_context(chunks()), status=result['statusCode'],
+                    content_type=result['contentType'])
+    disposition = (store.get_record(ticket) or {}).get('contentDisposition')
+    if disposition:
+        resp.headers['Content-Disposition'] = disposition
+    return resp
+
+
+def is_job_request():
+    """Whether the current request is a job being run by a worker, rather than
+    a request made by a user.
+    """
+    if not JOBS_ENABLED:
+        return False
+    ticket, _, signature = request.headers.get(JOB_HEADER, '').partition(':')
+    return bool(ticket) and hmac.compare_digest(signature, sign(ticket))
+
+
+def is_uncached_request():
+    """Whether the response caches should be skipped for the current request.
+    Jobs being run by a worker have to run the query itself, and every request
+    for a job needs a ticket of its own.
+    """
+    return is_job_request() or request.args.get('job', '').lower() == 'true'
 
 
 def make_job_response(endpoint, validated_query):
-    msg = 'This feature, enabled by the jobs=true flag, is currently ' \
-          'undergoing maintenance, we apologize for any inconvenience.'
-    return jsonify({'unavailable': msg})
+    """Hand the current request off to a worker, and respond with a ticket
+    that the result can be collected with at /jobs/<ticket>. The worker runs
+    the same request without the job flag.
+
+    :param endpoint: name of the endpoint the job was requested from
+    :param validated_query: ValidatorResult of the request
+    """
+    if not JOBS_ENABLED:
+        skip_cache()
+        return make_error('Jobs are disabled on this server until it is given a SECRET_KEY of its own.', 503)
+
+    query = request.args.to_dict(flat=False)
+    query.pop('job', None)
+
+    ticket = str(uuid4())
+    record = {
+        'request': {'endpoint': endpoint, 'query': query, 'path': request.path},
+        'queueTime': datetime.now().isoformat()
+    }
+    get_result_store().put_record(ticket, record)
+    run_job.apply_async(args=[request.path, query], task_id=ticket)
+    skip_cache()
+
+    return jsonify({
+        'ticket': ticket,
+        'url': url_for('api.jobs', ticket=ticket, _external=True),
+        'request': record['request']
+    })
@@ -1,6 +1,4 @@
 import codecs
-import csv
-import io
 import json
 import re
 import traceback
@@ -15,13 +13,18 @@ from datetime import datetime, timedelta
 from dateutil import parser
 from flask import Response, jsonify, request, stream_with_context
 
-from plenario.api.common import CACHE_TIMEOUT, cache, crossdomain, make_cache_key, unknown_object_json_handler
+from plenario.api.common import CACHE_SOFT_TIMEOUT, CACHE_TIMEOUT, LINE_FORMATS, cache, chunked, compressed, \
+    conditional, crossdomain, encode_cursor, geojsonseq_lines, is_line_request, make_cache_key, ndjson_lines, \
+    single_flight, unknown_object_json_handler
+from plenario.api import columnar
 from plenario.api.condition_builder import parse_tree
-from plenario.api.jobs import get_job, make_job_response
-from plenario.api.validator import DatasetRequiredValidator, NoDefaultDatesValidator, \
+from plenario.api.cost import cost_guard
+from plenario.api.jobs import is_uncached_request, job_response, make_job_response
+from plenario.api.validator import DatasetRequiredValidator, DetailValidator, ExportValidator, NoDefaultDatesValidator, \
     NoGeoJSONDatasetRequiredValidator, NoGeoJSONValidator, has_tree_filters, validate, \
     PointsetRequiredValidator
-from plenario.database import postgres_session
+from plenario.database import copy_many, copy_to, postgres_session, read_engine, statement_timeout, stream
+from plenario.metrics import timed
 from plenario.models import MetaTable
 from . import response as api_response
 
@@ -30,14 +33,14 @@ from . import response as api_response
 # routes
 # ======
 
-# The get_job method in jobs.py does not have crossdomain, and is out of the
-# Flask context. So we define a wrapper here to access it.
+# The job methods in jobs.py do not have crossdomain, so we define a wrapper
+# here to access them.
 @crossdomain(origin='*')
 def get_job_view(ticket):
-    return jsonify(get_job(ticket))
+    return job_response(ticket)
 
 
-@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
+@single_flight(timeout=CACHE_TIMEOUT, soft_timeout=CACHE_SOFT_TIMEOUT, background=True, unless=is_uncached_request)
 @crossdomain(origin='*')
 def detail_aggregate():
     fields = ('location_geom__within', 'dataset_name', 'agg', 'obs_date__ge',
@@ -55,13 +58,19 @@ def detail_aggregate():
         return api_response.detail_aggregate_response(time_counts, validator_result)
 
 
-@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
+def _uncached():
+    return is_uncached_request() or is_line_request()
+
+
+@compressed
+@conditional
+@single_flight(timeout=CACHE_TIMEOUT, unless=_uncached)
 @crossdomain(origin='*')
 def detail():
     fields = ('location_geom__within', 'dataset_name', 'shape', 'obs_date__ge',
-              'obs_date__le', 'data_type', 'offset', 'date__time_of_day_ge',
+              'obs_date__le', 'data_type', 'offset', 'cursor', 'date__time_of_day_ge',
               'date__time_of_day_le', 'limit', 'job')
-    validator = DatasetRequiredValidator(only=fields)
+    validator = DetailValidator(only=fields)
     validator_result = validate(validator, request.args.to_dict())
 
     if validator_result.errors:
@@ -69,35 +78,62 @@ def detail():
 
     if validator_result.data.get('job'):
         return make_job_response('detail', validator_result)
-    else:
-        result_rows = _detail(validator_result)
-        return api_response.detail_response(result_rows, validator_result)
+
+    query = _detail_page(validator_result)
+    if isinstance(query, Response):
+        return query
+
+    guarded = cost_guard('detail', validator_result, [query.statement])
+    if guarded is not None:
+        return guarded
+
+    fmt = validator_result.data['data_type']
+    if fmt in LINE_FORMATS:
+        stream = _detail_lines(validator_result, query)
+        return Response(stream_with_context(stream), mimetype=LINE_FORMATS[fmt])
+
+    result_rows = _detail(validator_result, query)
+    return api_response.detail_response(result_rows, validator_result)
 
 
+@compressed
 @crossdomain(origin='*')
 def datadump_view():
     fields = ('location_geom__within', 'dataset_name', 'shape', 'obs_date__ge',
               'obs_date__le', 'offset', 'date__time_of_day_ge',
-              'date__time_of_day_le', 'limit', 'job', 'data_type')
+              'date__time_of_day_le', 'limit', 'job', 'data_type', 'datadump_part',
+              'datadump_total')
 
-    validator = DatasetRequiredValidator(only=fields)
+    validator = ExportValidator(only=fields)
     validator_result = validate(validator, request.args.to_dict())
 
     if validator_result.errors:
         return api_response.error(validator_result.errors, 400)
 
+    fmt = validator_result.data['data_type']
+    if fmt in columnar.MIMETYPES and not columnar.available():
+        return api_response.error('{} exports are not available on this server.'.format(fmt), 501)
+
+    part = validator_result.data['datadump_part']
+    total = validator_result.data['datadump_total']
+    if part is not None and part > total:
+        return api_response.error('datadump_part cannot be greater than datadump_total.', 400)
+    if part is None and total > 1 and validator_result.data['data_type'] != 'csv':
+        return api_response.error('Exporting all parts at once is only supported for csv, '
+                                  'request each datadump_part separately instead.', 400)
+
     stream = datadump(**validator_result.data)
 
     dataset = validator_result.data['dataset'].name
-    fmt = validator_result.data['data_type']
     content_disposition = 'attachment; filename={}.{}'.format(dataset, fmt)
 
-    attachment = Response(stream_with_context(stream), mimetype='text/%s' % fmt)
+    mimetype = LINE_FORMATS.get(fmt) or columnar.MIMETYPES.get(fmt, 'text/%s' % fmt)
+    attachment = Response(stream_with_context(stream), mimetype=mimetype)
     attachment.headers['Content-Disposition'] = content_disposition
     return attachment
 
 
-@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
+@single_flight(timeout=CACHE_TIMEOUT, soft_timeout=CACHE_SOFT_TIMEOUT, background=True, unless=is_uncached_request)
 @crossdomain(origin='*')
 def grid():
 
@@ -116,7 +152,13 @@ def grid():
     if validator_result.errors:
         return api_response.bad_request(validator_result.errors)
 
-    results = _grid(validator_result)
+    # A list of queries, or the error that prevented building them
+    results = _grid_queries(validator_result)
+    if isinstance(results, list):
+        guarded = cost_guard('grid', validator_result, [q.statement for q, _, _ in results])
+        if guarded is not None:
+            return guarded
+        results = _grid(results)
 
     query = validator.dumps(validator_result.data)
     query = json.loads(query.data)
@@ -124,7 +166,8 @@ def grid():
     return jsonify(results)
 
 
-@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
+@conditional
+@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key, unless=is_uncached_request)
 @crossdomain(origin='*')
 def dataset_fields(dataset_name):
     request_args = request.args.to_dict()
@@ -143,7 +186,8 @@ def dataset_fields(dataset_name):
         return api_response.fields_response(result_data, validator_result)
 
 
-@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
+@conditional
+@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key, unless=is_uncached_request)
 @crossdomain(origin='*')
 def meta():
     fields = ('obs_date__le', 'obs_date__ge', 'dataset_name', 'location_geom__within', 'job')
@@ -164,6 +208,7 @@ def meta():
 # ============
 
 
+@timed('fetch')
 def _detail_aggregate(args):
     """Returns a record for every row in the specified dataset with brief
     temporal and spatial information about the row. This can give a user of the
@@ -210,41 +255,120 @@ def _detail_aggregate(args):
     return time_counts
 
 
-def _detail(args):
-    meta_params = ('dataset', 'shape', 'data_type', 'limit', 'offset')
-    meta_vals = (args.data.get(k) for k in meta_params)
-    dataset, shapeset, data_type, limit, offset = meta_vals
+@timed('build')
+def _detail_page(args):
+    """Build the query for a single page of detail records.
+
+    :param args: ValidatorResult of the request
+    :returns: (Query) or an error response
+    """
+    dataset, limit, offset, cursor = (args.data.get(k) for k in ('dataset', 'limit', 'offset', 'cursor'))
+
+    q = detail_query(args)
+    if isinstance(q, Response):
+        return q
+
+    # Keyset pagination. Rows are ordered by (point_date, hash), so picking up
+    # after the last row of the previous page is a range condition on the
+    # sort key instead of an offset that makes postgres discard every row
+    # that came before it.
+    if cursor:
+        point_date, hash_ = cursor
+        q = q.filter(
+            sqlalchemy.tuple_(dataset.c.point_date, dataset.c.hash) <
+            sqlalchemy.tuple_(point_date, hash_)
+        )
 
-    q = detail_query(args).order_by(dataset.c.point_date.desc())
+    q = q.order_by(dataset.c.point_date.desc(), dataset.c.hash.desc())
 
     # Apply limit and offset.
     q = q.limit(limit)
     q = q.offset(offset) if offset else q
+    return q
+
+
+@timed('fetch')
+def _detail(args, q):
+    dataset, shapeset, limit = (args.data.get(k) for k in ('dataset', 'shapeset', 'limit'))
 
     try:
         columns = [c.name for c in dataset.columns]
         if shapeset:
             columns += [c.name for c in shapeset.columns]
-        return [OrderedDict(list(zip(columns, row))) for row in q.all()]
+        results = q.all()
+        args.data['next_cursor'] = _next_cursor(results, limit, dataset)
+        return [OrderedDict(list(zip(columns, row))) for row in results]
     except Exception as e:
         postgres_session.rollback()
         msg = 'Failed to fetch records.'
         return api_response.make_raw_error('{}: {}'.format(msg, e))
 
 
+def _detail_lines(args, q):
+    """Stream a page of detail records as ndjson or geojsonseq, encoding each
+    row as it is read from the cursor. Plenario derived columns are hidden, as
+    they are in json responses.
+    """
+    dataset, shapeset = args.data['dataset'], args.data.get('shapeset')
+    hide = {'point_date', 'hash', 'geom'}
+
+    names = [c.name for c in dataset.columns]
+    if shapeset is not None:
+        names += [c.name for c in shapeset.columns]
+    shown = [(i, name) for i, name in enumerate(names) if name not in hide]
+
+    if args.data['data_type'] == 'ndjson':
+        records = (OrderedDict((name, row[i]) for i, name in shown) for row in stream(q))
+        return chunked(ndjson_lines(records))
+
+    q = q.add_columns(sqlalchemy.func.ST_AsGeoJSON(dataset.c.geom))
+    features = ((row[-1], OrderedDict((name, row[i]) for i, name in shown)) for row in stream(q))
+    return chunked(geojsonseq_lines(features))
+
+
+def _next_cursor(rows, limit, dataset):
+    """Return the cursor for the page following this one, or None if this
+    page was the last one.
+
+    The sort key is read by position from the point table columns, which
+    come first in every row. Joined shape tables have a hash of their own,
+    so looking it up by name could pick up the wrong one.
+    """
+    if not rows or len(rows) < limit:
+        return None
+    names = [c.name for c in dataset.columns]
+    last = rows[-1]
+    point_date = last[names.index('point_date')]
+    if point_date is None:
+        return None
+    return encode_cursor(point_date, last[names.index('hash')])
+
+
 def datadump(**kwargs):
-    """Export the result of a detail query in geojson or csv format. Returns a
-    generator that yields pieces of the export.
+    """Export the result of a detail query in geojson, csv, ndjson,
+    geojsonseq, parquet or arrow format. Returns a generator that yields pieces of the export.
+
+    If datadump_total is given, the export is split into that many point_date
+    ranges. A datadump_part picks out a single range, and without one, csv
+    exports run every range concurrently and stitch them back together.
     """
     if kwargs.get('data_type') == 'json':
         return datadump_json(**kwargs)
+    if kwargs.get('data_type') in LINE_FORMATS:
+        return datadump_lines(**kwargs)
+    if kwargs.get('data_type') in columnar.MIMETYPES:
+        return datadump_columnar(**kwargs)
+    if kwargs.get('datadump_total', 1) > 1 and kwargs.get('datadump_part') is None:
+        return datadump_csv_parallel(**kwargs)
     return datadump_csv(**kwargs)
 
 
 def datadump_json(**kwargs):
     """Export the result of a detail query as valid geojson, where each row is
     formatted as a feature with its column-value pairs stored in the properties
-    field. Plenario derived columns are hidden.
+    field. Plenario derived columns are hidden. Geometries are rendered by
+    postgres with ST_AsGeoJSON and spliced in as-is, and the features are
+    joined into byte chunks of STREAM_CHUNK_SIZE.
     """
     class ValidatorResultProxy(object):
         pass
@@ -253,75 +377,174 @@ def datadump_json(**kwargs):
     vr_proxy.data = kwargs
 
     dataset = kwargs['dataset']
-    columns = [c.name for c in dataset.c]
-    query = detail_query(vr_proxy)
+    hide = {'geom', 'hash'}
 
-    buffer = ''
-    chunksize = 1000
+    columns = [c for c in dataset.c if c.name not in hide]
+    names = [c.name for c in columns]
+    geometry = sqlalchemy.func.ST_AsGeoJSON(dataset.c.geom)
+    query = detail_query(vr_proxy).with_entities(geometry, *columns)
+    query = _in_point_date_range(query, dataset, *_datadump_part_range(kwargs))
 
-    yield "{'type': 'FeatureCollection', 'features': ["
+    return chunked(_geojson_features(stream(query), names))
 
-    for i, row in enumerate(query.yield_per(chunksize)):
-        wkb = row.geom
 
-        try:
-            geom = shapely.wkb.loads(wkb.desc, hex=True).__geo_interface__
-        except AttributeError:
+def datadump_lines(**kwargs):
+    """Export the result of a detail query as ndjson, one row per line, or as
+    a geojsonseq with one feature per row. Plenario derived columns are
+    hidden, and geometries are rendered by postgres with ST_AsGeoJSON.
+    """
+    class ValidatorResultProxy(object):
+        pass
+
+    vr_proxy = ValidatorResultProxy()
+    vr_proxy.data = kwargs
+
+    dataset = kwargs['dataset']
+    hide = {'geom', 'hash'}
+
+    columns = [c for c in dataset.c if c.name not in hide]
+    names = [c.name for c in columns]
+
+    if kwargs['data_type'] == 'ndjson':
+        query = detail_query(vr_proxy).with_entities(*columns)
+        query = _in_point_date_range(query, dataset, *_datadump_part_range(kwargs))
+        return chunked(ndjson_lines(OrderedDict(zip(names, row)) for row in stream(query)))
+
+    geometry = sqlalchemy.func.ST_AsGeoJSON(dataset.c.geom)
+    query = detail_query(vr_proxy).with_entities(geometry, *columns)
+    query = _in_point_date_range(query, dataset, *_datadump_part_range(kwargs))
+    return chunked(geojsonseq_lines((row[0], OrderedDict(zip(names, row[1:]))) for row in stream(query)))
+
+
+def _geojson_features(rows, names):
+    """Yield the pieces of a geojson feature collection, one feature at a time.
+    Each row is expected to hold its geometry as a geojson string followed by
+    the values for the given property names. Rows without a geometry are left
+    out, because they can't be expressed as a feature.
+    """
+    encoder = json.JSONEncoder(default=unknown_object_json_handler)
+    separator = ''
+
+    yield '{"type": "FeatureCollection", "features": ['
+
+    for row in rows:
+        geometry = row[0]
+        if geometry is None:
             continue
 
-        geojson = {
-            'type': 'Feature',
-            'geometry': geom,
-            'properties': dict(zip(columns, row))
-        }
-        del geojson['properties']['geom']
-        del geojson['properties']['hash']
+        properties = encoder.encode(dict(zip(names, row[1:])))
+        yield '%s{"type": "Feature", "geometry": %s, "properties": %s}' % (
+            separator, geometry, properties)
+        separator = ', '
 
-        buffer += json.dumps(geojson, default=unknown_object_json_handler)
-        buffer += ','
+    yield ']}'
 
-        if i % chunksize == 0:
-            yield buffer
-            buffer = ''
 
-    # Remove the trailing comma and close the json
-    yield buffer.rsplit(',', 1)[0] + ']}'
+def datadump_columnar(**kwargs):
+    """Export the result of a detail query as a parquet file or an arrow
+    stream, typed after the table's columns. Plenario derived columns are
+    hidden, as they are in csv exports.
+    """
+    class ValidatorResultProxy(object):
+        pass
+
+    vr_proxy = ValidatorResultProxy()
+    vr_proxy.data = kwargs
+
+    dataset = kwargs['dataset']
+    hide = {'geom', 'hash'}
+
+    columns = [c for c in dataset.c if c.name not in hide]
+    query = detail_query(vr_proxy).with_entities(*columns)
+    query = _in_point_date_range(query, dataset, *_datadump_part_range(kwargs))
+
+    return columnar.columnar_export(stream(query), columns, kwargs['data_type'])
 
 
 def datadump_csv(**kwargs):
     """Export the result of a detail query as a comma-delimited csv file. The
     header row is taken directly from the table's column list, with Plenario
-    derived values hidden.
+    derived values hidden. The filters of the detail query are compiled into a
+    COPY statement, so postgres writes the csv and we only pass it along.
     """
+    statement = _datadump_csv_statement(kwargs, *_datadump_part_range(kwargs))
+    header = kwargs.get('datadump_part') in (None, 1)
+    return copy_to(statement, read_engine(), header=header, timeout=statement_timeout())
+
+
+def datadump_csv_parallel(**kwargs):
+    """Export the result of a detail query as csv, split into datadump_total
+    point_date ranges that are exported concurrently over separate connections
+    and joined back together in order.
+    """
+    ranges = _point_date_ranges(kwargs['dataset'], kwargs['obs_date__ge'],
+                                kwargs['obs_date__le'], kwargs['datadump_total'])
+    statements = [_datadump_csv_statement(kwargs, lower, upper) for lower, upper in ranges]
+    return copy_many(statements, read_engine(), timeout=statement_timeout())
+
+
+def _datadump_csv_statement(kwargs, lower=None, upper=None):
     class ValidatorResultProxy(object):
         pass
 
     vr_proxy = ValidatorResultProxy()
-    vr_proxy.data = kwargs
+    vr_proxy.data = dict(kwargs)
 
     dataset = kwargs['dataset']
-    query = detail_query(vr_proxy)
-
-    rownum = 0
-    chunksize = 1000
     hide = {'geom', 'hash'}
 
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow([c.name for c in dataset.c if c not in hide])
+    columns = [c for c in dataset.c if c.name not in hide]
+    query = detail_query(vr_proxy).with_entities(*columns)
+    query = _in_point_date_range(query, dataset, lower, upper)
+
+    return query.statement
 
-    for row in query.yield_per(chunksize):
-        rownum += 1
-        writer.writerow([getattr(row, c) for c in row.keys() if c not in hide])
 
-        if rownum % chunksize == 0:
-            yield buffer.getvalue()
-            buffer.close()
-            buffer = io.StringIO()
-            writer = csv.writer(buffer)
+def _datadump_part_range(kwargs):
+    """The (lower, upper) point_date bounds of the requested datadump_part, or
+    no bounds at all if the whole export was asked for.
+    """
+    part = kwargs.get('datadump_part')
+    if part is None:
+        return None, None
+
+    ranges = _point_date_ranges(kwargs['dataset'], kwargs['obs_date__ge'],
+                                kwargs['obs_date__le'], kwargs['datadump_total'])
+    return ranges[part - 1]
+
+
+def _point_date_ranges(dataset, obs_date__ge, obs_date__le, total):
+    """Split the time span of a datadump into total contiguous point_date
+    ranges of equal length. The span is narrowed to the dates the dataset
+    actually covers. The first range is unbounded below and the last one
+    unbounded above, so that together they hold every row of the export and
+    no row falls into two of them.
+
+    :param dataset: (Table) point dataset being exported
+    :param obs_date__ge: (date) start of the export
+    :param obs_date__le: (date) end of the export, inclusive
+    :param total: (int) number of ranges
+    :returns: (list) of (lower, upper) datetimes, None where unbounded
+    """
+    meta = MetaTable.get_by_dataset_name(dataset.name)
+
+    starts = [d for d in (obs_date__ge, meta.obs_from) if d is not None]
+    ends = [d for d in (obs_date__le, meta.obs_to) if d is not None]
 
-    yield buffer.getvalue()
-    buffer.close()
+    start = datetime.combine(max(starts), datetime.min.time())
+    end = datetime.combine(min(ends), datetime.min.time()) + timedelta(days=1)
+    step = max(end - start, timedelta(0)) / total
+
+    boundaries = [start + step * i for i in range(1, total)]
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+
+def _in_point_date_range(query, dataset, lower=None, upper=None):
+    if lower is not None:
+        query = query.filter(dataset.c.point_date >= lower)
+    if upper is not None:
+        query = query.filter(dataset.c.point_date < upper)
+    return query
 
 
 def detail_query(args, aggregate=False):
@@ -387,13 +610,19 @@ def detail_query(args, aggregate=False):
     return q
 
 
-def _grid(args):
+@timed('build')
+def _grid_queries(args):
+    """Build the grid aggregation query for each dataset of the request.
+
+    :param args: ValidatorResult of the request
+    :returns: (list) of (query, size_x, size_y) or an error
+    """
     meta_params = ('dataset', 'geom', 'resolution', 'buffer', 'obs_date__ge',
                    'obs_date__le')
     meta_vals = (args.data.get(k) for k in meta_params)
     point_table, geom, resolution, buffer_, obs_date__ge, obs_date__le = meta_vals
 
-    result_rows = []
+    grid_queries = []
 
     if not has_tree_filters(args.data):
         tname = point_table.name
@@ -415,15 +644,30 @@ def _grid(args):
 
         try:
             registry_row = MetaTable.get_by_dataset_name(table.name)
-            # make_grid expects conditions to be iterable.
-            grid_rows, size_x, size_y = registry_row.make_grid(
+            # grid_query expects conditions to be iterable.
+            grid_queries.append(registry_row.grid_query(
                 resolution,
                 geom,
                 [conditions],
                 {'upper': obs_date__le, 'lower': obs_date__ge}
-            )
-            result_rows += grid_rows
+            ))
+        except Exception as e:
+            msg = 'Could not make grid aggregation.'
+            return api_response.make_raw_error('{}: {}'.format(msg, e))
+
+    return grid_queries
+
+
+@timed('fetch')
+def _grid(grid_queries):
+    result_rows = []
+    size_x = size_y = None
+
+    for q, size_x, size_y in grid_queries:
+        try:
+            result_rows += postgres_session.execute(q)
         except Exception as e:
+            postgres_session.rollback()
             msg = 'Could not make grid aggregation.'
             return api_response.make_raw_error('{}: {}'.format(msg, e))
 
@@ -520,8 +764,8 @@ def request_args_to_condition_tree(request_args, ignore=list()):
     :param ignore: what values to not use for building conditions
     :returns: condition tree
     """
-    ignored = {'agg', 'data_type', 'dataset', 'geom', 'limit', 'offset',
-               'shape', 'shapeset', 'job', 'all', 'datadump_part', 'datadump_total',
+    ignored = {'agg', 'data_type', 'dataset', 'geom', 'limit', 'offset', 'cursor',
+               'next_cursor', 'shape', 'shapeset', 'job', 'all', 'datadump_part', 'datadump_total',
                'datadump_requestid', 'datadump_urlroot', 'jobsframework_ticket', 'jobsframework_workerid',
                'jobsframework_workerbirthtime'}
     for val in ignore:
@@ -10,6 +10,7 @@ import shapely.wkb
 from flask import jsonify, make_response, request
 
 from plenario.api.common import date_json_handler, make_csv, unknown_object_json_handler
+from plenario.metrics import timed
 from plenario.models import ShapeMetadata
 from plenario.utils.ogr2ogr import OgrExport
 
@@ -114,6 +115,7 @@ def form_json_detail_response(to_remove, validator, rows):
     resp = json_response_base(validator, rows)
     resp['meta']['total'] = len(resp['objects'])
     resp['meta']['query'] = request.args
+    resp['meta']['next_cursor'] = validator.data.get('next_cursor') if validator else None
     resp = make_response(
         json.dumps(resp, default=unknown_object_json_handler),
         200
@@ -157,6 +159,7 @@ def form_geojson_detail_response(to_remove, rows):
     return resp
 
 
+@timed('geometry')
 def convert_result_geoms(result):
     """Given a list of rows, convert the geom for each row from a shape
     to a list of coordinates.
@@ -178,6 +181,7 @@ def convert_result_geoms(result):
 
 # Point Endpoint Repsonses ====================================================
 
+@timed('serialize')
 def detail_aggregate_response(query_result, query_args):
     datatype = query_args.data['data_type']
 
@@ -195,6 +199,7 @@ def detail_aggregate_response(query_result, query_args):
     return resp
 
 
+@timed('serialize')
 def meta_response(query_result, query_args):
     resp = json_response_base(query_args, query_result, request.args)
     resp['meta']['total'] = len(resp['objects'])
@@ -204,6 +209,7 @@ def meta_response(query_result, query_args):
     return resp
 
 
+@timed('serialize')
 def fields_response(query_result, query_args):
     resp = json_response_base(query_args, query_result, request.args)
     resp['objects'] = query_result[0]['columns']
@@ -213,6 +219,7 @@ def fields_response(query_result, query_args):
     return resp
 
 
+@timed('serialize')
 def detail_response(query_result, query_args):
     to_remove = ['point_date', 'hash']
 
@@ -229,6 +236,7 @@ def detail_response(query_result, query_args):
 
 # Shape Endpoint Responses ====================================================
 
+@timed('serialize')
 def aggregate_point_data_response(data_type, rows, dataset_names):
     if data_type == 'csv':
         return form_csv_detail_response(['hash', 'ogc_fid'], rows, dataset_names)
@@ -4,13 +4,13 @@ import shapely.geometry
 import shapely.wkb
 import sqlalchemy as sa
 from flask import jsonify, make_response, request
-from sqlalchemy import Table, func
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 
 from plenario.api.common import CACHE_TIMEOUT, RESPONSE_LIMIT, cache, crossdomain, date_json_handler, make_cache_key
 from plenario.api.response import make_error
-from plenario.database import postgres_base, postgres_engine as engine, postgres_session
-from plenario.utils.helpers import get_size_in_degrees
+from plenario.database import postgres_engine as engine, postgres_session
+from plenario.utils.helpers import get_size_in_degrees, reflect
 
 
 @cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
@@ -18,13 +18,7 @@ from plenario.utils.helpers import get_size_in_degrees
 def weather_stations():
     raw_query_params = request.args.copy()
 
-    stations_table = Table(
-        'weather_stations',
-        postgres_base.metadata,
-        autoload=True,
-        autoload_with=engine,
-        extend_existing=True
-    )
+    stations_table = reflect('weather_stations', engine)
 
     valid_query, query_clauses, resp, status_code = make_query(stations_table, raw_query_params)
     if valid_query:
@@ -59,21 +53,9 @@ def weather_stations():
 def weather(table):
     raw_query_params = request.args.copy()
 
-    weather_table = Table(
-        'dat_weather_observations_{}'.format(table),
-        postgres_base.metadata,
-        autoload=True,
-        autoload_with=engine,
-        extend_existing=True
-    )
+    weather_table = reflect('dat_weather_observations_{}'.format(table), engine)
 
-    stations_table = Table(
-        'weather_stations',
-        postgres_base.metadata,
-        autoload=True,
-        autoload_with=engine,
-        extend_existing=True
-    )
+    stations_table = reflect('weather_stations', engine)
 
     valid_query, query_clauses, resp, status_code = make_query(weather_table,
                                                                raw_query_params)
@@ -180,8 +162,7 @@ def wban_is_valid(wban):
         return False
 
     try:
-        stations_table = Table('weather_stations', postgres_base.metadata,
-                               autoload=True, autoload_with=engine, extend_existing=True)
+        stations_table = reflect('weather_stations', engine)
         q = sa.select([stations_table.c['wban_code']]).where(stations_table.c['wban_code'] == wban)
         result = postgres_session.execute(q)
     except SQLAlchemyError:
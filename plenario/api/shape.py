@@ -5,7 +5,7 @@ from flask import make_response, request
 from sqlalchemy import func
 from sqlalchemy.exc import NoSuchTableError
 
-from plenario.api.common import crossdomain, extract_first_geometry_fragment, make_fragment_str
+from plenario.api.common import conditional, crossdomain, extract_first_geometry_fragment, make_fragment_str
 from plenario.api.condition_builder import parse_tree
 from plenario.api.jobs import make_job_response
 from plenario.api.point import detail_query
@@ -81,6 +81,7 @@ def aggregate_point_data(point_dataset_name, polygon_dataset_name):
         )
 
 
+@conditional
 @crossdomain(origin='*')
 def export_shape(dataset_name):
     """Route for /shapes/<shapeset>/ endpoint. Requires a dataset argument
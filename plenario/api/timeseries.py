@@ -10,11 +10,15 @@ from marshmallow.decorators import pre_dump, post_load
 from marshmallow.fields import Str, List
 from marshmallow.validate import OneOf
 
-from plenario.api.common import crossdomain, cache, CACHE_TIMEOUT, make_cache_key
+from plenario.api.common import client_disconnected, crossdomain, CACHE_SOFT_TIMEOUT, CACHE_TIMEOUT, single_flight
 from plenario.api.condition_builder import parse_tree
+from plenario.api.cost import cost_guard
 from plenario.api.fields import Geometry, Pointset, DateTime, Commalist
+from plenario.api.jobs import is_uncached_request
 from plenario.api.response import make_error, make_csv, make_response
 from plenario.api.validator import has_tree_filters
+from plenario.database import statement_timeout
+from plenario.metrics import timed
 from plenario.models import MetaTable
 
 
@@ -48,12 +52,13 @@ class TimeseriesValidator(Schema):
         return data
 
 
-@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=make_cache_key)
+@single_flight(timeout=CACHE_TIMEOUT, soft_timeout=CACHE_SOFT_TIMEOUT, background=True, unless=is_uncached_request)
 @crossdomain(origin='*')
 def timeseries():
     validator = TimeseriesValidator()
 
-    deserialized_arguments = validator.load(request.args)
+    with timed('validate'):
+        deserialized_arguments = validator.load(request.args)
     serialized_arguments = json.loads(validator.dumps(deserialized_arguments.data).data)
 
     if deserialized_arguments.errors:
@@ -90,7 +95,15 @@ def timeseries():
     if not point_set_names:
         point_set_names = MetaTable.index()
 
-    results = MetaTable.timeseries_all(point_set_names, agg, start_date, end_date, geom, ctrees)
+    with timed('build'):
+        selects = MetaTable.timeseries_selects(point_set_names, agg, start_date, end_date, geom, ctrees)
+
+    guarded = cost_guard('timeseries', deserialized_arguments, selects)
+    if guarded is not None:
+        return guarded
+
+    with timed('fetch'):
+        results = MetaTable.timeseries_panel(selects, timeout=statement_timeout(), abandoned=client_disconnected)
 
     payload = {
         'meta': {
@@ -105,6 +118,11 @@ def timeseries():
     if ctrees:
         payload['meta']['query']['filters'] = raw_ctrees
 
+    return _timeseries_response(payload, data_type)
+
+
+@timed('serialize')
+def _timeseries_response(payload, data_type):
     if data_type == 'json':
         return jsonify(payload)
 
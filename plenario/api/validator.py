@@ -5,19 +5,20 @@ from datetime import datetime, timedelta
 
 import sqlalchemy
 from dateutil import parser
-from marshmallow import fields, Schema
+from marshmallow import fields, Schema, validates_schema
 from marshmallow.fields import Field
 from marshmallow.validate import Range, OneOf, ValidationError
-from sqlalchemy import MetaData
 from sqlalchemy.exc import DatabaseError, NoSuchTableError, ProgrammingError
 
-from plenario.api.common import extract_first_geometry_fragment, make_fragment_str
+from plenario.api.common import decode_cursor, extract_first_geometry_fragment, make_fragment_str
 from plenario.api.condition_builder import field_ops
-from plenario.database import postgres_session, redshift_engine
+from plenario.database import postgres_session
+from plenario.metrics import timed
 from plenario.models import MetaTable, ShapeMetadata
+from plenario.settings import DATADUMP_MAX_PARTS
 from plenario.models.SensorNetwork import FeatureMeta, NetworkMeta, NodeMeta, SensorMeta
 from plenario.sensor_network.api.sensor_aggregate_functions import aggregate_fn_map
-from plenario.utils.helpers import reflect
+from plenario.sensor_network.redshift_ops import feature_table
 
 
 class Pointset(Field):
@@ -48,7 +49,7 @@ def validate_dataset(dataset_name):
 
 
 def validate_shapeset(name):
-    if not ShapeMetadata.query.get(name):
+    if not ShapeMetadata.get_by_dataset_name(name):
         raise ValidationError('Invalid shape name: {}.'.format(name))
 
 
@@ -64,6 +65,13 @@ def validate_geom(geojson_str):
         raise ValidationError('Invalid geom: {}'.format(geojson_str))
 
 
+def validate_cursor(cursor):
+    try:
+        decode_cursor(cursor)
+    except ValueError:
+        raise ValidationError('Invalid cursor: {}'.format(cursor))
+
+
 def validate_network(network):
     if network.lower() not in NetworkMeta.index():
         raise ValidationError('Invalid network name: {}'.format(network))
@@ -131,6 +139,8 @@ class Validator(Schema):
     resolution = fields.Integer(default=500, validate=Range(0))
     job = fields.Bool(default=False)
     all = fields.Bool(default=False)
+    datadump_part = fields.Integer(default=None, validate=Range(1, DATADUMP_MAX_PARTS))
+    datadump_total = fields.Integer(default=1, validate=Range(1, DATADUMP_MAX_PARTS))
 
 
 class DatasetRequiredValidator(Validator):
@@ -168,6 +178,30 @@ class NoGeoJSONDatasetRequiredValidator(DatasetRequiredValidator):
     data_type = fields.Str(default='json', validate=OneOf(valid_formats))
 
 
+class DetailValidator(DatasetRequiredValidator):
+    """/detail can also stream its records line by line, and pages through
+    them with a cursor.
+    """
+    valid_formats = {'csv', 'geojson', 'json', 'ndjson', 'geojsonseq'}
+    data_type = fields.Str(default='json', validate=OneOf(valid_formats))
+    cursor = fields.Str(default=None, validate=validate_cursor)
+
+    @validates_schema
+    def validate_paging(self, data):
+        # The cursor already says where the page starts, an offset on top of
+        # it would skip rows on every page.
+        if data.get('cursor') and data.get('offset'):
+            raise ValidationError('Provide either a cursor or an offset, not both.')
+
+
+class ExportValidator(DatasetRequiredValidator):
+    """/datadump can also export typed, columnar files and stream its records
+    line by line.
+    """
+    valid_formats = {'csv', 'geojson', 'json', 'ndjson', 'geojsonseq', 'parquet', 'arrow'}
+    data_type = fields.Str(default='json', validate=OneOf(valid_formats))
+
+
 class NoDefaultDatesValidator(Validator):
     """Some endpoints, specifically /datasets, will not return results with
     the original default dates (because the time window is so small).
@@ -250,6 +284,7 @@ converters = {
     'date': lambda x: parser.parse(x).date(),
     'point_date': lambda x: parser.parse(x),
     'offset': int,
+    'cursor': lambda x: decode_cursor(x) if x is not None else None,
     'resolution': int,
     'geom': lambda x: make_fragment_str(extract_first_geometry_fragment(x)),
     'start_datetime': lambda x: x.isoformat().split('+')[0],
@@ -304,6 +339,7 @@ def marshmallow_validate(validator, args):
     return result
 
 
+@timed('validate')
 def validate(validator, request_args):
     """Validate a dictionary of arguments. Substitute all missing fields with
     defaults if not explicitly told to do otherwise.
@@ -362,7 +398,7 @@ def validate(validator, request_args):
             # These keys just have to do with the formatting of the JSON response.
             # We keep these values around even if they have no effect on a condition
             # tree.
-            elif key in {'geom', 'offset', 'limit', 'agg', 'obs_date__le', 'obs_date__ge'}:
+            elif key in {'geom', 'offset', 'cursor', 'limit', 'agg', 'obs_date__le', 'obs_date__ge'}:
                 pass
 
             # These keys are also ones that should be passed over when searching for
@@ -450,7 +486,7 @@ def sensor_network_validate(validator, request_args):
             t_name = result.data['feature']
             cond_tree['col'] = cond_tree['prop']
             del cond_tree['prop']
-            table = reflect(t_name, MetaData(), redshift_engine)
+            table = feature_table(t_name)
             if valid_tree(table, cond_tree):
                 result.data['filter'] = cond_tree
         except (ValueError, KeyError) as err:
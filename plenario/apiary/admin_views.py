@@ -8,6 +8,7 @@ from flask_login import current_user
 from sqlalchemy import func
 from wtforms import StringField
 
+from plenario import registry
 from plenario.database import postgres_session
 from plenario.models.SensorNetwork import NetworkMeta
 from plenario.sensor_network.redshift_ops import create_foi_table, table_exists
@@ -43,6 +44,14 @@ class BaseMetaView(ModelView):
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for('auth.login'))
 
+    def after_model_change(self, form, model, is_created):
+        # Every process rebuilds its sensor network topology from the new
+        # metadata, see plenario.registry
+        registry.invalidate()
+
+    def after_model_delete(self, model):
+        registry.invalidate()
+
 
 class NetworkMetaView(BaseMetaView):
     column_list = ('name', 'nodes', 'info')
@@ -4,8 +4,8 @@ from flask import Blueprint
 from redis import Redis
 from sqlalchemy import desc, select
 
-from plenario.database import redshift_base as rshift_base
 from plenario.models.SensorNetwork import SensorMeta
+from plenario.sensor_network.redshift_ops import feature_table
 from plenario.settings import REDIS_HOST
 
 blueprint = Blueprint('apiary', __name__)
@@ -16,8 +16,7 @@ def index() -> list:
     """Generate the information necessary for displaying unknown features on the
     admin index page.
     """
-    rshift_base.metadata.reflect()
-    unknown_features = rshift_base.metadata.tables['unknown_feature']
+    unknown_features = feature_table('unknown_feature')
 
     query = select([unknown_features]) \
         .order_by(desc(unknown_features.c.datetime)) \
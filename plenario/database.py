@@ -1,29 +1,214 @@
+import select
+import socket
 import subprocess
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from contextlib import contextmanager
+from functools import partial
 from logging import getLogger
+from queue import Queue
+from tempfile import TemporaryFile
+from threading import Event, Thread
+from time import time as now
 
-from sqlalchemy import create_engine
+from flask import current_app, has_request_context, request
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import CompoundSelect, Select
 
-from plenario.settings import DATABASE_CONN, REDSHIFT_CONN
+from plenario.settings import DATABASE_CONN, DATABASE_READ_CONN, POSTGRES_MAX_OVERFLOW, POSTGRES_POOL_PRE_PING, \
+    POSTGRES_POOL_RECYCLE, POSTGRES_POOL_SIZE, POSTGRES_POOL_TIMEOUT, REDSHIFT_CONN, REDSHIFT_MAX_OVERFLOW, \
+    REDSHIFT_POOL_PRE_PING, REDSHIFT_POOL_RECYCLE, REDSHIFT_POOL_SIZE, REDSHIFT_POOL_TIMEOUT, REPLICA_CHECK, \
+    REPLICA_RETRY, STREAM_CHUNK_SIZE, STREAM_FETCH_SIZE
 
 
 logger = getLogger(__name__)
 
+# Functions called with (pool name, seconds waited, connections checked out,
+# pool capacity, whether the checkout timed out) after every checkout that
+# had to get a connection from an InstrumentedQueuePool
+pool_observers = []
 
-postgres_engine = create_engine(DATABASE_CONN)
-postgres_session = scoped_session(sessionmaker(bind=postgres_engine))
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a connection,
+    and how much of the pool was in use, to the pool_observers.
+    """
+
+    def _do_get(self):
+        start = now()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = now() - start
+            capacity = self.size() + max(self._max_overflow, 0)
+            for observer in pool_observers:
+                try:
+                    observer(self.logging_name, waited, self.checkedout(), capacity, timed_out)
+                except Exception:
+                    logger.exception('Pool observer failed.')
+
+
+def _ping(dbapi_connection, connection_record, connection_proxy):
+    # Test connections before handing them out, so that a connection the
+    # server dropped is replaced instead of failing the first query run on it.
+    try:
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Exception:
+        raise DisconnectionError()
+
+
+def make_engine(url: str, name: str, size: int, overflow: int, timeout: int,
+                recycle: int, pre_ping: bool) -> Engine:
+    """Create an engine whose connections are kept in an InstrumentedQueuePool.
+
+    :param url: (str) database to connect to
+    :param name: (str) name the pool is reported under
+    :param size: (int) connections kept open
+    :param overflow: (int) connections opened on top of size when needed
+    :param timeout: (int) seconds to wait for a connection when all are in use
+    :param recycle: (int) seconds after which a connection is replaced
+    :param pre_ping: (bool) test connections before handing them out
+    """
+    engine = create_engine(url, poolclass=InstrumentedQueuePool, pool_logging_name=name,
+                           pool_size=size, max_overflow=overflow, pool_timeout=timeout,
+                           pool_recycle=recycle)
+    if pre_ping:
+        event.listen(engine, 'checkout', _ping)
+    return engine
+
+
+class RoutingSession(Session):
+    """Session that sends selects to the replica, if there is one and it can
+    be reached, when it serves a request for one of the views in
+    REPLICA_MODULES. Everything else, and every statement of other requests,
+    goes to its bind, the primary.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.replica = replica() if _serves_replica_module() else None
+
+    def get_bind(self, mapper=None, clause=None):
+        # Writes, DDL and statements that can't be told apart from them, like
+        # EXPLAIN or plain text, stay on the primary.
+        if self.replica is not None and isinstance(clause, (Select, CompoundSelect)):
+            return self.replica
+        return super().get_bind(mapper, clause)
+
+
+def read_engine() -> Engine:
+    """The engine the selects of the current session go to, for running them
+    or reflecting the tables they read outside of the session.
+    """
+    return postgres_session().replica or postgres_engine
+
+
+postgres_engine = make_engine(DATABASE_CONN, 'postgres', *_postgres_pool)
+postgres_read_engine = make_engine(DATABASE_READ_CONN, 'postgres_read', *_postgres_pool) if DATABASE_READ_CONN else None
+postgres_session = scoped_session(sessionmaker(class_=RoutingSession, bind=postgres_engine))
 postgres_base = declarative_base(bind=postgres_engine)
 postgres_base.query = postgres_session.query_property()
 
-redshift_engine = create_engine(REDSHIFT_CONN, max_overflow=-1)
+redshift_engine = make_engine(REDSHIFT_CONN, 'redshift', *_redshift_pool)
 redshift_session = scoped_session(sessionmaker(bind=redshift_engine, autocommit=True))
 redshift_base = declarative_base(bind=redshift_engine)
 redshift_base.query = redshift_session.query_property()
 
 
+# Time until which the replica is considered unreachable
+_replica_down_until = 0
+# Time until which the replica is considered reachable without checking again
+_replica_up_until = 0
+
+
+def replica():
+    """The engine of the read replica, or None if there is no replica or it
+    couldn't be reached in the last REPLICA_RETRY seconds. Reachability is
+    checked at most once every REPLICA_CHECK seconds, not for every session.
+    """
+    global _replica_down_until, _replica_up_until
+
+    if postgres_read_engine is None or now() < _replica_down_until:
+        return None
+    if now() < _replica_up_until:
+        return postgres_read_engine
+    try:
+        postgres_read_engine.connect().close()
+    except DBAPIError:
+        logger.warning('Read replica unreachable, reading from the primary for '
+                       'the next {} seconds.'.format(REPLICA_RETRY), exc_info=True)
+        _replica_down_until = now() + REPLICA_RETRY
+        return None
+    _replica_up_until = now() + REPLICA_CHECK
+    return postgres_read_engine
+
+
+def _serves_replica_module():
+    if not has_request_context() or request.endpoint is None:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, '__module__', None) in current_app.config.get('REPLICA_MODULES', ())
+
+
+class QueryAbandoned(Exception):
+    """Raised when the statements run for a request are cancelled because the
+    client that made it went away.
+    """
+
+
+def statement_timeout() -> int:
+    """Milliseconds that a statement run for the current API request may take,
+    from the STATEMENT_TIMEOUTS of the app by endpoint, or STATEMENT_TIMEOUT
+    for endpoints that aren't listed. Statements run outside of the api
+    blueprint, like those of the admin views and ETL tasks, and those of jobs
+    being run by a worker, aren't limited. 0 means no limit.
+    """
+    if not has_request_context() or request.blueprint != 'api':
+        return 0
+    from plenario.api.jobs import is_job_request
+    if is_job_request():
+        return 0
+    config = current_app.config
+    return config.get('STATEMENT_TIMEOUTS', {}).get(request.endpoint, config.get('STATEMENT_TIMEOUT', 0))
+
+
+def set_statement_timeout(connection, timeout: int) -> None:
+    """Limit the statements of the current transaction to timeout milliseconds.
+    """
+    connection.execute('SET LOCAL statement_timeout = {:d}'.format(timeout))
+
+
+@event.listens_for(postgres_session, 'after_begin')
+def _limit_postgres_transaction(session, transaction, connection):
+    timeout = statement_timeout()
+    if timeout:
+        set_statement_timeout(connection, timeout)
+
+
+@event.listens_for(redshift_engine, 'checkout')
+def _limit_redshift_connection(dbapi_connection, connection_record, connection_proxy):
+    # The redshift session runs in autocommit mode, so there are no transactions
+    # to scope the timeout to. Set it on the connection as it is checked out
+    # instead, skipping the round trip when it already has the right value.
+    timeout = statement_timeout()
+    if connection_record.info.get('statement_timeout') != timeout:
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout TO %s', (timeout,))
+        # Otherwise the setting is rolled back when the connection is returned
+        dbapi_connection.commit()
+        connection_record.info['statement_timeout'] = timeout
+
+
 def create_database(bind: Engine, database: str) -> None:
     """Setup a database (schema) in postgresql.
     """
@@ -61,6 +246,279 @@ def psql(path: str) -> None:
     subprocess.check_call(command, shell=True)
 
 
+def socket_closed(sock) -> bool:
+    """Whether the other end of a socket has closed the connection. False for
+    no socket at all, since then it can't be told.
+    """
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A closed connection reads as readable with nothing to read.
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        # The socket was closed on our side, because the response was sent.
+        return False
+
+
+def stream(query, fetch_size=STREAM_FETCH_SIZE, abandoned=None, poll: float = 0.5):
+    """Iterate over the rows of a query through a named, server-side cursor.
+    Only fetch_size rows are held by the worker at any one time, so memory
+    stays flat regardless of how many rows the query returns.
+
+    When called for a request served by gunicorn, the query is cancelled with
+    pg_cancel_backend as soon as the client disconnects, and QueryAbandoned is
+    raised in place of the rest of the rows.
+
+    :param query: (Query) SQLAlchemy ORM query
+    :param fetch_size: (int) rows to pull from the database per round trip
+    :param abandoned: (callable) whether the rows are no longer wanted,
+                      defaults to whether the client of the request went away
+    :param poll: (float) seconds between calls to abandoned
+    :returns: iterable over the result rows
+    """
+    query = query.execution_options(stream_results=True).yield_per(fetch_size)
+    if abandoned is None and has_request_context():
+        sock = request.environ.get('gunicorn.socket')
+        if sock is not None:
+            abandoned = partial(socket_closed, sock)
+    if abandoned is None:
+        return query
+    return _stream_until_abandoned(query, abandoned, poll)
+
+
+def _stream_until_abandoned(query, abandoned, poll):
+    # Run the statement on a connection we can see, so that a watcher thread
+    # knows which backend to cancel. This is the connection the query would
+    # have used, the one of the session's transaction or a new one for an
+    # autocommit session.
+    connection = query.session.connection(clause=query.statement, close_with_result=True)
+    pid = connection.connection.get_backend_pid()
+    finished = Event()
+    gone = Event()
+
+    def watch():
+        while not finished.wait(poll):
+            if abandoned():
+                gone.set()
+                cancel_backends([pid], connection.engine)
+                return
+
+    Thread(target=watch, daemon=True).start()
+    try:
+        result = connection.execution_options(stream_results=True).execute(query.statement)
+        try:
+            yield from query.instances(result)
+        finally:
+            result.close()
+    except DBAPIError:
+        if gone.is_set():
+            raise QueryAbandoned('Client disconnected, gave up on the query.')
+        raise
+    finally:
+        finished.set()
+
+
+class _ChunkWriter(object):
+    """File-like target for psycopg2's copy_expert. Collects the rows written
+    by COPY into chunks of roughly chunk_size bytes and hands each one off to
+    a queue.
+    """
+
+    def __init__(self, queue: Queue, chunk_size: int):
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.queue.put(b''.join(self.parts))
+        self.parts = []
+        self.size = 0
+
+
+def fetch_all(selectables, engine: Engine = postgres_engine, max_workers: int = 1,
+              timeout: int = 0, abandoned=None, poll: float = 0.5):
+    """Run several selects at the same time, each on its own connection, and
+    return their rows in order. If one of them fails, or the abandoned
+    callable returns True while they are running, the selects that are still
+    going are cancelled with pg_cancel_backend.
+
+    :param selectables: (list) statements to run
+    :param engine: (Engine) database to run them against
+    :param max_workers: (int) number of selects to run at a time
+    :param timeout: (int) milliseconds each select may take, 0 for no limit
+    :param abandoned: (callable) whether the results are no longer wanted
+    :param poll: (float) seconds between calls to abandoned
+    :returns: (list) of lists of rows
+    """
+    pids = {}
+
+    def fetch(index, selectable):
+        with engine.connect() as connection:
+            pids[index] = connection.connection.get_backend_pid()
+            try:
+                with connection.begin():
+                    if timeout:
+                        set_statement_timeout(connection, timeout)
+                    return connection.execute(selectable).fetchall()
+            finally:
+                del pids[index]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch, i, s) for i, s in enumerate(selectables)]
+        try:
+            while True:
+                done, pending = wait(futures, timeout=poll, return_when=FIRST_EXCEPTION)
+                if not pending or any(f.exception() for f in done):
+                    return [future.result() for future in futures]
+                if abandoned is not None and abandoned():
+                    raise QueryAbandoned('Client disconnected, gave up on {} queries.'.format(len(pending)))
+        finally:
+            for future in futures:
+                future.cancel()
+            cancel_backends(list(pids.values()), engine)
+
+
+def cancel_backends(pids, engine: Engine = postgres_engine) -> None:
+    """Cancel whatever the given backends are running, using a connection of
+    its own since the ones that are busy can't be used to do it.
+    """
+    if not pids:
+        return
+    logger.info('Cancelling queries on backends {}'.format(pids))
+    with engine.connect() as connection:
+        for pid in pids:
+            connection.execute('SELECT pg_cancel_backend(%s)', (pid,))
+
+
+def copy_to(selectable, engine: Engine = postgres_engine, header: bool = True,
+            chunk_size: int = STREAM_CHUNK_SIZE, timeout: int = 0):
+    """Export the result of a select as csv using COPY TO STDOUT, and yield
+    the output in chunks of bytes as postgres produces it. The rows never
+    pass through SQLAlchemy, so the only work done in python is moving bytes.
+
+    COPY runs in a background thread that feeds a bounded queue, so a slow
+    consumer holds back the export instead of buffering it in memory. If the
+    consumer goes away early, the running COPY is cancelled.
+
+    :param selectable: (Select) statement whose results are exported
+    :param engine: (Engine) database to run the export against
+    :param header: (bool) whether to write a header row
+    :param chunk_size: (int) approximate size of the yielded chunks
+    :param timeout: (int) milliseconds the export may take, 0 for no limit
+    """
+    compiled = selectable.compile(dialect=engine.dialect)
+    connection = engine.raw_connection()
+
+    try:
+        with connection.cursor() as cursor:
+            select_sql = cursor.mogrify(str(compiled), compiled.params)
+    except Exception:
+        connection.close()
+        raise
+    copy_sql = b'COPY (' + select_sql + b') TO STDOUT WITH CSV'
+    if header:
+        copy_sql += b' HEADER'
+
+    chunks = Queue(maxsize=8)
+    writer = _ChunkWriter(chunks, chunk_size)
+
+    def export():
+        try:
+            with connection.cursor() as cursor:
+                if timeout:
+                    cursor.execute('SET LOCAL statement_timeout = %s', (timeout,))
+                cursor.copy_expert(copy_sql, writer)
+            writer.flush()
+            chunks.put(None)
+        except Exception as exc:
+            chunks.put(exc)
+
+    thread = Thread(target=export, daemon=True)
+    thread.start()
+
+    finished = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                finished = True
+                return
+            if isinstance(chunk, Exception):
+                finished = True
+                raise chunk
+            yield chunk
+    finally:
+        if not finished:
+            # The consumer stopped early, stop the query and unblock the
+            # exporting thread so that it can wind down.
+            connection.cancel()
+            while not isinstance(chunks.get(), (Exception, type(None))):
+                pass
+        thread.join()
+        connection.close()
+
+
+def copy_many(selectables, engine: Engine = postgres_engine, header: bool = True,
+              chunk_size: int = STREAM_CHUNK_SIZE, timeout: int = 0):
+    """Export several selects as a single csv, in order, with every COPY
+    running at the same time on its own connection. The first select is
+    streamed as postgres produces it, while the others are spooled to
+    temporary files and passed along once the stream reaches them. Only the
+    first part is given a header row.
+
+    :param selectables: (list) statements whose results are exported
+    :param engine: (Engine) database to run the export against
+    :param header: (bool) whether to write a header row
+    :param chunk_size: (int) approximate size of the yielded chunks
+    :param timeout: (int) milliseconds each export may take, 0 for no limit
+    """
+    first, rest = selectables[0], selectables[1:]
+    stop = Event()
+
+    def spool(selectable):
+        spooled = TemporaryFile()
+        try:
+            chunks = copy_to(selectable, engine, header=False, chunk_size=chunk_size, timeout=timeout)
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    spooled.write(chunk)
+            finally:
+                chunks.close()
+        except Exception:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return spooled
+
+    executor = ThreadPoolExecutor(max_workers=max(len(rest), 1))
+    futures = [executor.submit(spool, selectable) for selectable in rest]
+
+    try:
+        yield from copy_to(first, engine, header=header, chunk_size=chunk_size, timeout=timeout)
+        for future in futures:
+            with future.result() as spooled:
+                yield from iter(lambda: spooled.read(chunk_size), b'')
+    finally:
+        # Tell the remaining exports to give up if the consumer went away,
+        # and clean up whatever they already wrote.
+        stop.set()
+        executor.shutdown(wait=True)
+        for future in futures:
+            if future.exception() is None:
+                future.result().close()
+
+
 @contextmanager
 def postgres_session_context():
     """A helper method for keeping the state of an connection with the database
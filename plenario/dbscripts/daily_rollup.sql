@@ -0,0 +1,7 @@
+-- Metadata tables created before rollup presence was tracked need the column
+-- added, and marked for the datasets whose rollups were already built.
+
+ALTER TABLE meta_master ADD COLUMN IF NOT EXISTS has_daily_rollup boolean NOT NULL DEFAULT false;
+
+UPDATE meta_master SET has_daily_rollup = true
+WHERE to_regclass(quote_ident(dataset_name || '__daily')) IS NOT NULL;
@@ -0,0 +1,5 @@
+-- Metadata tables created before data versions were tracked need the column
+-- added, create_all leaves existing tables alone.
+
+ALTER TABLE meta_master ADD COLUMN IF NOT EXISTS data_version integer NOT NULL DEFAULT 0;
+ALTER TABLE meta_shape ADD COLUMN IF NOT EXISTS data_version integer NOT NULL DEFAULT 0;
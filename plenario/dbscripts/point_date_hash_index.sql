@@ -0,0 +1,20 @@
+-- Point tables created before /detail paged by (point_date, hash) only have
+-- an index on point_date, add the composite index that keyset paging needs.
+-- Index names match point_date_hash_index in plenario/etl/point.py.
+
+DO $$
+DECLARE
+  point_table text;
+BEGIN
+  FOR point_table IN
+    SELECT dataset_name FROM meta_master
+    WHERE to_regclass(quote_ident(dataset_name)) IS NOT NULL
+  LOOP
+    EXECUTE format(
+      'CREATE INDEX IF NOT EXISTS %I ON %I (point_date, hash)',
+      left('ix_' || point_table || '_point_date_hash', 63),
+      point_table
+    );
+  END LOOP;
+END
+$$;
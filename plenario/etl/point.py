@@ -4,7 +4,7 @@
 import csv
 from logging import getLogger
 from geoalchemy2 import Geometry
-from sqlalchemy import TIMESTAMP, Table, Column, MetaData, String
+from sqlalchemy import TIMESTAMP, Table, Column, Index, MetaData, String
 from sqlalchemy import select, func
 from sqlalchemy.exc import NoSuchTableError
 
@@ -245,8 +245,10 @@ class Creation(object):
             Column('point_date', TIMESTAMP, nullable=True, index=True),
             Column('geom', Geometry('POINT', srid=4326),
                    nullable=True, index=True)]
+        # Backs the keyset paging of /detail, which orders by both
+        keyset_index = Index(point_date_hash_index(self.dataset.name), 'point_date', 'hash')
         new_table = Table(self.dataset.name, MetaData(),
-                          *(original_cols + derived_cols))
+                          *(original_cols + derived_cols + [keyset_index]))
 
         new_table.drop(postgres_engine, checkfirst=True)
         new_table.create(postgres_engine)
@@ -382,6 +384,13 @@ class Update(object):
         return geom_col
 
 
+def point_date_hash_index(table_name):
+    """Name of the (point_date, hash) index of a point table, cut to the
+    length postgres allows, as dbscripts/point_date_hash_index.sql does.
+    """
+    return 'ix_{}_point_date_hash'.format(table_name)[:63]
+
+
 def update_meta(metatable, table):
     """
     After ingest/update, update the metatable registry to reflect table information.
@@ -393,6 +402,7 @@ def update_meta(metatable, table):
     """
 
     metatable.update_date_added()
+    metatable.bump_data_version()
 
     metatable.obs_from, metatable.obs_to = postgres_session.query(
         func.min(table.c.point_date),
@@ -411,5 +421,7 @@ def update_meta(metatable, table):
         if c.name not in {'geom', 'point_date', 'hash'}
     }
 
+    metatable.refresh_daily_rollup()
+
     postgres_session.add(metatable)
     postgres_session.commit()
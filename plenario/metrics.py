@@ -0,0 +1,270 @@
+import threading
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from logging import getLogger
+from time import time as now
+
+from celery.signals import task_postrun, task_prerun
+from flask import Response, g, has_request_context, request
+from redis import StrictRedis
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from plenario.database import pool_observers
+from plenario.settings import METRICS_REDIS_URL
+
+
+logger = getLogger(__name__)
+
+INF = float('inf')
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, INF)
+RATIO_BUCKETS = (.1, .25, .5, .75, .9, 1, INF)
+
+Metric = namedtuple('Metric', ['kind', 'help', 'buckets'])
+
+METRICS = {
+    'plenario_request_seconds': Metric(
+        'histogram', 'Time spent answering requests, by endpoint and status.', LATENCY_BUCKETS),
+    'plenario_stage_seconds': Metric(
+        'histogram', 'Time spent in each stage of requests and tasks. Stages can overlap, '
+                     'execute covers every statement sent to a database.', LATENCY_BUCKETS),
+    'plenario_task_seconds': Metric(
+        'histogram', 'Time spent running celery tasks, by task and state.', LATENCY_BUCKETS),
+    'plenario_cache_requests_total': Metric(
+        'counter', 'Response cache lookups, by result.', None),
+    'plenario_pool_wait_seconds': Metric(
+        'histogram', 'Time spent waiting for a database connection, by pool.', LATENCY_BUCKETS),
+    'plenario_pool_saturation': Metric(
+        'histogram', 'Share of the connections of a pool in use after a checkout.', RATIO_BUCKETS),
+    'plenario_pool_timeouts_total': Metric(
+        'counter', 'Checkouts that gave up waiting for a database connection, by pool.', None),
+}
+
+# Metrics are kept in redis, so that every server and worker process adds to
+# the same numbers and any of them can report all of them.
+_redis = StrictRedis.from_url(METRICS_REDIS_URL)
+_key = 'plenario_metrics:{}'.format
+
+# Task the current thread is running, and the updates it has yet to write
+_local = threading.local()
+
+
+def observe(name, value, **labels):
+    """Add an observation to a histogram."""
+    metric = METRICS[name]
+    bucket = next(i for i, le in enumerate(metric.buckets) if value <= le)
+    _record((name, _labels(labels), bucket, value))
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter."""
+    _record((name, _labels(labels), None, value))
+
+
+@contextmanager
+def timed(stage):
+    """Time a stage of the current request or task. Works as a decorator too.
+    """
+    start = now()
+    try:
+        yield
+    finally:
+        observe('plenario_stage_seconds', now() - start, context=_context(), stage=stage)
+
+
+def render():
+    """Every metric in the prometheus text format."""
+    lines = []
+    for name, metric in sorted(METRICS.items()):
+        lines.append('# HELP {} {}'.format(name, metric.help))
+        lines.append('# TYPE {} {}'.format(name, metric.kind))
+        values = {k.decode('utf-8'): float(v) for k, v in _redis.hgetall(_key(name)).items()}
+
+        if metric.kind == 'counter':
+            for labels, value in sorted(values.items()):
+                lines.append('{}{{{}}} {}'.format(name, labels, _number(value)))
+            continue
+
+        series = defaultdict(dict)
+        for field, value in values.items():
+            labels, _, part = field.rpartition('|')
+            series[labels][part] = value
+        for labels, parts in sorted(series.items()):
+            cumulative = 0
+            for i, le in enumerate(metric.buckets):
+                cumulative += parts.get(str(i), 0)
+                le = '+Inf' if le == INF else _number(le)
+                bucket_labels = ','.join(filter(None, [labels, 'le="{}"'.format(le)]))
+                lines.append('{}_bucket{{{}}} {}'.format(name, bucket_labels, _number(cumulative)))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, _number(parts.get('sum', 0))))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, _number(parts.get('count', 0))))
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    try:
+        body = render()
+    except Exception:
+        logger.exception('Unable to read metrics.')
+        return Response('Unable to read metrics.\n', status=503, mimetype='text/plain')
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time every request of a flask app, and serve the metrics at /metrics.
+    """
+    _instrument()
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = now()
+        g.metrics_pending = []
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_request_timer(exception=None):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        status = g.pop('metrics_status', 500 if exception else 200)
+        observe('plenario_request_seconds', now() - start,
+                endpoint=request.endpoint or 'unknown', status=str(status))
+        _write(g.pop('metrics_pending', []))
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def init_celery():
+    """Time every celery task run by this process."""
+    _instrument()
+    task_prerun.connect(_start_task, weak=False)
+    task_postrun.connect(_stop_task, weak=False)
+
+
+def counting_cache(app, config, args, kwargs):
+    """Flask-Cache backend factory, for use as CACHE_TYPE. Creates the backend
+    named by CACHE_BACKEND and counts its hits and misses.
+    """
+    from flask_cache import backends
+
+    backend = getattr(backends, config['CACHE_BACKEND'])
+    return CountingCache(backend(app, config, args, kwargs))
+
+
+class CountingCache(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key):
+        rv = self.backend.get(key)
+        inc('plenario_cache_requests_total', result='miss' if rv is None else 'hit')
+        return rv
+
+    def peek(self, key):
+        """Get without counting, for looking at the same key again while
+        waiting for somebody else to fill it.
+        """
+        return self.backend.get(key)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+def _start_task(task=None, **kwargs):
+    _local.task = task.name
+    _local.task_start = now()
+    _local.pending = []
+
+
+def _stop_task(task=None, state=None, **kwargs):
+    start = getattr(_local, 'task_start', None)
+    if start is not None:
+        observe('plenario_task_seconds', now() - start, task=task.name, state=state or 'UNKNOWN')
+    pending = getattr(_local, 'pending', None) or []
+    _local.task = _local.task_start = _local.pending = None
+    _write(pending)
+
+
+_instrumented = False
+
+
+def _instrument():
+    """Time database statements and connection checkouts, once per process."""
+    global _instrumented
+    if _instrumented:
+        return
+    _instrumented = True
+
+    event.listen(Engine, 'before_cursor_execute', _before_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_execute)
+    pool_observers.append(_observe_pool)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_start', []).append(now())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_start')
+    if not starts:
+        return
+    start = starts.pop()
+    observe('plenario_stage_seconds', now() - start, context=_context(), stage='execute')
+
+
+def _observe_pool(name, waited, checked_out, capacity, timed_out):
+    observe('plenario_pool_wait_seconds', waited, pool=name)
+    observe('plenario_pool_saturation', checked_out / capacity if capacity else 1, pool=name)
+    if timed_out:
+        inc('plenario_pool_timeouts_total', pool=name)
+
+
+def _context():
+    """The endpoint or task the current thread is working for."""
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return getattr(_local, 'task', None) or 'none'
+
+
+def _record(update):
+    # Updates made for a request or task are written together once it's done,
+    # anything else is written right away.
+    if has_request_context() and 'metrics_pending' in g:
+        g.metrics_pending.append(update)
+    elif getattr(_local, 'pending', None) is not None:
+        _local.pending.append(update)
+    else:
+        _write([update])
+
+
+def _write(updates):
+    if not updates:
+        return
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        for name, labels, bucket, value in updates:
+            key = _key(name)
+            if bucket is None:
+                pipe.hincrbyfloat(key, labels, value)
+            else:
+                pipe.hincrby(key, '{}|{}'.format(labels, bucket), 1)
+                pipe.hincrbyfloat(key, labels + '|sum', value)
+                pipe.hincrby(key, labels + '|count', 1)
+        pipe.execute()
+    except Exception:
+        logger.exception('Unable to write metrics.')
+
+
+def _labels(labels):
+    escape = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join('{}="{}"'.format(k, escape(v)) for k, v in sorted(labels.items()))
+
+
+def _number(value):
+    return repr(int(value)) if float(value).is_integer() else repr(value)
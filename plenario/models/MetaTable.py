@@ -1,23 +1,32 @@
 import json
 from collections import namedtuple
-from datetime import datetime
+from datetime import datetime, time, timedelta
 from hashlib import md5
-from itertools import groupby
 from operator import itemgetter
 
 import sqlalchemy as sa
 from flask_bcrypt import Bcrypt
 from geoalchemy2 import Geometry
+from geoalchemy2.shape import to_shape
 from shapely.geometry import shape
-from sqlalchemy import Boolean, Column, Date, DateTime, String, Table, Text, func, select
+from sqlalchemy import BigInteger, Boolean, Column, Date, DateTime, Integer, MetaData, String, Table, Text, func, select
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.elements import ClauseList
 
-from plenario.database import postgres_base, postgres_session
-from plenario.utils.helpers import get_size_in_degrees, slugify
+from plenario import registry
+from plenario.database import fetch_all, postgres_base, postgres_engine, postgres_session, read_engine, \
+    statement_timeout
+from plenario.settings import TIMESERIES_WORKERS
+from plenario.utils.helpers import get_size_in_degrees, reflect, slugify
 
 bcrypt = Bcrypt()
 
+# Daily rollup tables are kept out of postgres_base.metadata, they are created
+# and dropped alongside the point tables they summarize, never by create_all.
+rollup_metadata = MetaData()
+
 
 class MetaTable(postgres_base):
     __tablename__ = 'meta_master'
@@ -49,6 +58,12 @@ class MetaTable(postgres_base):
     contributor_email = Column(String)
     result_ids = Column(ARRAY(String))
     column_names = Column(JSONB)  # {'<COLUMN_NAME>': '<COLUMN_TYPE>'}
+    # Bumped every time the point table is (re)ingested, used to tell apart
+    # cached responses built from older data
+    data_version = Column(Integer, nullable=False, default=0, server_default='0')
+    # Whether the daily rollup table has been built, so timeseries requests
+    # don't have to ask the catalog
+    has_daily_rollup = Column(Boolean, nullable=False, default=False, server_default='false')
 
     def __init__(self, url, human_name, observed_date,
                  approved_status=False, update_freq='yearly',
@@ -145,11 +160,48 @@ class MetaTable(postgres_base):
 
     @property
     def point_table(self):
+        # Reflected again once an ETL has bumped the data version. Reflected
+        # where the request reads it, the replica may lag behind the primary.
+        return reflect(self.dataset_name, read_engine(), version=self.data_version)
+
+    @property
+    def daily_rollup(self):
+        """Table holding the number of observations in the point table for
+        every day, used to answer unfiltered timeseries requests without
+        scanning the point table.
+        """
         try:
-            return self._point_table
+            return self._daily_rollup
         except AttributeError:
-            self._point_table = Table(self.dataset_name, postgres_base.metadata, autoload=True, extend_existing=True)
-            return self._point_table
+            self._daily_rollup = Table(
+                '{}__daily'.format(self.dataset_name), rollup_metadata,
+                Column('day', Date, primary_key=True),
+                Column('count', BigInteger, nullable=False),
+                extend_existing=True
+            )
+            return self._daily_rollup
+
+    def refresh_daily_rollup(self):
+        """Rebuild the daily rollup from the point table. Runs in a single
+        transaction, so readers see either the old counts or the new ones.
+        """
+        t = self.point_table
+        rollup = self.daily_rollup
+
+        day = sa.cast(t.c.point_date, Date).label('day')
+        counts = select([day, func.count().label('count')]) \
+            .where(t.c.point_date != None) \
+            .group_by(day)
+
+        with postgres_engine.begin() as connection:
+            rollup.drop(connection, checkfirst=True)
+            rollup.create(connection)
+            connection.execute(rollup.insert().from_select(['day', 'count'], counts))
+        self.has_daily_rollup = True
+
+    def drop_daily_rollup(self):
+        self.daily_rollup.drop(postgres_engine, checkfirst=True)
+        self.has_daily_rollup = False
 
     @classmethod
     def attach_metadata(cls, rows):
@@ -206,34 +258,59 @@ class MetaTable(postgres_base):
                 'items': [{'datetime': dt, 'count': int}, ...]
             }
         ]
+
+        Datasets that can't have records within the requested bounds are left
+        out up front, and the timeseries of the rest are counted concurrently
+        on separate connections.
         """
-        # For each table in table_names, generate a query to be unioned
+        selects = cls.timeseries_selects(table_names, agg_unit, start, end, geom, ctrees)
+        return cls.timeseries_panel(selects, timeout=statement_timeout())
+
+    @classmethod
+    def timeseries_selects(cls, table_names, agg_unit, start, end, geom=None, ctrees=None):
+        """Build the timeseries select of every dataset that can have records
+        within the requested bounds, without running them.
+        """
+        table_names = cls.narrow_candidates(table_names, start, end, geom)
+        if not table_names:
+            return []
+
+        snapshot = registry.points()
+        tables = [snapshot[name] for name in sorted(set(table_names))]
+
+        # For each table in table_names, generate a query to be run
         selects = []
-        for name in table_names:
+        for table in tables:
             # If we have condition trees specified, apply them.
             # .get will return None for those datasets who don't have filters
-            ctree = ctrees.get(name) if ctrees else None
-            table = cls.get_by_dataset_name(name)
+            ctree = ctrees.get(table.dataset_name) if ctrees else None
             ts_select = table.timeseries(agg_unit, start, end, geom, ctree)
-            selects.append(ts_select)
+            selects.append(ts_select.order_by('time_bucket'))
 
-        # Union the time series selects to get a panel
-        panel_query = sa.union(*selects) \
-            .order_by('dataset_name') \
-            .order_by('time_bucket')
-        panel_vals = postgres_session.execute(panel_query)
+        return selects
 
-        panel = []
-        for dataset_name, ts in groupby(panel_vals, lambda row: row.dataset_name):
+    @staticmethod
+    def timeseries_panel(selects, timeout=0, abandoned=None):
+        """Run the selects built by timeseries_selects and collect their
+        results in the format returned by timeseries_all.
+
+        :param timeout: milliseconds each select may take, 0 for no limit
+        :param abandoned: callable that returns True once the results are no
+                          longer wanted, which cancels the selects
+        """
+        if not selects:
+            return []
 
-            # ts gets closed after it's been iterated over once,
-            # so we need to store the rows somewhere to iterate over them twice.
-            rows = [row for row in ts]
+        panel_vals = fetch_all(selects, engine=read_engine(), max_workers=TIMESERIES_WORKERS,
+                               timeout=timeout, abandoned=abandoned)
+
+        panel = []
+        for rows in panel_vals:
             # If no records were found, don't include this dataset
             if all([row.count == 0 for row in rows]):
                 continue
 
-            ts_dict = {'dataset_name': dataset_name,
+            ts_dict = {'dataset_name': rows[0].dataset_name,
                        'items': []}
 
             for row in rows:
@@ -241,8 +318,8 @@ class MetaTable(postgres_base):
                     'datetime': row.time_bucket.date().isoformat(),
                     'count': row.count
                 })
-                # Aggregate top-level count across all time slices.
-                ts_dict['count'] = sum([i['count'] for i in ts_dict['items']])
+            # Aggregate top-level count across all time slices.
+            ts_dict['count'] = sum([i['count'] for i in ts_dict['items']])
             panel.append(ts_dict)
 
         return panel
@@ -250,16 +327,8 @@ class MetaTable(postgres_base):
     # Information about all point datasets
     @classmethod
     def index(cls):
-        try:
-            q = postgres_session.query(cls.dataset_name)
-            q = q.filter(cls.approved_status == True)
-            names = [result.dataset_name for result in q.all()]
-        except ProgrammingError:
-            # Handles a case that causes init_db to crash.
-            # Validator calls index when initializing, prevents this call
-            # from raising an error when the database is empty.
-            names = []
-        return names
+        # The registry comes up empty while the database is being set up
+        return [name for name, meta in registry.points().items() if meta.approved_status]
 
     @classmethod
     def narrow_candidates(cls, dataset_names, start, end, geom=None):
@@ -268,23 +337,33 @@ class MetaTable(postgres_base):
         :return names: Names of point datasets whose bounding box and date range
                        interesects with the given bounds.
         """
-        # Filter out datsets that don't intersect the time boundary
-        q = postgres_session.query(cls.dataset_name) \
-            .filter(cls.dataset_name.in_(dataset_names), cls.date_added != None,
-                    cls.obs_from < end,
-                    cls.obs_to > start)
-
-        # or the geometry boundary
-        if geom:
-            intersecting = cls.bbox.ST_Intersects(func.ST_GeomFromGeoJSON(geom))
-            q = q.filter(intersecting)
+        # The observation bounds are dates, so compare against whole days to
+        # keep records on the first and last day of either range.
+        start, end = _as_datetime(start).date(), _as_datetime(end).date()
+        area = shape(json.loads(geom)) if geom else None
+
+        names = []
+        for name in dataset_names:
+            meta = registry.points().get(name)
+            # Filter out datasets that were never ingested
+            if meta is None or meta.date_added is None or meta.obs_from is None or meta.obs_to is None:
+                continue
+            # or that don't intersect the time boundary
+            if meta.obs_from > end or meta.obs_to < start:
+                continue
+            # or the geometry boundary
+            if area is not None and (meta.bbox is None or not to_shape(meta.bbox).intersects(area)):
+                continue
+            names.append(name)
 
-        return [row.dataset_name for row in q.all()]
+        return names
 
     @classmethod
     def get_by_dataset_name(cls, name):
-        foo = postgres_session.query(cls).filter(cls.dataset_name == name).first()
-        return foo
+        """Registry row of a point dataset, from the snapshot of this process.
+        It's shared, so don't change it, query the row to do that.
+        """
+        return registry.points().get(name)
 
     def get_bbox_center(self):
         sel = select([func.ST_AsGeoJSON(func.ST_centroid(self.bbox))])
@@ -292,6 +371,21 @@ class MetaTable(postgres_base):
         # returns [lon, lat]
         return json.loads(result.first()[0])['coordinates']
 
+    def bump_data_version(self):
+        # Incremented in the database, so concurrent ETLs can't lose a bump,
+        # and read back right away, since reflections of the point table are
+        # keyed on it
+        session = object_session(self) or postgres_session
+        session.flush()
+        table = MetaTable.__table__
+        bumped = session.execute(
+            table.update()
+            .where(table.c.source_url_hash == self.source_url_hash)
+            .values(data_version=table.c.data_version + 1)
+            .returning(table.c.data_version)
+        ).scalar()
+        set_committed_value(self, 'data_version', bumped)
+
     def update_date_added(self):
         now = datetime.now()
         if self.date_added is None:
@@ -311,6 +405,17 @@ class MetaTable(postgres_base):
                  size_x, size_y: the horizontal and vertical size
                                     of the grid squares in degrees
         """
+        q, size_x, size_y = self.grid_query(resolution, geom, conditions, obs_dates)
+        return postgres_session.execute(q), size_x, size_y
+
+    def grid_query(self, resolution, geom=None, conditions=None, obs_dates={}):
+        """Build the query make_grid runs, without running it. Takes the same
+        arguments as make_grid.
+
+        :return: q: query counting records per grid square
+                 size_x, size_y: the horizontal and vertical size
+                                    of the grid squares in degrees
+        """
         if conditions is None:
             conditions = []
 
@@ -341,14 +446,13 @@ class MetaTable(postgres_base):
             q = q.filter(t.c.point_date >= obs_dates['lower'])
             q = q.filter(t.c.point_date <= obs_dates['upper'])
 
-        return postgres_session.execute(q), size_x, size_y
+        return q, size_x, size_y
 
     # Return select statement to execute or union
     def timeseries(self, agg_unit, start, end, geom=None, column_filters=None):
         # Reading this blog post
         # http://no0p.github.io/postgresql/2014/05/08/timeseries-tips-pg.html
         # inspired this implementation.
-        t = self.point_table
 
         # Special case for the 'quarter' unit of aggregation.
         step = '3 months' if agg_unit == 'quarter' else '1 ' + agg_unit
@@ -362,6 +466,31 @@ class MetaTable(postgres_base):
                            day_generator.label('time_bucket')]) \
             .alias('defaults')
 
+        actuals = None
+        if geom is None and _is_empty(column_filters) and self.has_daily_rollup:
+            actuals = self._rollup_actuals(agg_unit, start, end)
+
+        if actuals is None:
+            actuals = self._point_actuals(agg_unit, start, end, geom, column_filters)
+
+        # Need to alias to make it usable in a subexpression
+        actuals = actuals.alias('actuals')
+
+        # Outer join the default and observed values
+        # to create the timeseries select statement.
+        # If no observed value in a bucket, use the default.
+        name = sa.literal_column("'{}'".format(self.dataset_name)) \
+            .label('dataset_name')
+        bucket = defaults.c.time_bucket.label('time_bucket')
+        count = func.coalesce(actuals.c.count, defaults.c.count).label('count')
+        ts = select([name, bucket, count]). \
+            select_from(defaults.outerjoin(actuals, actuals.c.time_bucket == defaults.c.time_bucket))
+
+        return ts
+
+    def _point_actuals(self, agg_unit, start, end, geom=None, column_filters=None):
+        t = self.point_table
+
         where_filters = [t.c.point_date >= start, t.c.point_date <= end]
         if column_filters is not None:
             # Column filters has to be iterable here, because the '+' operator
@@ -383,20 +512,38 @@ class MetaTable(postgres_base):
             contains = func.ST_Within(t.c.geom, func.ST_GeomFromGeoJSON(geom))
             actuals = actuals.where(contains)
 
-        # Need to alias to make it usable in a subexpression
-        actuals = actuals.alias('actuals')
+        return actuals
 
-        # Outer join the default and observed values
-        # to create the timeseries select statement.
-        # If no observed value in a bucket, use the default.
-        name = sa.literal_column("'{}'".format(self.dataset_name)) \
-            .label('dataset_name')
-        bucket = defaults.c.time_bucket.label('time_bucket')
-        count = func.coalesce(actuals.c.count, defaults.c.count).label('count')
-        ts = select([name, bucket, count]). \
-            select_from(defaults.outerjoin(actuals, actuals.c.time_bucket == defaults.c.time_bucket))
+    def _rollup_actuals(self, agg_unit, start, end):
+        """Count records per time bucket using the daily rollup for every day
+        that lies entirely within [start, end], and the point table only for
+        the partial days at either edge. Returns None if there is no whole day
+        in the range, in which case the point table has to be used anyway.
+        """
+        t = self.point_table
+        rollup = self.daily_rollup
 
-        return ts
+        start, end = _as_datetime(start), _as_datetime(end)
+        first_day = start.date() if start.time() == time() else start.date() + timedelta(days=1)
+        last_day = end.date()
+        if first_day >= last_day:
+            return None
+
+        days = select([rollup.c.count,
+                       sa.cast(rollup.c.day, DateTime).label('point_date')]) \
+            .where(sa.and_(rollup.c.day >= first_day, rollup.c.day < last_day))
+
+        edge_date = func.date_trunc('day', t.c.point_date).label('point_date')
+        edges = select([func.count(t.c.hash).label('count'), edge_date]) \
+            .where(sa.or_(
+                sa.and_(t.c.point_date >= start, t.c.point_date < first_day),
+                sa.and_(t.c.point_date >= last_day, t.c.point_date <= end))) \
+            .group_by(edge_date)
+
+        daily = sa.union_all(days, edges).alias('daily')
+        return select([sa.cast(func.sum(daily.c.count), BigInteger).label('count'),
+                       func.date_trunc(agg_unit, daily.c.point_date).label('time_bucket')]) \
+            .group_by('time_bucket')
 
     def timeseries_one(self, agg_unit, start, end, geom=None, column_filters=None):
         ts_select = self.timeseries(agg_unit, start, end, geom, column_filters)
@@ -425,3 +572,18 @@ class MetaTable(postgres_base):
             WHERE m.approved_status = 'true'
         """
         return list(postgres_session.execute(query))
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time())
+
+
+def _is_empty(column_filters):
+    """Whether a set of column filters places no restrictions at all, which
+    is the case for an 'and' condition tree without any conditions.
+    """
+    if column_filters is None:
+        return True
+    return isinstance(column_filters, ClauseList) and not column_filters.clauses
@@ -6,7 +6,9 @@ from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, ForeignKey,
 from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, JSONB
 from sqlalchemy.orm import relationship
 
+from plenario import registry
 from plenario.database import postgres_base, postgres_engine, postgres_session, redshift_base
+from plenario.sensor_network.redshift_ops import forget_feature_table
 
 sensor_to_node = Table(
     'sensor__sensor_to_node',
@@ -94,33 +96,19 @@ class NetworkMeta(postgres_base):
 
     @staticmethod
     def index():
-        networks = postgres_session.query(NetworkMeta)
-        return [network.name.lower() for network in networks]
+        return registry.topology().network_index()
 
     def __repr__(self):
         return '<Network {!r}>'.format(self.name)
 
     def tree(self):
-        sensor_tree_fn = sqla_fn.network_tree(self.name)
-        sensor_tree_result_proxy = self.query.session.execute(sensor_tree_fn)
-        return sensor_tree_result_proxy.scalar()
+        return registry.topology().tree(self.name)
 
     def sensors(self) -> set:
-
-        keys = []
-        for sensor in self.tree().values():
-            keys += sensor
-
-        return set(keys)
+        return registry.topology().sensors(self.name)
 
     def features(self):
-
-        keys = []
-        for sensor in self.tree().values():
-            for feature in sensor.values():
-                keys += feature.values()
-
-        return set([k.split('.')[0] for k in keys])
+        return registry.topology().features(self.name)
 
 
 class NodeMeta(postgres_base):
@@ -141,15 +129,23 @@ class NodeMeta(postgres_base):
         return query.all()
 
     @staticmethod
-    def index(network_name):
-        return [node.id for node in NodeMeta.all(network_name)]
+    def index(network_name=None):
+        return registry.topology().node_index(network_name)
+
+    @staticmethod
+    def geometries(network_name):
+        """Locations of the nodes of a network as geojson strings, by lower
+        cased node id.
+        """
+        query = postgres_session.query(NodeMeta.id, sqla_fn.ST_AsGeoJSON(NodeMeta.location))
+        query = query.filter(NodeMeta.sensor_network == network_name)
+        return {node_id.lower(): geometry for node_id, geometry in query}
 
     @staticmethod
     def nearest_neighbor_to(lng, lat, network, features):
         sensors = set()
         for feature in features:
-            feature = FeatureMeta.query.get(feature)
-            sensors = sensors | feature.sensors()
+            sensors = sensors | registry.topology().sensors_of(feature)
 
         return knn(
             lng=lng,
@@ -194,6 +190,10 @@ class SensorMeta(postgres_base):
     observed_properties = Column(JSONB)
     info = Column(JSONB)
 
+    @staticmethod
+    def index(network_name=None):
+        return registry.topology().sensor_index(network_name)
+
     def features(self) -> set:
         """Return the features that this sensor reports on.
         """
@@ -221,24 +221,11 @@ class FeatureMeta(postgres_base):
     def sensors(self) -> set:
         """Return the set of sensors that report on this feature.
         """
-        results = set()
-        for network in self.networks:
-            for node in network.tree().values():
-                for sensor, properties in node.items():
-                    if self.name in {p.split('.')[0] for p in properties}:
-                        results.add(sensor)
-
-        return results
+        return registry.topology().sensors_of(self.name)
 
     @staticmethod
     def index(network_name=None):
-        features = []
-        for node in postgres_session.query(NodeMeta).all():
-            if network_name is None or node.sensor_network.lower() == network_name.lower():
-                for sensor in node.sensors:
-                    for prop in sensor.observed_properties.values():
-                        features.append(prop.split('.')[0].lower())
-        return list(set(features))
+        return registry.topology().feature_index(network_name)
 
     @staticmethod
     def properties_of(feature):
@@ -275,6 +262,7 @@ class FeatureMeta(postgres_base):
         )
 
         redshift_table.create()
+        forget_feature_table(redshift_table.name)
 
     def __repr__(self):
         return '<Feature {!r}>'.format(self.name)
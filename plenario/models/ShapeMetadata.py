@@ -2,12 +2,15 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from geoalchemy2 import Geometry
-from sqlalchemy import Boolean, Column, Date, Integer, String, Table, Text, func, select
+from sqlalchemy import Boolean, Column, Date, Integer, String, Text, func, select
 from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.types import NullType
 
-from plenario.database import postgres_base, postgres_session
-from plenario.utils.helpers import slugify
+from plenario import registry
+from plenario.database import postgres_base, postgres_session, read_engine
+from plenario.utils.helpers import reflect, slugify
 
 bcrypt = Bcrypt()
 
@@ -43,11 +46,16 @@ class ShapeMetadata(postgres_base):
     is_ingested = Column(Boolean, nullable=False)
     # foreign key of celery task responsible for shapefile's ingestion
     celery_task_id = Column(String)
+    # Bumped every time the shape table is (re)ingested, used to tell apart
+    # cached responses built from older data
+    data_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     @classmethod
     def get_by_dataset_name(cls, name):
-        shape_metatable = postgres_session.query(cls).filter(cls.dataset_name == name).first()
-        return shape_metatable
+        """Registry row of a shapeset, from the snapshot of this process. It's
+        shared, so don't change it, query the row to do that.
+        """
+        return registry.shapes().get(name)
 
     @classmethod
     def get_all_with_etl_status(cls):
@@ -124,10 +132,8 @@ class ShapeMetadata(postgres_base):
             name = dataset['dataset_name']
             try:
                 # Reflect up the shape table
-                table = Table(name,
-                              postgres_base.metadata,
-                              autoload=True,
-                              extend_existing=True)
+                meta = cls.get_by_dataset_name(name)
+                table = reflect(name, read_engine(), version=meta and meta.data_version)
             except NoSuchTableError:
                 # If that table doesn't exist (?!?!)
                 # don't try to form the fields.
@@ -151,7 +157,7 @@ class ShapeMetadata(postgres_base):
 
     @classmethod
     def tablenames(cls):
-        return [x.dataset_name for x in postgres_session.query(ShapeMetadata.dataset_name).all()]
+        return list(registry.shapes())
 
     @staticmethod
     def add_intersections_to_index(listing, geom):
@@ -216,11 +222,9 @@ class ShapeMetadata(postgres_base):
 
     @property
     def shape_table(self):
-        try:
-            return self._shape_table
-        except AttributeError:
-            self._shape_table = Table(self.dataset_name, postgres_base.metadata, autoload=True, extend_existing=True)
-            return self._shape_table
+        # Reflected again once an ETL has bumped the data version. Reflected
+        # where the request reads it, the replica may lag behind the primary.
+        return reflect(self.dataset_name, read_engine(), version=self.data_version)
 
     def remove_table(self):
         if self.is_ingested:
@@ -230,9 +234,25 @@ class ShapeMetadata(postgres_base):
 
     def update_after_ingest(self):
         self.is_ingested = True
+        self.bump_data_version()
         self.bbox = self._make_bbox()
         self.num_shapes = self._get_num_shapes()
 
+    def bump_data_version(self):
+        # Incremented in the database, so concurrent ETLs can't lose a bump,
+        # and read back right away, since reflections of the shape table are
+        # keyed on it
+        session = object_session(self) or postgres_session
+        session.flush()
+        table = ShapeMetadata.__table__
+        bumped = session.execute(
+            table.update()
+            .where(table.c.dataset_name == self.dataset_name)
+            .values(data_version=table.c.data_version + 1)
+            .returning(table.c.data_version)
+        ).scalar()
+        set_committed_value(self, 'data_version', bumped)
+
     def _make_bbox(self):
         bbox_query = 'SELECT ST_Envelope(ST_Union(geom)) FROM {};'. \
             format(self.dataset_name)
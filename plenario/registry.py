@@ -0,0 +1,210 @@
+"""Process-wide snapshot of the point and shape dataset registries, meta_master
+and meta_shape, and of the sensor network topology, so that resolving a dataset
+name or validating a sensor query on the hot path of a request costs no queries.
+
+The snapshot is reloaded after REGISTRY_TTL seconds at the latest. Sooner
+than that, any process that commits a change to either registry publishes
+on REGISTRY_CHANNEL, and every process drops its snapshot when it hears
+about it. Changes made through the ORM are noticed on their own. Changes
+made with plain sql, like the deletes in tasks.py, have to call invalidate().
+
+Rows in the snapshot are detached from any session and shared between
+threads, treat them as read-only.
+"""
+import os
+import threading
+from collections import namedtuple
+from hashlib import sha1
+from logging import getLogger
+from time import sleep, time as now
+
+from redis import StrictRedis
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import Session
+
+from plenario.database import postgres_engine
+from plenario.sensor_network.topology import Topology
+from plenario.settings import REGISTRY_CHANNEL, REGISTRY_REDIS_URL, REGISTRY_TTL
+
+
+logger = getLogger(__name__)
+
+Snapshot = namedtuple('Snapshot', ['points', 'shapes', 'topology', 'digests', 'expires'])
+
+_snapshot = None
+# Bumped by every expire(), so that a load that started before the snapshot
+# was expired doesn't store what it read as current
+_generation = 0
+_lock = threading.Lock()
+
+_redis = StrictRedis.from_url(REGISTRY_REDIS_URL)
+# Process the listener thread was started by, it doesn't survive a fork
+_listener_pid = None
+
+
+def points() -> dict:
+    """MetaTable rows by dataset name."""
+    return _current().points
+
+
+def shapes() -> dict:
+    """ShapeMetadata rows by dataset name."""
+    return _current().shapes
+
+
+def topology() -> Topology:
+    """Networks, nodes, sensors and features, see plenario.sensor_network.topology."""
+    return _current().topology
+
+
+def digests(tablename) -> dict:
+    """Digests of the rows of meta_master or meta_shape by dataset name, along
+    with one of the whole table under None. They change whenever any column
+    of a row does, and are the same in every process.
+    """
+    return _current().digests[tablename]
+
+
+def expire() -> None:
+    """Drop the snapshot of this process, the next lookup reloads it."""
+    global _snapshot, _generation
+    _generation += 1
+    _snapshot = None
+
+
+def invalidate() -> None:
+    """Drop the snapshot of every process."""
+    expire()
+    try:
+        _redis.publish(REGISTRY_CHANNEL, 'invalidate')
+    except Exception:
+        logger.exception('Unable to publish a registry invalidation.')
+
+
+def _current() -> Snapshot:
+    _listen()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.expires > now():
+        return snapshot
+
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot.expires <= now():
+            snapshot = _load()
+        return snapshot
+
+
+def _load() -> Snapshot:
+    global _snapshot
+    from plenario.models import MetaTable, ShapeMetadata
+
+    generation = _generation
+
+    # A session of its own, expunging rows from the session of a request
+    # would detach them from whatever the request is doing with them
+    session = Session(bind=postgres_engine)
+    try:
+        point_rows = session.query(MetaTable).all()
+        shape_rows = session.query(ShapeMetadata).all()
+        topology_ = Topology.load(session)
+        session.expunge_all()
+    except ProgrammingError:
+        logger.exception('Unable to load the registry.')
+        raise
+    finally:
+        session.close()
+
+    points_ = {}
+    for row in point_rows:
+        points_.setdefault(row.dataset_name, row)
+    shapes_ = {row.dataset_name: row for row in shape_rows}
+    digests_ = {'meta_master': _digests(points_), 'meta_shape': _digests(shapes_)}
+
+    snapshot = Snapshot(points_, shapes_, topology_, digests_, now() + REGISTRY_TTL)
+    # Expired while we were reading, what we read may already be out of date.
+    # Hand it to this lookup but let the next one load it again.
+    if generation == _generation:
+        _snapshot = snapshot
+    return snapshot
+
+
+def _digests(rows) -> dict:
+    by_name = {}
+    for name, row in rows.items():
+        # str and not repr, geometries repr with their address in memory
+        values = [str(getattr(row, attr.key)) for attr in inspect(type(row)).column_attrs]
+        by_name[name] = sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+    whole = sha1()
+    for name in sorted(by_name):
+        whole.update('{}:{}\n'.format(name, by_name[name]).encode('utf-8'))
+    by_name[None] = whole.hexdigest()
+    return by_name
+
+
+def _listen() -> None:
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        thread = threading.Thread(target=_listener, name='registry-listener', daemon=True)
+        thread.start()
+
+
+def _listener() -> None:
+    while True:
+        try:
+            pubsub = _redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(REGISTRY_CHANNEL)
+            # Anything published while we weren't subscribed was missed
+            expire()
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    expire()
+        except Exception:
+            logger.exception('Lost the registry invalidation channel.')
+            sleep(min(REGISTRY_TTL, 5) or 5)
+
+
+# Changes made through the ORM
+# ============================
+
+def _registry_models():
+    from plenario.models import MetaTable, ShapeMetadata
+    from plenario.models.SensorNetwork import FeatureMeta, NetworkMeta, NodeMeta, SensorMeta
+    return MetaTable, ShapeMetadata, FeatureMeta, NetworkMeta, NodeMeta, SensorMeta
+
+
+@event.listens_for(Session, 'before_flush')
+def _note_changes(session, flush_context, instances):
+    models = _registry_models()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models):
+            session.info['registry_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def _note_bulk_update(update_context):
+    if issubclass(update_context.mapper.class_, _registry_models()):
+        update_context.session.info['registry_changed'] = True
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _note_bulk_delete(delete_context):
+    if issubclass(delete_context.mapper.class_, _registry_models()):
+        delete_context.session.info['registry_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    if session.info.pop('registry_changed', False):
+        invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changes(session, previous_transaction):
+    session.info.pop('registry_changed', None)
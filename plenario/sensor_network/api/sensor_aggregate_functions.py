@@ -2,10 +2,11 @@ from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime, timedelta
 
-from sqlalchemy import Table, and_, asc, func
+from sqlalchemy import and_, asc, func
 from sqlalchemy.sql import select
 
-from plenario.database import redshift_base as redshift_base, redshift_session as r_session
+from plenario.database import redshift_session as r_session
+from plenario.sensor_network.redshift_ops import feature_table
 
 
 def _fill_in_blanks(aggregates, agg_unit, start_dt, end_dt):
@@ -121,22 +122,6 @@ def _generate_placeholder(aggreagte):
     return placeholder
 
 
-def _reflect(table_name, metadata, engine):
-    """Helper function for an oft repeated block of code.
-
-    :param table_name: (str) table name
-    :param metadata: (MetaData) SQLAlchemy object found in a declarative base
-    :param engine: (Engine) SQLAlchemy object to send queries to the database
-    :returns: (Table) SQLAlchemy object
-    """
-    return Table(
-        table_name,
-        metadata,
-        autoload=True,
-        autoload_with=engine
-    )
-
-
 # TODO(heyzoos)
 # This could be replaced with a generalized validator for sensor network trees.
 def _valid_columns(node, target_sensors, target_features, target_properties=None):
@@ -225,8 +210,7 @@ def aggregate(args, agg_label, agg_fn):
                          'filtering on a sensor which doesn\'t have the feature '
                          'you are aggregating for)')
 
-    redshift_base.metadata.reflect()
-    obs_table = redshift_base.metadata.tables[network.name + '__' + feature.name]
+    obs_table = feature_table(network.name + '__' + feature.name)
 
     # Generate the necessary select statements and datetime delimiters
     selects = _generate_aggregate_selects(obs_table,
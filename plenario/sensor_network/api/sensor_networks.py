@@ -1,6 +1,7 @@
 import csv
 import io
 import json
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import boto3
@@ -10,19 +11,21 @@ from marshmallow.exceptions import ValidationError
 from marshmallow.fields import DateTime, Field, Float, Integer, List, String
 from marshmallow.validate import Range
 from shapely import wkb
-from sqlalchemy import MetaData, and_, asc, desc, func as sqla_fn
+from sqlalchemy import and_, asc, desc, func as sqla_fn
 from sqlalchemy.orm.exc import NoResultFound
 
-from plenario.api.common import cache, crossdomain, extract_first_geometry_fragment, make_cache_key, make_fragment_str, \
+from plenario.api import columnar
+from plenario.api.common import LINE_FORMATS, cache, chunked, compressed, crossdomain, \
+    extract_first_geometry_fragment, geojsonseq_lines, make_cache_key, make_fragment_str, ndjson_lines, \
     unknown_object_json_handler
 from plenario.api.condition_builder import parse_tree
 from plenario.api.validator import valid_tree
-from plenario.database import redshift_base, redshift_engine, redshift_session
+from plenario.database import redshift_session, stream
 from plenario.models.SensorNetwork import FeatureMeta, NetworkMeta, NodeMeta, SensorMeta
 from plenario.sensor_network.api.sensor_aggregate_functions import aggregate_fn_map
-from plenario.sensor_network.api.sensor_response import bad_request, json_response_base
-from plenario.settings import S3_BUCKET
-from plenario.utils.helpers import reflect
+from plenario.sensor_network.api.sensor_response import bad_request, json_response_base, make_error
+from plenario.sensor_network.redshift_ops import feature_table
+from plenario.settings import S3_BUCKET, STREAM_FETCH_SIZE
 
 # Cache timeout of 5 minutes
 CACHE_TIMEOUT = 60 * 10
@@ -92,11 +95,10 @@ class ConditionTree(Field):
     def _deserialize(self, value, attr, data):
         feature = request.args['feature']
         network = request.view_args['network']
-        redshift_base.metadata.reflect()
 
         try:
             parsed_json = json.loads(value)
-            table = redshift_base.metadata.tables[network + '__' + feature]
+            table = feature_table(network + '__' + feature)
             valid_tree(table, parsed_json)
             return parse_tree(table, parsed_json)
         except (KeyError) as err:
@@ -379,7 +381,8 @@ def check(network: str) -> Response:
 @crossdomain(origin='*')
 def get_observations(network: str) -> Response:
     '''Return raw sensor network observations for a single feature within
-    the specified network.
+    the specified network. With data_type=ndjson or geojsonseq, observations
+    are streamed one per line instead.
 
     :endpoint: /sensor-networks/<network-name>/query?feature=<feature>'''
 
@@ -387,6 +390,10 @@ def get_observations(network: str) -> Response:
     sensors = request.args.get('sensors')
     feature = request.args.get('feature')
 
+    fmt = request.args.get('data_type', 'json')
+    if fmt != 'json' and fmt not in LINE_FORMATS:
+        return bad_request('data_type must be one of json, {}.'.format(', '.join(sorted(LINE_FORMATS))))
+
     args = request.args.to_dict()
     args.update({
         'network': network,
@@ -404,14 +411,22 @@ def get_observations(network: str) -> Response:
         feature, property_ = feature.split('.', 1)
         validated.data.update({'property': property_})
 
-    redshift_base.metadata.reflect()
-    table = redshift_base.metadata.tables[network + '__' + feature]
+    table = feature_table(network + '__' + feature)
 
     try:
         query = observation_query(table, **validated.data)
     except KeyError as err:
         return bad_request(str(err))
 
+    if fmt == 'ndjson':
+        lines = ndjson_lines(format_observation(obs, table) for obs in stream(query))
+        return Response(stream_with_context(chunked(lines)), mimetype=LINE_FORMATS[fmt])
+    if fmt == 'geojsonseq':
+        locations = NodeMeta.geometries(network)
+        lines = geojsonseq_lines((locations.get(obs.node_id.lower()), format_observation(obs, table))
+                                 for obs in stream(query))
+        return Response(stream_with_context(chunked(lines)), mimetype=LINE_FORMATS[fmt])
+
     data = list()
     for obs in query:
         data.append(format_observation(obs, table))
@@ -439,9 +454,11 @@ def get_observation_nearest(network: str) -> Response:
     return jsonify(json_response_base(validated, result, args))
 
 
+@compressed
 @crossdomain(origin='*')
 def get_observations_download(network: str) -> Response:
-    '''Stream a sensor network's bulk records to a csv file.
+    '''Stream a sensor network's bulk records to a csv, json, ndjson or
+    geojsonseq file, or for a single feature, a parquet file or arrow stream.
 
     :endpoint: /sensor-networks/<network>/download'''
 
@@ -470,10 +487,25 @@ def get_observations_download(network: str) -> Response:
     if not deserialized.data.get('start_datetime'):
         deserialized.data.update({'start_datetime': datetime.now() - timedelta(days=7)})
 
-    if deserialized.data.get('data_type') == 'json':
+    fmt = deserialized.data.get('data_type')
+    if fmt == 'json':
         stream = get_observation_datadump_json(**deserialized.data)
         filename = datetime.now().isoformat() + '-' + deserialized.data['network'].name + '.json'
         attachment = Response(stream_with_context(stream), mimetype='text/json')
+    elif fmt in LINE_FORMATS:
+        stream = get_observation_datadump_lines(**deserialized.data)
+        filename = datetime.now().isoformat() + '-' + deserialized.data['network'].name + '.' + fmt
+        attachment = Response(stream_with_context(stream), mimetype=LINE_FORMATS[fmt])
+    elif fmt in columnar.MIMETYPES:
+        if not columnar.available():
+            return make_error('{} downloads are not available on this server.'.format(fmt), 501)
+        if len(deserialized.data['features']) != 1:
+            return bad_request('{} downloads hold a single feature, '
+                               'request one feature at a time.'.format(fmt))
+        stream = get_observation_datadump_columnar(**deserialized.data)
+        filename = '{}-{}-{}.{}'.format(datetime.now().isoformat(), deserialized.data['network'].name,
+                                        deserialized.data['features'][0].name, fmt)
+        attachment = Response(stream_with_context(stream), mimetype=columnar.MIMETYPES[fmt])
     else:
         stream = get_observation_datadump_csv(**deserialized.data)
         filename = datetime.now().isoformat() + '-' + deserialized.data['network'].name + '.csv'
@@ -665,7 +697,7 @@ def get_observation_queries(args):
 
     for feature in features:
         table_name = network.name + '__' + feature.name
-        table = reflect(table_name, MetaData(), redshift_engine)
+        table = feature_table(table_name)
         tables.append(table)
 
     return [(observation_query(table, **args.data), table) for table in tables]
@@ -696,7 +728,7 @@ def get_observation_nearest_query(args):
         return 'No nodes could be found nearby with your target feature.'
 
     feature_str = '{}__{}'.format(network.name, feature.name)
-    feature = redshift_base.metadata.tables[feature_str]
+    feature = feature_table(feature_str)
 
     result = None
     for row in nearest_nodes_rp:
@@ -741,25 +773,20 @@ def get_observation_datadump_csv(**kwargs):
 
     queries_and_tables = get_observation_queries(vr_proxy)
 
-    chunksize = 100
-
     buffer = io.StringIO()
     writer = csv.writer(buffer)
 
     for query, table in queries_and_tables:
 
         writer.writerow([c.name for c in table.c])
-        rownum = 1
 
-        # Chunk sizes of 25000 seem to be the sweet spot. The windowed_query
-        # doesn't take that long to calculate the query bounds, and the results
-        # are large enough that download speed is decent
-        for row in query.yield_per(1000):
+        # Flush once per fetch from the server-side cursor, so that every
+        # chunk sent to the client corresponds to a single round trip.
+        for rownum, row in enumerate(stream(query), 1):
 
-            rownum += 1
             writer.writerow([getattr(row, c) for c in row.keys()])
 
-            if rownum % chunksize == 0:
+            if rownum % STREAM_FETCH_SIZE == 0:
                 yield buffer.getvalue()
                 buffer.close()
                 buffer = io.StringIO()
@@ -771,6 +798,45 @@ def get_observation_datadump_csv(**kwargs):
     buffer.close()
 
 
+def get_observation_datadump_lines(**kwargs):
+    '''Query and yield chunks of sensor network observations as ndjson, or
+    as a geojsonseq of features located at their nodes.'''
+
+    class ValidatorResultProxy(object):
+        pass
+
+    vr_proxy = ValidatorResultProxy()
+    vr_proxy.data = kwargs
+
+    queries_and_tables = get_observation_queries(vr_proxy)
+
+    def records():
+        for query, table in queries_and_tables:
+            columns = [c.name for c in table.c]
+            for row in stream(query):
+                yield OrderedDict(zip(columns, row))
+
+    if kwargs['data_type'] == 'ndjson':
+        return chunked(ndjson_lines(records()))
+
+    locations = NodeMeta.geometries(kwargs['network'].name)
+    return chunked(geojsonseq_lines((locations.get(r['node_id'].lower()), r) for r in records()))
+
+
+def get_observation_datadump_columnar(**kwargs):
+    '''Query and yield record batches of the observations of a single feature
+    as a parquet file or an arrow stream.'''
+
+    class ValidatorResultProxy(object):
+        pass
+
+    vr_proxy = ValidatorResultProxy()
+    vr_proxy.data = kwargs
+
+    [(query, table)] = get_observation_queries(vr_proxy)
+    return columnar.columnar_export(stream(query), list(table.c), kwargs['data_type'])
+
+
 def get_observation_datadump_json(**kwargs):
     '''Query and yield chunks of sensor network observations for streaming.'''
 
@@ -782,18 +848,17 @@ def get_observation_datadump_json(**kwargs):
 
     queries_and_tables = get_observation_queries(vr_proxy)
 
-    chunksize = 1000
     buffer = '{"objects": ['
 
     for query, table in queries_and_tables:
         columns = [c.name for c in table.c]
 
-        for i, row in enumerate(query.yield_per(1000)):
+        for i, row in enumerate(stream(query), 1):
             row = dict(zip(columns, row))
             buffer += json.dumps(row, default=unknown_object_json_handler)
             buffer += ','
 
-            if i % chunksize == 0:
+            if i % STREAM_FETCH_SIZE == 0:
                 yield buffer
                 buffer = ''
 
@@ -1,13 +1,51 @@
 import logging
+from time import time as now
 
-from sqlalchemy import text
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.exc import NoSuchTableError, ProgrammingError
 
 from plenario.database import redshift_engine
+from plenario.settings import FEATURE_TABLE_TTL
 
 
 logger = logging.getLogger(__name__)
 
+# Catalog of reflected feature tables, name -> (expires, Table)
+_feature_tables = {}
+
+
+def feature_table(table_name):
+    """Reflect a single redshift table, like network__feature, or reuse its
+    reflection from the last FEATURE_TABLE_TTL seconds.
+
+    :param table_name: (str) table name
+    :returns: (Table) SQLAlchemy object, shared, don't modify it
+    :raises KeyError: if there is no such table
+    """
+    cached = _feature_tables.get(table_name)
+    if cached is not None and cached[0] > now():
+        return cached[1]
+
+    try:
+        table = Table(table_name, MetaData(bind=redshift_engine), autoload=True)
+    except NoSuchTableError:
+        _feature_tables.pop(table_name, None)
+        raise KeyError(table_name)
+
+    _feature_tables[table_name] = (now() + FEATURE_TABLE_TTL, table)
+    return table
+
+
+def feature_tables():
+    """Every feature table, network__feature, in the database by name."""
+    names = inspect(redshift_engine).get_table_names()
+    return {name: feature_table(name) for name in names if '__' in name}
+
+
+def forget_feature_table(table_name):
+    """Drop a table from the catalog after it has been created or altered."""
+    _feature_tables.pop(table_name, None)
+
 
 def create_foi_table(foi_name, properties):
     """Create a new foi table
@@ -35,6 +73,7 @@ def create_foi_table(foi_name, properties):
     operation = template.format(**kwargs)
     logger.info(operation)
     redshift_engine.execute(text(operation))
+    forget_feature_table(foi_name)
 
 
 def table_exists(table_name):
@@ -0,0 +1,117 @@
+"""How the sensor networks are put together, network -> node -> sensor ->
+feature.property, along with the reverse maps, so that the validators and
+metadata endpoints can answer from memory instead of calling network_tree()
+and walking relationships on every request.
+
+A Topology is built from the sensor metadata tables as part of the registry
+snapshot, see plenario.registry, and is replaced rather than updated when the
+metadata changes. Treat what it hands out as read-only.
+"""
+from collections import defaultdict
+
+from sqlalchemy import select
+
+
+class Topology(object):
+
+    def __init__(self, networks, nodes, sensors, links, feature_networks):
+        """
+        :param networks: names of every network
+        :param nodes: (network, node id) for every node
+        :param sensors: (name, observed properties) for every sensor
+        :param links: (network, node id, sensor) for every sensor on a node
+        :param feature_networks: (feature, network) for every network a
+                                 feature belongs to
+        """
+        observed_properties = dict(sensors)
+
+        # network -> node -> sensor -> observed properties, the same thing
+        # the network_tree function returns
+        self.trees = {network: {} for network in networks}
+        self.nodes = defaultdict(list)
+        self.sensor_nodes = defaultdict(set)
+        self.network_sensors = defaultdict(set)
+        self.network_features = defaultdict(set)
+        # (network, feature) -> sensors reporting on the feature there
+        self.reporting = defaultdict(set)
+        self.feature_networks = defaultdict(set)
+
+        for network, node in nodes:
+            self.nodes[network].append(node)
+
+        for network, node, sensor in links:
+            # Like network_tree, which joins the links to the sensor metadata
+            if sensor not in observed_properties:
+                continue
+            properties = observed_properties[sensor] or {}
+            self.trees.setdefault(network, {}).setdefault(node, {})[sensor] = properties
+            self.sensor_nodes[sensor].add((network, node))
+            self.network_sensors[network].add(sensor)
+            for feature_property in properties.values():
+                feature = feature_property.split('.')[0]
+                self.network_features[network].add(feature)
+                self.reporting[network, feature].add(sensor)
+
+        for feature, network in feature_networks:
+            self.feature_networks[feature].add(network)
+
+    @classmethod
+    def load(cls, session):
+        """Build the topology with the five queries it takes."""
+        from plenario.models.SensorNetwork import FeatureMeta, NetworkMeta, NodeMeta, SensorMeta, \
+            feature_to_network, sensor_to_node
+
+        return cls(
+            networks=[name for name, in session.query(NetworkMeta.name)],
+            nodes=session.query(NodeMeta.sensor_network, NodeMeta.id).all(),
+            sensors=session.query(SensorMeta.name, SensorMeta.observed_properties).all(),
+            links=session.execute(select([
+                sensor_to_node.c.network, sensor_to_node.c.node, sensor_to_node.c.sensor
+            ])).fetchall(),
+            feature_networks=session.execute(select([
+                feature_to_network.c.feature, feature_to_network.c.network
+            ])).fetchall()
+        )
+
+    def tree(self, network) -> dict:
+        """Nodes of a network, with their sensors and what they observe."""
+        return self.trees.get(network, {})
+
+    def sensors(self, network) -> set:
+        return set(self.network_sensors.get(network, ()))
+
+    def features(self, network) -> set:
+        return set(self.network_features.get(network, ()))
+
+    def sensors_of(self, feature) -> set:
+        """Sensors reporting on a feature in any of the networks it belongs to."""
+        results = set()
+        for network in self.feature_networks.get(feature, ()):
+            results |= self.reporting.get((network, feature), set())
+        return results
+
+    def nodes_of(self, sensor) -> set:
+        """(network, node id) for every node a sensor is on."""
+        return set(self.sensor_nodes.get(sensor, ()))
+
+    def network_index(self) -> list:
+        return [network.lower() for network in self.trees]
+
+    def node_index(self, network=None) -> list:
+        if network is not None:
+            return list(self.nodes.get(network, ()))
+        return [node for nodes in self.nodes.values() for node in nodes]
+
+    def sensor_index(self, network=None) -> list:
+        return list({s.lower() for s in self._matching(self.network_sensors, network)})
+
+    def feature_index(self, network=None) -> list:
+        return list({f.lower() for f in self._matching(self.network_features, network)})
+
+    @staticmethod
+    def _matching(by_network, network):
+        # Network names are matched without regard to case, as the validators
+        # always have
+        for name, values in by_network.items():
+            if network is None or name.lower() == network.lower():
+                yield from values
@@ -7,6 +7,7 @@ from logging import getLogger
 from raven.contrib.flask import Sentry
 import yaml
 
+from plenario import metrics
 from plenario.database import postgres_session as db_session
 from plenario.models import bcrypt
 from plenario.settings import PLENARIO_SENTRY_URL
@@ -44,6 +45,7 @@ def create_app():
     app.config.from_object('plenario.settings')
     app.config['JSON_SORT_KEYS'] = False
     app.url_map.strict_slashes = False
+    metrics.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     bcrypt.init_app(app)
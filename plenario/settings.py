@@ -1,10 +1,12 @@
+import json
 from os import environ
 
 
 get = environ.get
 
 
-SECRET_KEY = get('SECRET_KEY', 'abcdefghijklmnop')
+DEFAULT_SECRET_KEY = 'abcdefghijklmnop'
+SECRET_KEY = get('SECRET_KEY', DEFAULT_SECRET_KEY)
 
 PLENARIO_SENTRY_URL = get('PLENARIO_SENTRY_URL', None)
 
@@ -26,16 +28,110 @@ RS_HOST = get('REDSHIFT_HOST', 'localhost')
 RS_PORT = get('REDSHIFT_PORT', 5432)
 RS_NAME = get('REDSHIFT_NAME', 'plenario_test')
 
+# Optional read replica of the postgres database, which answers the requests
+# served by the views in REPLICA_MODULES. While it can't be reached, those
+# requests go to the primary and the replica is retried every REPLICA_RETRY
+# seconds. Once reached, it isn't checked again for REPLICA_CHECK seconds.
+DB_READ_HOST = get('POSTGRES_READ_HOST', '')
+DB_READ_PORT = get('POSTGRES_READ_PORT', DB_PORT)
+REPLICA_RETRY = int(get('REPLICA_RETRY', 30))
+REPLICA_CHECK = int(get('REPLICA_CHECK', 10))
+REPLICA_MODULES = [
+    'plenario.api.point',
+    'plenario.api.timeseries',
+    'plenario.api.shape',
+    'plenario.api.sensor'
+]
+
 DATABASE_CONN = 'postgresql://{}:{}@{}:{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
 REDSHIFT_CONN = 'postgresql://{}:{}@{}:{}/{}'.format(RS_USER, RS_PASSWORD, RS_HOST, RS_PORT, RS_NAME)
+DATABASE_READ_CONN = 'postgresql://{}:{}@{}:{}/{}'.format(DB_USER, DB_PASSWORD, DB_READ_HOST, DB_READ_PORT, DB_NAME) \
+    if DB_READ_HOST else ''
+
+# Connection pools. Once pool size plus overflow connections are in use, a
+# checkout waits up to POOL_TIMEOUT seconds for one to be returned and then
+# fails. Connections are replaced after POOL_RECYCLE seconds and, with
+# POOL_PRE_PING, tested before they are handed out.
+POSTGRES_POOL_SIZE = int(get('POSTGRES_POOL_SIZE', 10))
+POSTGRES_MAX_OVERFLOW = int(get('POSTGRES_MAX_OVERFLOW', 10))
+POSTGRES_POOL_TIMEOUT = int(get('POSTGRES_POOL_TIMEOUT', 30))
+POSTGRES_POOL_RECYCLE = int(get('POSTGRES_POOL_RECYCLE', 30 * 60))
+POSTGRES_POOL_PRE_PING = get('POSTGRES_POOL_PRE_PING', 'true').lower() == 'true'
+
+REDSHIFT_POOL_SIZE = int(get('REDSHIFT_POOL_SIZE', 5))
+REDSHIFT_MAX_OVERFLOW = int(get('REDSHIFT_MAX_OVERFLOW', 10))
+REDSHIFT_POOL_TIMEOUT = int(get('REDSHIFT_POOL_TIMEOUT', 30))
+REDSHIFT_POOL_RECYCLE = int(get('REDSHIFT_POOL_RECYCLE', 30 * 60))
+REDSHIFT_POOL_PRE_PING = get('REDSHIFT_POOL_PRE_PING', 'true').lower() == 'true'
+
+# Number of rows fetched per round trip by the server-side cursors used for
+# streaming exports (datadump, sensor downloads and archives)
+STREAM_FETCH_SIZE = int(get('STREAM_FETCH_SIZE', 1000))
+
+# Size in bytes of the chunks that exports generated by the database itself
+# (COPY TO STDOUT) are handed to the response in
+STREAM_CHUNK_SIZE = int(get('STREAM_CHUNK_SIZE', 64 * 1024))
+
+# Number of rows in each record batch of parquet and arrow exports, which is
+# also the size of the row groups of parquet files
+COLUMNAR_BATCH_ROWS = int(get('COLUMNAR_BATCH_ROWS', 64 * 1024))
+
+# Upper bound on the number of point_date ranges a datadump can be split into
+# with datadump_total, each of which is exported over its own connection
+DATADUMP_MAX_PARTS = int(get('DATADUMP_MAX_PARTS', 8))
+
+# Number of datasets whose timeseries are counted concurrently, each on its own
+# pooled connection, when /timeseries is asked about several datasets at once
+TIMESERIES_WORKERS = int(get('TIMESERIES_WORKERS', 4))
+
+# Compression applied to exports and downloads for clients that accept it, as
+# a zlib level (1-9) for gzip and a quality (0-11) for brotli
+COMPRESSION_LEVEL = int(get('COMPRESSION_LEVEL', 6))
+BROTLI_QUALITY = int(get('BROTLI_QUALITY', 4))
+
+# Planner cost estimates above which a request is turned into a job, or refused
+# outright with a 413. Set either to 0 to turn it off.
+QUERY_COST_JOB = float(get('QUERY_COST_JOB', 1e7))
+QUERY_COST_REJECT = float(get('QUERY_COST_REJECT', 1e9))
+
+# Milliseconds that a single statement run for an API request may take, by
+# endpoint, with STATEMENT_TIMEOUT for endpoints that aren't listed. More
+# endpoints can be given as a json object in the STATEMENT_TIMEOUTS environment
+# variable. Statements run by the admin views, ETL and jobs aren't limited, 0
+# means no limit.
+STATEMENT_TIMEOUT = int(get('STATEMENT_TIMEOUT', 30 * 1000))
+STATEMENT_TIMEOUTS = {
+    'api.timeseries': 60 * 1000,
+    'api.grid': 60 * 1000,
+    'api.datadump': 15 * 60 * 1000,
+    'api.sensor_network_download': 15 * 60 * 1000,
+    'api.node_download': 15 * 60 * 1000
+}
+STATEMENT_TIMEOUTS.update(json.loads(get('STATEMENT_TIMEOUTS', '{}')))
 
 # Use this cache for data that can be refreshed
 REDIS_HOST = get('REDIS_HOST', 'localhost')
 
+# Redis database that the counters and histograms served at /metrics are
+# kept in
+METRICS_REDIS_URL = get('METRICS_REDIS_URL', 'redis://{}:6379/1'.format(REDIS_HOST))
+
+# Every process keeps a snapshot of the dataset registries, meta_master and
+# meta_shape, for at most REGISTRY_TTL seconds. Changes to them are announced
+# on REGISTRY_CHANNEL, which drops the snapshots right away.
+REGISTRY_TTL = int(get('REGISTRY_TTL', 60))
+REGISTRY_REDIS_URL = get('REGISTRY_REDIS_URL', 'redis://{}:6379/0'.format(REDIS_HOST))
+REGISTRY_CHANNEL = get('REGISTRY_CHANNEL', 'plenario_registry')
+
+# Redshift feature tables, network__feature, are reflected one at a time as
+# they are needed and reused for FEATURE_TABLE_TTL seconds.
+FEATURE_TABLE_TTL = int(get('FEATURE_TABLE_TTL', 5 * 60))
+
 # See: https://pythonhosted.org/Flask-Cache/#configuring-flask-cache
-# for config options
+# for config options. The backend is wrapped to count hits and misses.
 CACHE_CONFIG = {
-    'CACHE_TYPE': 'redis',
+    'CACHE_TYPE': 'plenario.metrics.counting_cache',
+    'CACHE_BACKEND': 'redis',
     'CACHE_REDIS_HOST': REDIS_HOST,
     'CACHE_KEY_PREFIX': get('CACHE_KEY_PREFIX', 'plenario_app')
 }
@@ -53,6 +149,14 @@ AWS_SECRET_KEY = get('AWS_SECRET_KEY', '')
 AWS_REGION_NAME = get('AWS_REGION_NAME', 'us-east-1')
 S3_BUCKET = get('S3_BUCKET', '')
 
+# Results of job=true requests are written in chunks of JOBS_CHUNK_SIZE bytes
+# to either a directory shared by the server and worker ('filesystem') or an
+# S3 bucket ('s3')
+JOBS_RESULT_STORE = get('JOBS_RESULT_STORE', 'filesystem')
+JOBS_RESULT_PATH = get('JOBS_RESULT_PATH', '/tmp/plenario/jobs')
+JOBS_RESULT_BUCKET = get('JOBS_RESULT_BUCKET', S3_BUCKET)
+JOBS_CHUNK_SIZE = int(get('JOBS_CHUNK_SIZE', 1024 * 1024))
+
 # Email address for notifying site administrators
 # Expect comma-delimited list of emails.
 _admin_emails = get('ADMIN_EMAILS')
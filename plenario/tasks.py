@@ -10,12 +10,17 @@ from dateutil.parser import parse as date_parse
 from raven import Client
 from sqlalchemy import Table
 
-from plenario.database import redshift_base, redshift_session, postgres_session, postgres_base, postgres_engine
+from plenario.database import redshift_session, postgres_session, postgres_engine, \
+    stream
+from plenario import metrics, registry
 from plenario.etl.point import PlenarioETL
 from plenario.etl.shape import ShapeETL
 from plenario.models import MetaTable, ShapeMetadata
-from plenario.settings import CELERY_BROKER_URL, S3_BUCKET, PLENARIO_SENTRY_URL, CELERY_RESULT_BACKEND
-from plenario.utils.helpers import reflect
+from plenario.sensor_network.redshift_ops import feature_tables
+from plenario.settings import CELERY_BROKER_URL, JOBS_CHUNK_SIZE, S3_BUCKET, PLENARIO_SENTRY_URL, \
+    CELERY_RESULT_BACKEND
+from plenario.utils.helpers import forget_reflection, reflect, sign
+from plenario.utils.result_store import get_result_store
 from plenario.utils.weather import WeatherETL
 
 
@@ -26,6 +31,7 @@ worker = Celery(
     broker=CELERY_BROKER_URL,
     backend=CELERY_RESULT_BACKEND
 )
+metrics.init_celery()
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +62,78 @@ def health() -> bool:
     return True
 
 
+# Flask app that job requests are replayed against, created on first use
+_job_app = None
+
+# Header that marks a request as a job being run by a worker
+JOB_HEADER = 'X-Plenario-Job'
+
+
+@worker.task(bind=True)
+def run_job(self, path: str, query: dict) -> dict:
+    """Answer a job=true api request. The request is replayed against the api
+    without the job flag, and the response body is written to the result
+    store in chunks of JOBS_CHUNK_SIZE bytes as it is produced.
+    """
+    global _job_app
+    logger.info('Begin. (path: "{}")'.format(path))
+
+    if _job_app is None:
+        # The server imports the api, which imports this module.
+        from plenario.server import create_app
+        _job_app = create_app()
+        # Jobs exist for requests that take too long to answer inline.
+        _job_app.config['STATEMENT_TIMEOUT'] = 0
+        _job_app.config['STATEMENT_TIMEOUTS'] = {}
+
+    ticket = self.request.id
+    store = get_result_store()
+    record = store.get_record(ticket) or {}
+    record.update({
+        'startTime': datetime.now().isoformat(),
+        'workers': [self.request.hostname]
+    })
+    store.put_record(ticket, record)
+
+    headers = {JOB_HEADER: '{}:{}'.format(ticket, sign(ticket))}
+    response = _job_app.test_client().get(path, query_string=query, headers=headers, buffered=False)
+
+    chunks = 0
+    size = 0
+    pieces = []
+    buffered = 0
+    try:
+        for piece in response.iter_encoded():
+            pieces.append(piece)
+            buffered += len(piece)
+            if buffered >= JOBS_CHUNK_SIZE:
+                store.put_chunk(ticket, chunks, b''.join(pieces))
+                chunks += 1
+                size += buffered
+                pieces = []
+                buffered = 0
+                self.update_state(state='PROGRESS', meta={'chunks': chunks, 'bytes': size})
+        if pieces or chunks == 0:
+            store.put_chunk(ticket, chunks, b''.join(pieces))
+            chunks += 1
+            size += buffered
+    finally:
+        response.close()
+
+    record.update({
+        'endTime': datetime.now().isoformat(),
+        'statusCode': response.status_code,
+        'contentType': response.headers.get('Content-Type'),
+        'contentDisposition': response.headers.get('Content-Disposition'),
+        'chunks': chunks,
+        'bytes': size
+    })
+    store.put_record(ticket, record)
+
+    logger.info('End.')
+    return {'chunks': chunks, 'bytes': size}
+
+
 @worker.task()
 def add_dataset(name: str) -> bool:
     """Ingest the row information for an approved point dataset.
@@ -83,9 +161,12 @@ def delete_dataset(name: str) -> bool:
     """Delete the table and meta information for an approved point dataset.
     """
     logger.info('Begin. (name: "{}")'.format(name))
-    metatable = reflect("meta_master", postgres_base.metadata, postgres_engine)
+    get_meta(name).drop_daily_rollup()
+    metatable = reflect("meta_master", postgres_engine)
     metatable.delete().where(metatable.c.dataset_name == name).execute()
-    reflect(name, postgres_base.metadata, postgres_engine).drop()
+    registry.invalidate()
+    reflect(name, postgres_engine).drop()
+    forget_reflection(name)
     logger.info('End.')
     return True
 
@@ -120,11 +201,13 @@ def delete_shape(name) -> bool:
     """
     logger.info('Begin. (name: "{}")'.format(name))
     logger.debug('Reflect the shape metadata table.')
-    metashape = reflect("meta_shape", postgres_base.metadata, postgres_engine)
+    metashape = reflect("meta_shape", postgres_engine)
     logger.debug('Delete the shape meta record.')
     metashape.delete().where(metashape.c.dataset_name == name).execute()
+    registry.invalidate()
     logger.debug('Reflect and drop the corresponding shape table.')
-    reflect(name, postgres_base.metadata, postgres_engine).drop()
+    reflect(name, postgres_engine).drop()
+    forget_reflection(name)
     logger.info('End.')
     return True
 
@@ -222,17 +305,12 @@ def archive(datetime_string: str) -> bool:
     """
     logger.debug('reflecting tables')
     # Get table objects for all known feature tables in redshift database
-    redshift_base.metadata.reflect()
-    tables = dict(redshift_base.metadata.tables)
+    tables = feature_tables()
     logger.debug('reflected redshift tables')
 
-    try:
-        del tables['unknown_feature']
-        del tables['array_of_things_chicago__unknown_feature']
-        logger.debug('deleted unknown feature keys')
-    except KeyError:
-        # The unknown feature table might not exist in test environments
-        pass
+    # The unknown feature table might not exist in test environments
+    tables.pop('array_of_things_chicago__unknown_feature', None)
+    logger.debug('deleted unknown feature keys')
 
     # Get the start and end datetime bounds for this month
     start, end = start_and_end_of_the_month(date_parse(datetime_string))
@@ -298,10 +376,9 @@ def table_to_csvs(table: Table, start: datetime, end: datetime) -> list:
 
     query = redshift_session.query(table) \
         .filter(table.c.datetime >= start) \
-        .filter(table.c.datetime < end) \
-        .yield_per(1000)
+        .filter(table.c.datetime < end)
 
-    for row in query:
+    for row in stream(query):
         node = row.node_id
         if node not in files:
             file = '{}.{}.{}.{}.csv'
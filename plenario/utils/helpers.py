@@ -1,15 +1,29 @@
 import csv
+import hmac
 import math
 from collections import namedtuple
+from hashlib import sha256
 
 import boto3
 from slugify import slugify as _slugify
-from sqlalchemy import Table
+from sqlalchemy import MetaData, Table
 
-from plenario.settings import ADMIN_EMAILS, AWS_ACCESS_KEY, AWS_REGION_NAME, AWS_SECRET_KEY, MAIL_USERNAME
+from plenario.settings import ADMIN_EMAILS, AWS_ACCESS_KEY, AWS_REGION_NAME, AWS_SECRET_KEY, MAIL_USERNAME, \
+    SECRET_KEY
 from plenario.utils.typeinference import normalize_column_type
 
 
+# (database url, table name) -> (version, Table)
+_reflections = {}
+
+
+def sign(message: str) -> str:
+    """HMAC of a message keyed with SECRET_KEY, for values we hand out and
+    later need to recognize as our own.
+    """
+    return hmac.new(SECRET_KEY.encode('utf-8'), message.encode('utf-8'), sha256).hexdigest()
+
+
 def get_size_in_degrees(meters, latitude):
     earth_circumference = 40041000.0  # meters, average circumference
     degrees_per_meter = 360.0 / earth_circumference
@@ -113,17 +127,31 @@ def send_mail(subject, recipient, body):
         print(e, 'Failed to send email through AWS SES.')
 
 
-def reflect(table_name, metadata, engine):
-    """Helper function for an oft repeated block of code.
+def reflect(table_name, engine, version=None):
+    """Reflect a table, or reuse the reflection of an earlier call with the
+    same version. Reflections are kept for the life of the process, so tables
+    whose columns can change should pass something that changes with them,
+    like the data_version of a dataset, or be forgotten with forget_reflection.
 
     :param table_name: (str) table name
-    :param metadata: (MetaData) SQLAlchemy object found in a declarative base
     :param engine: (Engine) SQLAlchemy object to send queries to the database
-    :returns: (Table) SQLAlchemy object
+    :param version: any value that changes when the columns of the table do
+    :returns: (Table) SQLAlchemy object, shared, don't modify it
     """
-    return Table(
-        table_name,
-        metadata,
-        autoload=True,
-        autoload_with=engine
-    )
+    key = (str(engine.url), table_name)
+    cached = _reflections.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    # A MetaData of its own, so that a newer version never has to extend the
+    # Table object that requests are still using. Bound, like the declarative
+    # bases, so statements made from it can be executed on their own.
+    table = Table(table_name, MetaData(bind=engine), autoload=True)
+    _reflections[key] = (version, table)
+    return table
+
+
+def forget_reflection(table_name):
+    """Drop the reflections of a table that has been altered or dropped."""
+    for key in [k for k in _reflections if k[1] == table_name]:
+        _reflections.pop(key, None)
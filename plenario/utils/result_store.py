@@ -0,0 +1,90 @@
+import json
+import os
+
+import boto3
+from botocore.exceptions import ClientError
+
+from plenario.settings import JOBS_RESULT_BUCKET, JOBS_RESULT_PATH, JOBS_RESULT_STORE
+
+
+class FileResultStore(object):
+    """Keeps job records and result chunks in a directory per ticket. The
+    directory has to be shared between the server and the worker.
+    """
+
+    def __init__(self, root: str = JOBS_RESULT_PATH):
+        self.root = root
+
+    def _path(self, ticket: str, name: str) -> str:
+        return os.path.join(self.root, ticket, name)
+
+    def _write(self, ticket: str, name: str, data: bytes) -> None:
+        path = self._path(ticket, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to the side and rename, so readers never see a partial file
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+
+    def _read(self, ticket: str, name: str):
+        try:
+            with open(self._path(ticket, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_record(self, ticket: str, record: dict) -> None:
+        self._write(ticket, 'record.json', json.dumps(record).encode('utf-8'))
+
+    def get_record(self, ticket: str):
+        data = self._read(ticket, 'record.json')
+        return json.loads(data.decode('utf-8')) if data is not None else None
+
+    def put_chunk(self, ticket: str, index: int, data: bytes) -> None:
+        self._write(ticket, 'chunk-{}'.format(index), data)
+
+    def get_chunk(self, ticket: str, index: int):
+        return self._read(ticket, 'chunk-{}'.format(index))
+
+
+class S3ResultStore(object):
+    """Same interface as FileResultStore, backed by an S3 (or S3 compatible)
+    bucket with one key prefix per ticket.
+    """
+
+    def __init__(self, bucket: str = JOBS_RESULT_BUCKET, prefix: str = 'jobs'):
+        self.bucket = boto3.resource('s3').Bucket(bucket)
+        self.prefix = prefix
+
+    def _key(self, ticket: str, name: str) -> str:
+        return '{}/{}/{}'.format(self.prefix, ticket, name)
+
+    def _read(self, ticket: str, name: str):
+        try:
+            return self.bucket.Object(self._key(ticket, name)).get()['Body'].read()
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def put_record(self, ticket: str, record: dict) -> None:
+        body = json.dumps(record).encode('utf-8')
+        self.bucket.put_object(Key=self._key(ticket, 'record.json'), Body=body)
+
+    def get_record(self, ticket: str):
+        data = self._read(ticket, 'record.json')
+        return json.loads(data.decode('utf-8')) if data is not None else None
+
+    def put_chunk(self, ticket: str, index: int, data: bytes) -> None:
+        self.bucket.put_object(Key=self._key(ticket, 'chunk-{}'.format(index)), Body=data)
+
+    def get_chunk(self, ticket: str, index: int):
+        return self._read(ticket, 'chunk-{}'.format(index))
+
+
+def get_result_store():
+    """Return the result store selected by the JOBS_RESULT_STORE setting.
+    """
+    if JOBS_RESULT_STORE == 's3':
+        return S3ResultStore()
+    return FileResultStore()
@@ -18,8 +18,9 @@ from metar.metar import ParserError
 from sqlalchemy import BigInteger, Column, Date, DateTime, Float, Integer, String, Table, and_, distinct, select, text
 from sqlalchemy.dialects.postgresql import ARRAY
 
-from plenario.database import postgres_base, postgres_engine as engine
+from plenario.database import postgres_base, postgres_engine as engine, postgres_session
 from plenario.settings import DATA_DIR
+from plenario.utils.helpers import reflect
 from .weather_metar import getAllCurrentWeather, getCurrentWeather, getMetar, getMetarVals
 
 
@@ -1401,8 +1402,7 @@ class WeatherETL(object):
         return date(year, month, day)
 
     def _get_distinct_weather_stations_by_month(self, year, month, daily_or_hourly='daily'):
-        table = Table('dat_weather_observations_%s' % daily_or_hourly, postgres_base.metadata, autoload=True,
-                      autoload_with=engine)
+        table = reflect('dat_weather_observations_%s' % daily_or_hourly, engine)
         column = None
         if (daily_or_hourly == 'daily'):
             column = table.c.date
@@ -11,13 +11,12 @@ import requests
 from flask import Blueprint, flash, redirect, render_template, request, session as flask_session, url_for
 from flask_login import login_required
 from flask_wtf import Form
-from sqlalchemy import Table
 from sqlalchemy.exc import NoSuchTableError
 from wtforms import SelectField, StringField
 from wtforms.validators import DataRequired
 
 import plenario.tasks as worker
-from plenario.database import postgres_base, postgres_engine as engine, postgres_session
+from plenario.database import postgres_session
 from plenario.models import MetaTable, ShapeMetadata, User
 from plenario.settings import FLOWER_URL
 from plenario.utils.helpers import infer_csv_columns, send_mail, slugify
@@ -699,9 +698,7 @@ def edit_dataset(source_url_hash):
 
     if meta.approved_status:
         try:
-            table_name = meta.dataset_name
-            table = Table(table_name, postgres_base.metadata,
-                          autoload=True, autoload_with=engine)
+            table = meta.point_table
 
             # Would prefer to just get the names from the metadata
             # without needing to reflect.
@@ -4,6 +4,7 @@ from logging import getLogger
 from flask import Flask
 
 import plenario.tasks as tasks
+from plenario import metrics
 
 
 logger = getLogger(__name__)
@@ -15,6 +16,7 @@ def create_worker():
     app = Flask(__name__)
     app.config.from_object('plenario.settings')
     app.url_map.strict_slashes = False
+    metrics.init_app(app)
 
     @app.route('/update/weather', methods=['POST'])
     def weather():
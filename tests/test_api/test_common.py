@@ -0,0 +1,63 @@
+import unittest
+
+from werkzeug.datastructures import MultiDict
+
+from plenario.api.common import canonical_query, requested_datasets
+
+
+class TestCanonicalQuery(unittest.TestCase):
+
+    def test_argument_order(self):
+        a = MultiDict([('dataset_name', 'crimes'), ('agg', 'week')])
+        b = MultiDict([('agg', 'week'), ('dataset_name', 'crimes')])
+        self.assertEqual(canonical_query(a), canonical_query(b))
+
+    def test_equivalent_dates(self):
+        a = MultiDict([('obs_date__ge', '2016-01-01')])
+        b = MultiDict([('obs_date__ge', '2016-01-01T00:00:00')])
+        self.assertEqual(canonical_query(a), canonical_query(b))
+
+    def test_equivalent_geojson(self):
+        a = MultiDict([('location_geom__within', '{"type": "Point", "coordinates": [1, 2]}')])
+        b = MultiDict([('location_geom__within', '{"coordinates":[1,2],"type":"Point"}')])
+        self.assertEqual(canonical_query(a), canonical_query(b))
+
+    def test_equivalent_trees(self):
+        a = MultiDict([('crimes__filter', '{"op": "eq", "col": "iucr", "val": 1150}')])
+        b = MultiDict([('crimes__filter', '{"val":1150,"col":"iucr","op":"eq"}')])
+        self.assertEqual(canonical_query(a), canonical_query(b))
+
+    def test_dataset_order(self):
+        a = MultiDict([('dataset_name__in', 'crimes,landmarks')])
+        b = MultiDict([('dataset_name__in', 'landmarks,crimes')])
+        self.assertEqual(canonical_query(a), canonical_query(b))
+
+    def test_different_queries(self):
+        a = MultiDict([('obs_date__ge', '2016-01-01')])
+        b = MultiDict([('obs_date__ge', '2016-01-02')])
+        self.assertNotEqual(canonical_query(a), canonical_query(b))
+
+    def test_unparseable_values_are_kept(self):
+        a = MultiDict([('location_geom__within', 'garbage')])
+        self.assertIn('garbage', canonical_query(a))
+
+
+class TestRequestedDatasets(unittest.TestCase):
+
+    def test_arguments_and_trees(self):
+        args = MultiDict([
+            ('dataset_name__in', 'crimes, landmarks'),
+            ('shape', 'chicago_neighborhoods'),
+            ('flu_shot_clinics__filter', '{"op": "eq", "col": "zip", "val": 60620}')
+        ])
+        self.assertEqual(
+            requested_datasets(args),
+            {'crimes', 'landmarks', 'chicago_neighborhoods', 'flu_shot_clinics'}
+        )
+
+    def test_view_args(self):
+        view_args = {'point_dataset_name': 'crimes', 'polygon_dataset_name': 'chicago_neighborhoods'}
+        self.assertEqual(
+            requested_datasets(MultiDict(), view_args),
+            {'crimes', 'chicago_neighborhoods'}
+        )
@@ -1,9 +1,17 @@
+import gzip
 import json
 import os
+import unittest
 import urllib.request, urllib.parse, urllib.error
-from io import StringIO
+from io import BytesIO, StringIO
 import csv
+from datetime import datetime
 
+from sqlalchemy import event
+
+from plenario.api import columnar, cost, jobs
+from plenario.database import postgres_engine, postgres_session
+from plenario.models import MetaTable
 from tests.fixtures.base_test import BasePlenarioTest, fixtures_path
 
 # Filters
@@ -107,6 +115,50 @@ class PointAPITests(BasePlenarioTest):
                                   '&include_columns=true')
         self.assertEqual(len(r['objects'][0]['columns']), 17)
 
+    def test_metadata_not_modified(self):
+        resp = self.app.get('/v1/api/datasets?dataset_name=crimes')
+        etag = resp.headers['ETag']
+
+        resp = self.app.get('/v1/api/datasets?dataset_name=crimes',
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+        resp = self.app.get('/v1/api/datasets?dataset_name=landmarks',
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_metadata_edit_changes_listing_etag(self):
+        etag = self.app.get('/v1/api/datasets').headers['ETag']
+
+        meta = postgres_session.query(MetaTable).filter(MetaTable.dataset_name == 'crimes').one()
+        description = meta.description
+        meta.description = 'Edited for the listing etag test'
+        postgres_session.commit()
+        try:
+            resp = self.app.get('/v1/api/datasets', headers={'If-None-Match': etag})
+        finally:
+            meta.description = description
+            postgres_session.commit()
+        self.assertEqual(resp.status_code, 200)
+
+    def test_not_modified_runs_no_queries(self):
+        etag = self.app.get('/v1/api/datasets?dataset_name=crimes').headers['ETag']
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(postgres_engine, 'before_cursor_execute', count)
+        try:
+            resp = self.app.get('/v1/api/datasets?dataset_name=crimes',
+                                headers={'If-None-Match': etag})
+        finally:
+            event.remove(postgres_engine, 'before_cursor_execute', count)
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(statements, [])
+
     ''' /fields '''
 
     def test_fields(self):
@@ -166,6 +218,65 @@ class PointAPITests(BasePlenarioTest):
                                   upper_hour_arg + lower_hour_arg)
         self.assertEqual(r['meta']['total'], 3)
 
+    def test_detail_cursor_pagination(self):
+        query = 'detail?dataset_name=flu_shot_clinics&obs_date__ge=2000&limit={}'
+
+        everything = self.get_api_response(query.format(10))
+        first_page = self.get_api_response(query.format(5))
+        cursor = first_page['meta']['next_cursor']
+        self.assertIsNotNone(cursor)
+
+        second_page = self.get_api_response(query.format(5) + '&cursor=' + cursor)
+        paged = first_page['objects'] + second_page['objects']
+        self.assertEqual(paged, everything['objects'])
+
+    def test_detail_cursor_pagination_with_shape(self):
+        query = 'detail?dataset_name=flu_shot_clinics&obs_date__ge=2000' \
+                '&shape=chicago_neighborhoods&limit={}'
+
+        everything = self.get_api_response(query.format(6))
+        first_page = self.get_api_response(query.format(3))
+        cursor = first_page['meta']['next_cursor']
+        self.assertIsNotNone(cursor)
+
+        second_page = self.get_api_response(query.format(3) + '&cursor=' + cursor)
+        paged = first_page['objects'] + second_page['objects']
+        self.assertEqual(len(everything['objects']), 6)
+        self.assertEqual(paged, everything['objects'])
+
+    def test_detail_ndjson(self):
+        query = '/v1/api/detail?dataset_name=flu_shot_clinics&obs_date__ge=2000&limit=10'
+        everything = json.loads(self.app.get(query).data.decode('utf-8'))
+
+        resp = self.app.get(query + '&data_type=ndjson')
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+
+        records = [json.loads(line) for line in resp.data.decode('utf-8').splitlines()]
+        self.assertEqual(records, everything['objects'])
+
+    def test_detail_geojsonseq(self):
+        query = '/v1/api/detail?dataset_name=flu_shot_clinics&obs_date__ge=2000&limit=10&data_type=geojsonseq'
+        resp = self.app.get(query)
+
+        records = resp.data.decode('utf-8').split('\x1e')[1:]
+        self.assertEqual(len(records), 10)
+        for record in records:
+            feature = json.loads(record)
+            self.assertEqual(feature['geometry']['type'], 'Point')
+            self.assertNotIn('geom', feature['properties'])
+
+    def test_detail_bad_cursor(self):
+        r = self.get_api_response('detail?dataset_name=flu_shot_clinics&cursor=garbage')
+        self.assertIn('cursor', r['meta']['message'])
+
+    def test_detail_cursor_with_offset(self):
+        query = 'detail?dataset_name=flu_shot_clinics&obs_date__ge=2000&limit=5'
+        cursor = self.get_api_response(query)['meta']['next_cursor']
+
+        resp = self.app.get('/v1/api/' + query + '&offset=5&cursor=' + cursor)
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('offset', resp.data.decode('utf-8'))
+
     def test_csv_response(self):
         query = '/v1/api/detail/?dataset_name=flu_shot_clinics&obs_date__ge=2013-09-22&obs_date__le=2013-10-1&data_type=csv'
         resp = self.app.get(query)
@@ -361,6 +472,24 @@ class PointAPITests(BasePlenarioTest):
         self.assertEqual(resp_data['objects'][0]['count'], 65)
         self.assertEqual(resp_data['objects'][1]['count'], 149)
 
+    def test_timeseries_from_daily_rollup(self):
+        meta = MetaTable.get_by_dataset_name('flu_shot_clinics')
+        start, end = datetime(2013, 9, 22, 12), datetime(2013, 10, 1, 12)
+        self.assertTrue(meta.has_daily_rollup)
+
+        for agg in ('day', 'week', 'month', 'year'):
+            from_rollup = meta.timeseries_one(agg, start, end)
+            meta.drop_daily_rollup()
+            try:
+                from_points = meta.timeseries_one(agg, start, end)
+            finally:
+                meta.refresh_daily_rollup()
+            self.assertEqual(from_rollup, from_points)
+
+    def test_timeseries_outside_every_dataset(self):
+        r = self.get_api_response('timeseries?obs_date__ge=1900-01-01&obs_date__le=1900-12-31')
+        self.assertEqual(r['objects'], [])
+
     def test_timeseries_with_multiple_datasets_but_one_is_bad(self):
         endpoint = 'timeseries'
         query = '?obs_date__ge=2000&agg=year&dataset_name__in=flu_shot_clinics,landmarkz'
@@ -430,6 +559,18 @@ class PointAPITests(BasePlenarioTest):
 
         self.assertEqual(response_data['meta']['total'], 5)
 
+    def test_polygon_filter_returns_shape_columns(self):
+        query = '/v1/api/detail/?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-09-22&obs_date__le=2013-10-1' \
+                '&shape=chicago_neighborhoods'
+        resp = self.app.get(query)
+        response_data = json.loads(resp.data.decode("utf-8"))
+
+        self.assertEqual(resp.status_code, 200)
+        for record in response_data['objects']:
+            self.assertIn('event_type', record)
+            self.assertIn('pri_neigh', record)
+
     def test_aggregate_column_filter(self):
         query = 'v1/api/detail-aggregate/' \
                 '?obs_date__ge=2013-1-1&obs_date__le=2014-1-1' \
@@ -453,3 +594,168 @@ class PointAPITests(BasePlenarioTest):
         resp = self.app.get(query)
         response_data = json.loads(resp.data.decode("utf-8"))
         self.assertTrue("Unused parameter value fake_column='fake'" in response_data['meta']['message'])
+
+    # =========
+    # /datadump
+    # =========
+
+    def test_datadump_csv(self):
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=csv'
+        resp = self.app.get(query)
+
+        reader = csv.reader(StringIO(resp.data.decode('utf-8')))
+        lines = [line for line in reader]
+
+        # One header line, 65 flu shot clinics in 2013
+        self.assertEqual(len(lines), 66)
+        for line in lines:
+            self.assertEqual(len(line), len(lines[0]))
+        self.assertNotIn('hash', lines[0])
+        self.assertNotIn('geom', lines[0])
+
+    def test_datadump_json(self):
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=json'
+        resp = self.app.get(query)
+
+        geojson = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(geojson['type'], 'FeatureCollection')
+        self.assertEqual(len(geojson['features']), 65)
+
+        feature = geojson['features'][0]
+        self.assertEqual(feature['geometry']['type'], 'Point')
+        self.assertNotIn('hash', feature['properties'])
+        self.assertNotIn('geom', feature['properties'])
+
+    def test_datadump_csv_in_parts(self):
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=csv'
+
+        def read_csv(url):
+            resp = self.app.get(url)
+            return list(csv.reader(StringIO(resp.data.decode('utf-8'))))
+
+        whole = read_csv(query)
+        stitched = read_csv(query + '&datadump_total=4')
+        parts = [read_csv(query + '&datadump_total=3&datadump_part={}'.format(i)) for i in (1, 2, 3)]
+
+        self.assertEqual(sorted(stitched), sorted(whole))
+        self.assertEqual(stitched[0], whole[0])
+        self.assertEqual(sum(len(part) for part in parts), len(whole))
+
+    def test_datadump_bad_part(self):
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics&datadump_total=2&datadump_part=3'
+        resp = self.app.get(query)
+        self.assertEqual(resp.status_code, 400)
+
+    @unittest.skipUnless(columnar.available(), 'pyarrow is not installed')
+    def test_datadump_parquet(self):
+        import pyarrow.parquet
+
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=parquet'
+        resp = self.app.get(query)
+        self.assertEqual(resp.mimetype, 'application/vnd.apache.parquet')
+
+        table = pyarrow.parquet.read_table(BytesIO(resp.data))
+        self.assertEqual(table.num_rows, 65)
+        self.assertNotIn('hash', table.schema.names)
+        self.assertNotIn('geom', table.schema.names)
+        self.assertEqual(str(table.schema.field('zip').type), 'int32')
+        self.assertEqual(str(table.schema.field('latitude').type), 'double')
+
+    @unittest.skipUnless(columnar.available(), 'pyarrow is not installed')
+    def test_datadump_arrow(self):
+        import pyarrow
+
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=arrow'
+        resp = self.app.get(query)
+
+        table = pyarrow.RecordBatchStreamReader(BytesIO(resp.data)).read_all()
+        self.assertEqual(table.num_rows, 65)
+        self.assertEqual(str(table.schema.field('point_date').type), 'timestamp[us]')
+
+    def test_datadump_ndjson(self):
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=ndjson'
+        resp = self.app.get(query)
+
+        records = [json.loads(line) for line in resp.data.decode('utf-8').splitlines()]
+        self.assertEqual(len(records), 65)
+        self.assertNotIn('hash', records[0])
+
+    def test_datadump_gzip(self):
+        query = '/v1/api/datadump?dataset_name=flu_shot_clinics' \
+                '&obs_date__ge=2013-01-01&obs_date__le=2013-12-31&data_type=csv'
+        plain = self.app.get(query)
+        compressed = self.app.get(query, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertLess(len(compressed.data), len(plain.data))
+
+    # ==========
+    # query cost
+    # ==========
+
+    def test_query_cost_estimate(self):
+        query = MetaTable.get_by_dataset_name('crimes').grid_query(500)[0]
+        total_cost, rows = cost.estimate(query.statement)
+        self.assertGreater(total_cost, 0)
+        self.assertGreater(rows, 0)
+
+    def test_expensive_grid_is_rejected(self):
+        reject = cost.QUERY_COST_REJECT
+        cost.QUERY_COST_REJECT = 0.01
+        try:
+            resp = self.app.get('/v1/api/grid?obs_date__ge=2000&dataset_name=crimes&resolution=50')
+        finally:
+            cost.QUERY_COST_REJECT = reject
+        self.assertEqual(resp.status_code, 413)
+
+        # The refusal isn't cached, the same query goes through once allowed
+        resp = self.app.get('/v1/api/grid?obs_date__ge=2000&dataset_name=crimes&resolution=50')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_expensive_grid_runs_inline_without_jobs(self):
+        job_cost, enabled = cost.QUERY_COST_JOB, jobs.JOBS_ENABLED
+        cost.QUERY_COST_JOB, jobs.JOBS_ENABLED = 0.01, False
+        try:
+            resp = self.app.get('/v1/api/grid?obs_date__ge=2000&dataset_name=crimes&resolution=75')
+        finally:
+            cost.QUERY_COST_JOB, jobs.JOBS_ENABLED = job_cost, enabled
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('ticket', json.loads(resp.data.decode('utf-8')))
+
+    # =====
+    # /jobs
+    # =====
+
+    def test_unknown_job(self):
+        resp = self.app.get('/v1/api/jobs/for_sure_this_isnt_a_job')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_job_requests_get_their_own_tickets(self):
+        url = '/v1/api/detail?dataset_name=flu_shot_clinics&job=true'
+        enabled = jobs.JOBS_ENABLED
+        jobs.JOBS_ENABLED = True
+        try:
+            first = self.app.get(url)
+            second = self.app.get(url)
+        finally:
+            jobs.JOBS_ENABLED = enabled
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('ETag', first.headers)
+        self.assertNotEqual(json.loads(first.data.decode('utf-8'))['ticket'],
+                            json.loads(second.data.decode('utf-8'))['ticket'])
+
+    def test_jobs_are_refused_with_the_default_secret_key(self):
+        enabled = jobs.JOBS_ENABLED
+        jobs.JOBS_ENABLED = False
+        try:
+            resp = self.app.get('/v1/api/detail?dataset_name=flu_shot_clinics&job=true')
+        finally:
+            jobs.JOBS_ENABLED = enabled
+        self.assertEqual(resp.status_code, 503)
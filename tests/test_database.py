@@ -0,0 +1,113 @@
+import time
+import unittest
+
+from sqlalchemy import column, func, select, table
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from plenario.database import InstrumentedQueuePool, QueryAbandoned, RoutingSession, fetch_all, pool_observers, \
+    postgres_engine, statement_timeout
+from plenario.server import create_app
+
+
+class TestFetchAll(unittest.TestCase):
+
+    def test_rows_in_order(self):
+        rows = fetch_all([select([1]), select([2])], max_workers=2)
+        self.assertEqual([r[0][0] for r in rows], [1, 2])
+
+    def test_statement_timeout(self):
+        with self.assertRaises(OperationalError):
+            fetch_all([select([func.pg_sleep(5)])], timeout=100)
+
+    def test_abandoned_queries_are_cancelled(self):
+        start = time.time()
+        with self.assertRaises(QueryAbandoned):
+            fetch_all([select([func.pg_sleep(30)])], abandoned=lambda: True, poll=0.1)
+        self.assertLess(time.time() - start, 10)
+
+
+class TestRoutingSession(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app()
+
+    def test_primary_without_replica(self):
+        self.app.config['REPLICA_MODULES'] = ['plenario.api.point']
+        with self.app.test_request_context('/v1/api/detail'):
+            session = RoutingSession(bind=postgres_engine)
+            self.assertIs(session.get_bind(), postgres_engine)
+            session.close()
+
+    def test_only_selects_go_to_the_replica(self):
+        replica = object()
+        session = RoutingSession(bind=postgres_engine)
+        session.replica = replica
+        things = table('things', column('x'))
+        try:
+            self.assertIs(session.get_bind(clause=select([things.c.x])), replica)
+            self.assertIs(session.get_bind(clause=things.update().values(x=1)), postgres_engine)
+            self.assertIs(session.get_bind(), postgres_engine)
+        finally:
+            session.replica = None
+            session.close()
+
+    def test_outside_of_requests(self):
+        session = RoutingSession(bind=postgres_engine)
+        self.assertIsNone(session.replica)
+        session.close()
+
+
+class TestStatementTimeout(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app()
+
+    def test_api_requests_are_limited(self):
+        with self.app.test_request_context('/v1/api/detail'):
+            self.assertEqual(statement_timeout(), self.app.config['STATEMENT_TIMEOUT'])
+        with self.app.test_request_context('/v1/api/timeseries'):
+            self.assertEqual(statement_timeout(), self.app.config['STATEMENT_TIMEOUTS']['api.timeseries'])
+
+    def test_admin_views_are_not_limited(self):
+        with self.app.test_request_context('/admin/view-datasets'):
+            self.assertEqual(statement_timeout(), 0)
+        self.assertEqual(statement_timeout(), 0)
+
+
+class _Connection(object):
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestInstrumentedQueuePool(unittest.TestCase):
+
+    def setUp(self):
+        self.observed = []
+        pool_observers.append(self.observe)
+
+    def tearDown(self):
+        pool_observers.remove(self.observe)
+
+    def observe(self, *args):
+        self.observed.append(args)
+
+    def test_checkouts_are_observed(self):
+        pool = InstrumentedQueuePool(lambda: _Connection(), pool_size=1, max_overflow=0,
+                                     timeout=0.1, logging_name='test')
+        first = pool.connect()
+        with self.assertRaises(PoolTimeout):
+            pool.connect()
+        first.close()
+
+        name, waited, checked_out, capacity, timed_out = self.observed[-1]
+        self.assertEqual(name, 'test')
+        self.assertGreaterEqual(waited, 0.1)
+        self.assertEqual((checked_out, capacity), (1, 1))
+        self.assertTrue(timed_out)
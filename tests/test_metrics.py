@@ -0,0 +1,23 @@
+import unittest
+from uuid import uuid4
+
+from plenario import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        pool = str(uuid4())
+        metrics.inc('plenario_pool_timeouts_total', pool=pool)
+        metrics.inc('plenario_pool_timeouts_total', pool=pool)
+        self.assertIn('plenario_pool_timeouts_total{{pool="{}"}} 2'.format(pool), metrics.render())
+
+    def test_histogram(self):
+        pool = str(uuid4())
+        metrics.observe('plenario_pool_wait_seconds', 0.02, pool=pool)
+        metrics.observe('plenario_pool_wait_seconds', 3, pool=pool)
+        rendered = metrics.render()
+        self.assertIn('plenario_pool_wait_seconds_bucket{{pool="{}",le="0.01"}} 0'.format(pool), rendered)
+        self.assertIn('plenario_pool_wait_seconds_bucket{{pool="{}",le="0.025"}} 1'.format(pool), rendered)
+        self.assertIn('plenario_pool_wait_seconds_bucket{{pool="{}",le="+Inf"}} 2'.format(pool), rendered)
+        self.assertIn('plenario_pool_wait_seconds_count{{pool="{}"}} 2'.format(pool), rendered)
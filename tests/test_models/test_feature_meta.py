@@ -5,6 +5,7 @@ from sqlalchemy.exc import ProgrammingError, IntegrityError, InvalidRequestError
 from plenario.database import redshift_engine
 from plenario.database import postgres_session as postgres_session
 from plenario.models.SensorNetwork import NetworkMeta, FeatureMeta
+from plenario.sensor_network.redshift_ops import feature_table, forget_feature_table
 
 
 session = postgres_session()
@@ -60,6 +61,19 @@ class TestFeatureMeta(unittest.TestCase):
         feature.mirror()
         self.assert_(redshift_table_exists('test__foo'))
 
+    def test_feature_table_is_reflected_once(self):
+        """Runs after test_feature_meta_mirror, which creates the table."""
+
+        table = feature_table('test__foo')
+        self.assertIn('bar', table.c)
+        self.assertIs(feature_table('test__foo'), table)
+
+        forget_feature_table('test__foo')
+        self.assertIsNot(feature_table('test__foo'), table)
+
+        with self.assertRaises(KeyError):
+            feature_table('test__not_a_feature')
+
     @classmethod
     def tearDownClass(cls):
 
@@ -0,0 +1,78 @@
+import time
+
+from sqlalchemy import event
+
+from plenario import registry
+from plenario.database import postgres_engine, postgres_session
+from plenario.models import MetaTable, ShapeMetadata
+from plenario.settings import REGISTRY_CHANNEL
+from tests.fixtures.base_test import BasePlenarioTest
+
+
+class TestRegistry(BasePlenarioTest):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestRegistry, cls).setUpClass()
+        super(TestRegistry, cls).ingest_points()
+
+    def test_lookups_run_no_queries(self):
+        registry.points()
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(postgres_engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual(MetaTable.get_by_dataset_name('flu_shot_clinics').dataset_name, 'flu_shot_clinics')
+            self.assertIsNone(MetaTable.get_by_dataset_name('not_a_dataset'))
+            self.assertIn('landmarks', MetaTable.index())
+        finally:
+            event.remove(postgres_engine, 'before_cursor_execute', count)
+
+        self.assertEqual(statements, [])
+
+    def test_commit_invalidates(self):
+        self.assertIsNone(ShapeMetadata.get_by_dataset_name('registry_test'))
+
+        ShapeMetadata.add(human_name='Registry Test', source_url=None, approved_status=False,
+                          update_freq='yearly')
+        postgres_session.commit()
+        try:
+            self.assertIsNotNone(ShapeMetadata.get_by_dataset_name('registry_test'))
+        finally:
+            postgres_session.query(ShapeMetadata).filter(ShapeMetadata.dataset_name == 'registry_test').delete()
+            postgres_session.commit()
+
+        self.assertIsNone(ShapeMetadata.get_by_dataset_name('registry_test'))
+
+    def test_invalidation_reaches_other_processes(self):
+        registry.points()
+        # Stand in for another process publishing a change
+        registry._redis.publish(REGISTRY_CHANNEL, 'invalidate')
+
+        deadline = time.time() + 5
+        while registry._snapshot is not None and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertIsNone(registry._snapshot)
+
+    def test_expired_while_loading_is_not_kept(self):
+        registry.expire()
+        expired = []
+
+        def expire_once(*args):
+            # Stand in for an invalidation arriving in the middle of the load
+            if not expired:
+                expired.append(True)
+                registry.expire()
+
+        event.listen(postgres_engine, 'before_cursor_execute', expire_once)
+        try:
+            self.assertIn('flu_shot_clinics', registry.points())
+        finally:
+            event.remove(postgres_engine, 'before_cursor_execute', expire_once)
+        self.assertIsNone(registry._snapshot)
+
+        registry.points()
+        self.assertIsNotNone(registry._snapshot)
@@ -309,6 +309,26 @@ class TestSensorNetworks(unittest.TestCase):
         received_number_of_objects = len(json.loads(response.get_data().decode('utf-8'))['objects'])
         self.assertEqual(expected_number_of_objects, received_number_of_objects)
 
+    def test_sensor_network_download_ndjson(self):
+        url = "/v1/api/sensor-networks/test_network/download?" \
+              "start_datetime=2016-10-01T00:00:00" \
+              "&data_type=ndjson" \
+              "&nodes=test_node"
+        response = self.app.get(url)
+
+        lines = response.get_data().decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 900)
+        self.assertEqual(json.loads(lines[0])['node_id'], 'test_node')
+
+    def test_query_endpoint_geojsonseq(self):
+        url = "/v1/api/sensor-networks/test_network/query?nodes=test_node"
+        url += "&feature=vector&start_datetime=2016-10-01&end_datetime=2016-10-03&data_type=geojsonseq"
+        response = self.app.get(url)
+
+        records = response.get_data().decode('utf-8').split('\x1e')[1:]
+        self.assertEqual(len(records), 200)
+        self.assertEqual(json.loads(records[0])['geometry']['type'], 'Point')
+
     def test_sensor_network_download_csv_with_feature_filter(self):
         url = "/v1/api/sensor-networks/test_network/download?" \
               "start_datetime=2016-10-01T00:00:00&"            \
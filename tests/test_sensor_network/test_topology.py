@@ -0,0 +1,51 @@
+import unittest
+
+from plenario.sensor_network.topology import Topology
+
+
+class TestTopology(unittest.TestCase):
+
+    def setUp(self):
+        self.topology = Topology(
+            networks=['Test_Network', 'other_network'],
+            nodes=[('Test_Network', 'node_a'), ('Test_Network', 'node_b'), ('other_network', 'node_c')],
+            sensors=[
+                ('tmp001', {'howhot': 'temperature.temperature'}),
+                ('vec001', {'vec_x': 'vector.x', 'vec_y': 'vector.y'}),
+            ],
+            links=[
+                ('Test_Network', 'node_a', 'tmp001'),
+                ('Test_Network', 'node_a', 'vec001'),
+                ('Test_Network', 'node_b', 'tmp001'),
+                ('other_network', 'node_c', 'vec001'),
+                ('other_network', 'node_c', 'missing_sensor'),
+            ],
+            feature_networks=[('temperature', 'Test_Network'), ('vector', 'other_network')]
+        )
+
+    def test_tree(self):
+        self.assertEqual(self.topology.tree('Test_Network'), {
+            'node_a': {
+                'tmp001': {'howhot': 'temperature.temperature'},
+                'vec001': {'vec_x': 'vector.x', 'vec_y': 'vector.y'}
+            },
+            'node_b': {'tmp001': {'howhot': 'temperature.temperature'}}
+        })
+        self.assertEqual(self.topology.tree('not_a_network'), {})
+
+    def test_sensors_and_features_of_a_network(self):
+        self.assertEqual(self.topology.sensors('other_network'), {'vec001'})
+        self.assertEqual(self.topology.features('Test_Network'), {'temperature', 'vector'})
+
+    def test_reverse_maps(self):
+        self.assertEqual(self.topology.sensors_of('temperature'), {'tmp001'})
+        self.assertEqual(self.topology.sensors_of('vector'), {'vec001'})
+        self.assertEqual(self.topology.nodes_of('vec001'),
+                         {('Test_Network', 'node_a'), ('other_network', 'node_c')})
+
+    def test_indexes(self):
+        self.assertEqual(sorted(self.topology.network_index()), ['other_network', 'test_network'])
+        self.assertEqual(self.topology.node_index('Test_Network'), ['node_a', 'node_b'])
+        self.assertEqual(sorted(self.topology.node_index()), ['node_a', 'node_b', 'node_c'])
+        self.assertEqual(sorted(self.topology.feature_index('test_network')), ['temperature', 'vector'])
+        self.assertEqual(self.topology.sensor_index('other_network'), ['vec001'])
@@ -6,3 +6,14 @@ class TestHelpers(unittest.TestCase):
     def test_slugify(self):
         from plenario.utils.helpers import slugify
         self.assertEqual(slugify("A-Awef-Basdf-123"), "a_awef_basdf_123")
+
+    def test_reflect_reuses_tables_of_the_same_version(self):
+        from plenario.database import postgres_engine
+        from plenario.utils.helpers import forget_reflection, reflect
+        first = reflect('meta_master', postgres_engine, version=1)
+        self.assertIs(reflect('meta_master', postgres_engine, version=1), first)
+        self.assertIsNot(reflect('meta_master', postgres_engine, version=2), first)
+
+        second = reflect('meta_master', postgres_engine, version=2)
+        forget_reflection('meta_master')
+        self.assertIsNot(reflect('meta_master', postgres_engine, version=2), second)
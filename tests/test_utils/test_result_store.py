@@ -0,0 +1,29 @@
+import shutil
+import tempfile
+import unittest
+
+from plenario.utils.result_store import FileResultStore
+
+
+class TestFileResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = FileResultStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_record_round_trip(self):
+        self.store.put_record('ticket', {'queueTime': 'now'})
+        self.assertEqual(self.store.get_record('ticket'), {'queueTime': 'now'})
+
+    def test_chunk_round_trip(self):
+        self.store.put_chunk('ticket', 0, b'first')
+        self.store.put_chunk('ticket', 1, b'second')
+        self.assertEqual(self.store.get_chunk('ticket', 0), b'first')
+        self.assertEqual(self.store.get_chunk('ticket', 1), b'second')
+
+    def test_missing(self):
+        self.assertIsNone(self.store.get_record('nope'))
+        self.assertIsNone(self.store.get_chunk('nope', 0))